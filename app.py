@@ -4,27 +4,61 @@
 
 import os
 
-from flask import Flask, request, abort, jsonify
+from flask import Flask, Response, request, abort, jsonify
 from flask_cors import CORS
 from models import setup_db, Movie, Actor, db
 from auth import AuthError, requires_auth
-
-
-def create_app():
+from ratelimit import AdmissionError, admission_stats
+from pagination import (
+    MAX_PAGE_SIZE, paginate, order_by_sort, get_page_args, encode_cursor
+)
+from streaming import stream_list, wants_stream
+from fieldsets import get_fields, select_fields
+from filters import filter_movies, filter_actors, get_sort
+from pool import pool_stats
+from etags import conditional
+from cache import cached, RESPONSE_CACHE
+from replicas import use_replica
+from search import get_search_args, search, search_cursor
+from export import stream_export
+from importer import IMPORT_ENABLED, upload
+from stats import actor_stats, list_movie_stats, movie_stats, summarize
+from serialization import JSON_PROVIDER, list_response
+from metrics import METRICS_ENABLED, setup_metrics
+from compression import COMPRESSION_ENABLED, setup_compression
+from diagnostics import query_budget
+from bulk import (
+    get_records, validate_records, validate_movie, validate_actor,
+    validate_movie_ids, bulk_errors, bulk_insert, parse_date, get_batch,
+    validate_movie_patch, validate_actor_patch, batch_update, batch_delete,
+    batch_result, update_one
+)
+
+
+def create_app(database_path=None, replica_paths=None):
     """
         Create and configure the app
 
         Args:
-            None
+            database_path: the primary database url, DATABASE_URL by default
+            replica_paths: the replica database urls,
+                DATABASE_REPLICA_URLS by default
 
         Returns:
             app: the created app
     """
     app = Flask(__name__)
+    app.json = JSON_PROVIDER(app)
+
+    if METRICS_ENABLED:
+        setup_metrics(app)
 
-    setup_db(app)
+    setup_db(app, database_path, replica_paths)
     CORS(app)
 
+    if COMPRESSION_ENABLED:
+        setup_compression(app)
+
     @app.after_request
     def after_request(response):
         """
@@ -48,10 +82,16 @@ def create_app():
         return response
 
     @app.route("/movies", methods=["GET"])
+    @query_budget(3)
     @requires_auth("get:movie")
+    @use_replica
+    @conditional("movies", "actors")
+    @cached("movies", "actors")
     def get_movies(payload):
         """
-            Get all movies
+            Get all movies, or a page of them when limit or cursor is given,
+            with only the fields listed in the fields parameter if any,
+            filtered and sorted by the query parameters
 
             Args:
                 None
@@ -59,17 +99,20 @@ def create_app():
             Returns:
                 jsonify: the response object
         """
-        movies = Movie.query.all()
+        fields = get_fields(Movie)
+        sort = get_sort(Movie)
+        query = filter_movies(Movie.query, Movie)
+        query = select_fields(query, Movie, fields, sort[0])
+
+        if wants_stream():
+            return stream_list("movies", order_by_sort(query, Movie, sort), fields)
+
+        movies, page = paginate(query, Movie, sort)
 
         if movies is None:
             abort(404, "No movies found.")
 
-        movies = list(map(lambda movie: movie.format(), movies))
-
-        return jsonify({
-            "success": True,
-            "movies": movies
-        })
+        return list_response("movies", movies, Movie, fields, **page)
 
     @app.route("/movies", methods=["POST"])
     @requires_auth("post:movie")
@@ -94,6 +137,11 @@ def create_app():
         if title is None or release_date is None:
             abort(400, "Missing information.")
 
+        release_date = parse_date(release_date)
+
+        if release_date is None:
+            abort(400, "Invalid release_date.")
+
         movie = Movie(title=title, release_date=release_date)
 
         movie.insert()
@@ -102,6 +150,63 @@ def create_app():
             "success": True
         })
 
+    @app.route("/movies/bulk", methods=["POST"])
+    @requires_auth("post:movie")
+    def post_movies_bulk(payload):
+        """
+            Post an array of movies in one transaction
+
+            Every record is validated before anything is written, the
+            errors are reported with the index of their record.
+
+            Args:
+                None
+
+            Returns:
+                jsonify: the response object
+        """
+        rows, errors = validate_records(get_records(), validate_movie)
+
+        if errors:
+            return bulk_errors(errors)
+
+        return jsonify({
+            "success": True,
+            "created": bulk_insert(Movie, rows)
+        })
+
+    @app.route("/movies/batch", methods=["PATCH"])
+    @requires_auth("patch:movie")
+    def update_movies_batch(payload):
+        """
+            Apply one patch to many movies with a single UPDATE
+
+            Args:
+                None
+
+            Returns:
+                jsonify: the response object
+        """
+        ids, values = get_batch(validate_movie_patch)
+
+        return batch_result("updated", ids, batch_update(Movie, ids, values))
+
+    @app.route("/movies/batch", methods=["DELETE"])
+    @requires_auth("delete:movie")
+    def delete_movies_batch(payload):
+        """
+            Delete many movies with a single DELETE
+
+            Args:
+                None
+
+            Returns:
+                jsonify: the response object
+        """
+        ids, _ = get_batch()
+
+        return batch_result("deleted", ids, batch_delete(Movie, ids))
+
     @app.route("/movies/<int:movie_id>", methods=["PATCH"])
     @requires_auth("patch:movie")
     def update_movie(payload, movie_id):
@@ -115,26 +220,28 @@ def create_app():
                 jsonify: the response object
         """
 
-        movie_query = Movie.query.get(movie_id)
-
-        if not movie_query:
-            abort(404, "Movie not found.")
-
         request_body = request.get_json()
 
         title = request_body.get("title", None)
         release_date = request_body.get("release_date", None)
+        values = {}
 
         if title:
-            movie_query.title = title
+            values["title"] = title
         if release_date:
-            movie_query.release_date = release_date
+            values["release_date"] = parse_date(release_date)
+
+            if values["release_date"] is None:
+                abort(400, "Invalid release_date.")
+
+        movie = update_one(Movie, movie_id, values)
 
-        movie_query.update()
+        if movie is None:
+            abort(404, "Movie not found.")
 
         return jsonify({
             "success": True,
-            "updated": movie_query.format()
+            "updated": movie
         })
 
     @app.route("/movies/<int:movie_id>", methods=["DELETE"])
@@ -149,23 +256,25 @@ def create_app():
             Returns:
                 jsonify: the response object
         """
-        movie_query = Movie.query.filter(Movie.id == movie_id).one_or_none()
-
-        if movie_query is None:
+        if not batch_delete(Movie, [movie_id]):
             abort(404, f"Movie not found.")
 
-        movie_query.delete()
-
         return jsonify({
             "success": True,
             "deleted": movie_id
         })
 
     @app.route("/actors", methods=["GET"])
+    @query_budget(2)
     @requires_auth("get:actor")
+    @use_replica
+    @conditional("actors")
+    @cached("actors")
     def get_actors(payload):
         """
-            Get all actors
+            Get all actors, or a page of them when limit or cursor is given,
+            with only the fields listed in the fields parameter if any,
+            filtered and sorted by the query parameters
 
             Args:
                 None
@@ -173,13 +282,17 @@ def create_app():
             Returns:
                 jsonify: the response object
         """
-        actors = Actor.query.all()
-        actors = list(map(lambda actor: actor.format(), actors))
+        fields = get_fields(Actor)
+        sort = get_sort(Actor)
+        query = filter_actors(Actor.query, Actor)
+        query = select_fields(query, Actor, fields, sort[0])
 
-        return jsonify({
-            "success": True,
-            "actors": actors
-        })
+        if wants_stream():
+            return stream_list("actors", order_by_sort(query, Actor, sort), fields)
+
+        actors, page = paginate(query, Actor, sort)
+
+        return list_response("actors", actors, Actor, fields, **page)
 
     @app.route("/actors", methods=["POST"])
     @requires_auth("post:actor")
@@ -214,6 +327,65 @@ def create_app():
             "success": True
         })
 
+    @app.route("/actors/bulk", methods=["POST"])
+    @requires_auth("post:actor")
+    def post_actors_bulk(payload):
+        """
+            Post an array of actors in one transaction
+
+            Every record is validated before anything is written, the
+            movies of all records are checked with one query and the
+            errors are reported with the index of their record.
+
+            Args:
+                None
+
+            Returns:
+                jsonify: the response object
+        """
+        rows, errors = validate_records(get_records(), validate_actor)
+        errors = validate_movie_ids(rows, errors)
+
+        if errors:
+            return bulk_errors(errors)
+
+        return jsonify({
+            "success": True,
+            "created": bulk_insert(Actor, rows)
+        })
+
+    @app.route("/actors/batch", methods=["PATCH"])
+    @requires_auth("patch:actor")
+    def update_actors_batch(payload):
+        """
+            Apply one patch to many actors with a single UPDATE
+
+            Args:
+                None
+
+            Returns:
+                jsonify: the response object
+        """
+        ids, values = get_batch(validate_actor_patch)
+
+        return batch_result("updated", ids, batch_update(Actor, ids, values))
+
+    @app.route("/actors/batch", methods=["DELETE"])
+    @requires_auth("delete:actor")
+    def delete_actors_batch(payload):
+        """
+            Delete many actors with a single DELETE
+
+            Args:
+                None
+
+            Returns:
+                jsonify: the response object
+        """
+        ids, _ = get_batch()
+
+        return batch_result("deleted", ids, batch_delete(Actor, ids))
+
     @app.route("/actors/<int:actor_id>", methods=["PATCH"])
     @requires_auth("patch:actor")
     def update_actor(payload, actor_id):
@@ -227,34 +399,22 @@ def create_app():
                 jsonify: the response object
         """
 
-        actor_query = Actor.query.get(actor_id)
-
-        if not actor_query:
-            abort(404, "Actor not found.")
+        values, message = validate_actor_patch(request.get_json(silent=True))
 
-        body = request.get_json()
-        name = body.get("name", None)
-        age = body.get("age", None)
-        gender = body.get("gender", None)
-        movie_id = body.get("movie_id", None)
-
-        if name:
-            actor_query.name = name
-        if age:
-            actor_query.age = age
-        if gender:
-            actor_query.gender = gender
-        if movie_id:
-            actor_query.movie_id = movie_id
+        if message is not None:
+            abort(400, message)
 
         try:
-            actor_query.update()
+            actor = update_one(Actor, actor_id, values)
         except BaseException:
             abort(400, "Invalid request.")
 
+        if actor is None:
+            abort(404, "Actor not found.")
+
         return jsonify({
             "success": True,
-            "updated": actor_query.format()
+            "updated": actor
         })
 
     @app.route("/actors/<int:actor_id>", methods=["DELETE"])
@@ -269,18 +429,264 @@ def create_app():
             Returns:
                 jsonify: the response object
         """
-        actor_query = Actor.query.filter(Actor.id == actor_id).one_or_none()
-
-        if actor_query is None:
+        if not batch_delete(Actor, [actor_id]):
             abort(404, "Actor not found.")
 
-        actor_query.delete()
-
         return jsonify({
             "success": True,
             "deleted": actor_id
         })
 
+    @app.route("/search", methods=["GET"])
+    @query_budget(2)
+    @requires_auth("get:movie")
+    @use_replica
+    @conditional("movies", "actors")
+    @cached("movies", "actors")
+    def get_search(payload):
+        """
+            Search movie titles, and actor names when the caller may read
+            actors, best matches first, one page at a time
+
+            Args:
+                None
+
+            Returns:
+                jsonify: the response object
+        """
+        terms, limit, after = get_search_args()
+        models = [Movie]
+
+        if "get:actor" in payload["permissions"]:
+            models.append(Actor)
+
+        try:
+            rows = search(db.session, models, terms, limit + 1, after)
+        except NotImplementedError as error:
+            abort(501, str(error))
+
+        labels = {model.search_kind: model.search_field for model in models}
+
+        return jsonify({
+            "success": True,
+            "results": [
+                {"type": kind, "id": row_id, labels[kind]: label, "rank": score}
+                for kind, row_id, label, score in rows[:limit]
+            ],
+            "next_cursor": search_cursor(rows, limit)
+        })
+
+    @app.route("/export/movies", methods=["GET"])
+    @requires_auth("get:movie")
+    @use_replica
+    def export_movies(payload):
+        """
+            Stream every movie as NDJSON or CSV, by id
+
+            Args:
+                None
+
+            Returns:
+                Response: the streamed response
+        """
+        return stream_export(Movie)
+
+    @app.route("/export/actors", methods=["GET"])
+    @requires_auth("get:actor")
+    @use_replica
+    def export_actors(payload):
+        """
+            Stream every actor as NDJSON or CSV, by id
+
+            Args:
+                None
+
+            Returns:
+                Response: the streamed response
+        """
+        return stream_export(Actor)
+
+    @app.route("/stats/actors", methods=["GET"])
+    @query_budget(2)
+    @requires_auth("get:actor")
+    @use_replica
+    @conditional("actors")
+    @cached("actors")
+    def get_actor_stats(payload):
+        """
+            Get the actor count, gender split and age histogram of every
+            actor, from the precomputed aggregates
+
+            Args:
+                None
+
+            Returns:
+                jsonify: the response object
+        """
+        return jsonify({
+            "success": True,
+            "stats": actor_stats()
+        })
+
+    @app.route("/stats/movies", methods=["GET"])
+    @query_budget(3)
+    @requires_auth("get:actor")
+    @use_replica
+    @conditional("actors")
+    @cached("actors")
+    def get_movies_stats(payload):
+        """
+            Get the statistics of the cast of each movie with actors, by
+            page of movie ids
+
+            Args:
+                None
+
+            Returns:
+                jsonify: the response object
+        """
+        limit, after = get_page_args() or (MAX_PAGE_SIZE, None)
+        stats, more = list_movie_stats(limit, after and after["id"])
+
+        return jsonify({
+            "success": True,
+            "movies": stats,
+            "next_cursor": encode_cursor(stats[-1]["movie_id"]) if more else None
+        })
+
+    @app.route("/stats/movies/<int:movie_id>", methods=["GET"])
+    @query_budget(3)
+    @requires_auth("get:actor")
+    @use_replica
+    @conditional("actors")
+    @cached("actors")
+    def get_movie_stats(payload, movie_id):
+        """
+            Get the actor count, gender split and age histogram of the
+            cast of a movie
+
+            Args:
+                movie_id: the id of the movie
+
+            Returns:
+                jsonify: the response object
+        """
+        stats = movie_stats([movie_id]).get(movie_id)
+
+        if stats is None:
+            if Movie.query.with_entities(Movie.id).filter_by(id=movie_id).first() is None:
+                abort(404, "Movie not found.")
+
+            stats = summarize([])
+
+        return jsonify({
+            "success": True,
+            "stats": dict(stats, movie_id=movie_id)
+        })
+
+    @app.route("/health/pool", methods=["GET"])
+    @requires_auth("get:health")
+    def get_pool_stats(payload):
+        """
+            Get the statistics of the database connection pool
+
+            Args:
+                None
+
+            Returns:
+                jsonify: the response object
+        """
+        return jsonify({
+            "success": True,
+            "pool": pool_stats(db.session.get_bind())
+        })
+
+    @app.route("/health/cache", methods=["GET"])
+    @requires_auth("get:health")
+    def get_cache_stats(payload):
+        """
+            Get the statistics of the response cache
+
+            Args:
+                None
+
+            Returns:
+                jsonify: the response object
+        """
+        return jsonify({
+            "success": True,
+            "cache": RESPONSE_CACHE.stats()
+        })
+
+    @app.route("/health/admission", methods=["GET"])
+    @requires_auth("get:health")
+    def get_admission_stats(payload):
+        """
+            Get the statistics of the rate and concurrency limits
+
+            Args:
+                None
+
+            Returns:
+                jsonify: the response object
+        """
+        return jsonify({
+            "success": True,
+            "admission": admission_stats()
+        })
+
+    if IMPORT_ENABLED:
+        @app.route("/import/movies", methods=["POST"])
+        @requires_auth("post:movie")
+        def import_movies(payload):
+            """
+                Import the movies of an NDJSON or CSV file
+
+                Args:
+                    None
+
+                Returns:
+                    jsonify: the response object
+            """
+            return upload(Movie)
+
+        @app.route("/import/actors", methods=["POST"])
+        @requires_auth("post:actor")
+        def import_actors(payload):
+            """
+                Import the actors of an NDJSON or CSV file
+
+                Args:
+                    None
+
+                Returns:
+                    jsonify: the response object
+            """
+            return upload(Actor)
+
+    if METRICS_ENABLED:
+        @app.route("/metrics", methods=["GET"])
+        @requires_auth("get:health")
+        def get_metrics(payload):
+            """
+                Get the request metrics of this process, with the pool and
+                response cache statistics, in the Prometheus text format
+
+                Args:
+                    None
+
+                Returns:
+                    Response: the response object
+            """
+            return Response(
+                app.extensions["metrics"].render({
+                    "pool": pool_stats(db.session.get_bind()),
+                    "response_cache": RESPONSE_CACHE.stats(),
+                    "admission": admission_stats()
+                }),
+                mimetype="text/plain; version=0.0.4"
+            )
+
     # @app.route("/authentification/url", methods=["GET"])
     # def get_authentification_url():
     #     """
@@ -370,6 +776,74 @@ def create_app():
             "message": set_error_message(error, "Bad request.")
         }), 400
 
+    @app.errorhandler(406)
+    def not_acceptable(error):
+        """
+            Handle not acceptable error
+
+            Args:
+                error: the error object
+
+            Returns:
+                jsonify: the response object
+        """
+        return jsonify({
+            "success": False,
+            "error": 406,
+            "message": set_error_message(error, "Not acceptable.")
+        }), 406
+
+    @app.errorhandler(415)
+    def unsupported_media_type(error):
+        """
+            Handle unsupported media type error
+
+            Args:
+                error: the error object
+
+            Returns:
+                jsonify: the response object
+        """
+        return jsonify({
+            "success": False,
+            "error": 415,
+            "message": set_error_message(error, "Unsupported media type.")
+        }), 415
+
+    @app.errorhandler(501)
+    def not_implemented(error):
+        """
+            Handle not implemented error
+
+            Args:
+                error: the error object
+
+            Returns:
+                jsonify: the response object
+        """
+        return jsonify({
+            "success": False,
+            "error": 501,
+            "message": set_error_message(error, "Not implemented.")
+        }), 501
+
+    @app.errorhandler(AdmissionError)
+    def admission_error(err):
+        """
+            Handle a request refused by the admission control
+
+            Args:
+                err: the error object
+
+            Returns:
+                jsonify: the response object, with Retry-After
+        """
+        return jsonify({
+            "success": False,
+            "error": err.status_code,
+            "message": err.description
+        }), err.status_code, {"Retry-After": str(err.retry_after)}
+
     @app.errorhandler(AuthError)
     def auth_error(err):
         """
@@ -0,0 +1,305 @@
+"""
+    File for serving the app over ASGI with an async database engine
+
+    uvicorn asgi:ASGI_APP
+
+    Each request runs the Flask app, so the routes, hooks and error
+    handlers are the same as over WSGI, but its session is the sync
+    facade of an AsyncSession: every statement awaits the async driver
+    instead of blocking, and one process holds many requests in flight.
+"""
+
+import sys
+
+from io import BytesIO
+from jose import jwt
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.util import greenlet_spawn
+import auth
+from app import create_app
+from models import DATABASE_PATH, db
+from pool import engine_options
+from ratelimit import CONCURRENCY_LIMITER, ConcurrencyLimiter
+
+
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite"
+}
+
+
+def async_url(database_url):
+    """
+        Switch a database url to the asyncio driver of its database
+
+        Args:
+            database_url: The database url
+
+        Returns:
+            str: The url, unchanged when its driver is already async
+    """
+    url = make_url(database_url)
+
+    if url.get_dialect().is_async:
+        return database_url
+
+    return url.set(
+        drivername=ASYNC_DRIVERS[url.get_backend_name()]
+    ).render_as_string(hide_password=False)
+
+
+def build_environ(scope, body):
+    """
+        Build the WSGI environ of an ASGI HTTP request
+
+        Args:
+            scope: The ASGI scope
+            body: The request body
+
+        Returns:
+            dict: The environ
+    """
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client")
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode().decode("latin-1"),
+        "PATH_INFO": scope["path"].encode().decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": False,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False
+    }
+
+    if client:
+        environ["REMOTE_ADDR"] = client[0]
+
+    for name, value in scope["headers"]:
+        name = name.decode("latin-1")
+
+        if name == "content-length":
+            continue
+
+        key = "CONTENT_TYPE" if name == "content-type" else (
+            "HTTP_" + name.upper().replace("-", "_")
+        )
+        value = value.decode("latin-1")
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+
+    return environ
+
+
+async def read_body(receive):
+    """
+        Read the whole body of an ASGI HTTP request
+
+        Args:
+            receive: The ASGI receive callable
+
+        Returns:
+            bytes: The body
+    """
+    chunks = []
+
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+async def prefetch_key(environ):
+    """
+        Load the signing key of the request token without blocking
+
+        The sync verification in requires_auth then finds the key in
+        memory. Malformed tokens are left to it to reject.
+
+        Args:
+            environ: The WSGI environ
+
+        Returns:
+            None
+    """
+    parts = environ.get("HTTP_AUTHORIZATION", "").split()
+
+    if len(parts) != 2 or parts[0].lower() != "bearer":
+        return
+
+    try:
+        kid = jwt.get_unverified_header(parts[1]).get("kid")
+    except jwt.JWTError:
+        return
+
+    if kid is None:
+        return
+
+    try:
+        await auth.JWKS_STORE.get_key_async(kid)
+    except Exception:
+        pass
+
+
+class ASGIApp:
+    """
+        ASGI application running a Flask app on an async engine
+    """
+    def __init__(self, app, engine):
+        """
+            Constructor for ASGIApp
+
+            Args:
+                app: The Flask app
+                engine: The AsyncEngine of the app database
+
+            Returns:
+                None
+        """
+        self.app = app
+        self.engine = engine
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self.http(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.engine.dispose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def http(self, scope, receive, send):
+        environ = build_environ(scope, await read_body(receive))
+        await prefetch_key(environ)
+
+        async with AsyncSession(self.engine) as session:
+            context, status, headers, body = await greenlet_spawn(
+                self.start, session.sync_session, environ
+            )
+            chunks = iter(body)
+
+            try:
+                await send({
+                    "type": "http.response.start",
+                    "status": status,
+                    "headers": headers
+                })
+
+                while True:
+                    chunk = await greenlet_spawn(next, chunks, None)
+
+                    if chunk is None:
+                        break
+
+                    if chunk:
+                        await send({
+                            "type": "http.response.body",
+                            "body": chunk,
+                            "more_body": True
+                        })
+
+                await send({"type": "http.response.body", "body": b""})
+            finally:
+                await greenlet_spawn(self.finish, context, body)
+
+    def start(self, session, environ):
+        """
+            Run the Flask app up to its response headers
+
+            Runs in a greenlet, where session statements await the async
+            driver.
+
+            Args:
+                session: The sync session of the request AsyncSession
+                environ: The WSGI environ
+
+            Returns:
+                tuple: The app context, the status, the headers and the
+                    body iterable
+        """
+        context = self.app.app_context()
+        context.push()
+        db.session.registry.set(session)
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started["status"] = int(status.split(" ", 1)[0])
+            started["headers"] = [
+                (name.lower().encode("latin-1"), value.encode("latin-1"))
+                for name, value in headers
+            ]
+
+        try:
+            body = self.app.wsgi_app(environ, start_response)
+        except BaseException:
+            context.pop()
+            raise
+
+        return context, started["status"], started["headers"], body
+
+    def finish(self, context, body):
+        """
+            Close the body and the app context, releasing the session
+
+            Args:
+                context: The app context pushed by start
+                body: The body iterable
+
+            Returns:
+                None
+        """
+        try:
+            if hasattr(body, "close"):
+                body.close()
+        finally:
+            context.pop()
+
+
+def create_asgi_app(database_path=None):
+    """
+        Create the ASGI app
+
+        Args:
+            database_path: The database url, DATABASE_URL by default
+
+        Returns:
+            ASGIApp: The app
+    """
+    database_path = database_path or DATABASE_PATH
+    engine = create_async_engine(
+        async_url(database_path),
+        **engine_options(database_path, asynchronous=True)
+    )
+
+    app = create_app(database_path, replica_paths=[])
+
+    # Requests share the event loop thread, where one waiting for a
+    # concurrency slot would block the requests holding them.
+    app.extensions["concurrency_limiter"] = ConcurrencyLimiter(
+        CONCURRENCY_LIMITER.limit, wait=0
+    )
+
+    with app.app_context():
+        db.create_all(bind_key=None)
+
+    return ASGIApp(app, engine)
+
+
+ASGI_APP = create_asgi_app()
@@ -3,17 +3,30 @@
 """
 
 import os
+import re
 import json
+import time
+import asyncio
+import hashlib
+import threading
 
-from flask import request
+from collections import OrderedDict
+
+from flask import g, make_response, request
 from functools import wraps
-from jose import jwt
+from jose import jwk, jwt
 from urllib.request import urlopen
+from metrics import Phase
+from ratelimit import concurrency_limiter, rate_limit
 
 
 AUTH0_DOMAIN = os.environ["AUTH0_DOMAIN"]
 ALGORITHMS = [os.environ["ALGORITHMS"]]
 API_AUDIENCE = os.environ["API_AUDIENCE"]
+JWKS_URL = os.environ.get(
+    "JWKS_URL",
+    f"https://{AUTH0_DOMAIN}/.well-known/jwks.json"
+)
 
 
 class AuthError(Exception):
@@ -80,11 +93,224 @@ def check_permissions(permission, payload):
 
     return True
 
+def parse_max_age(cache_control, default):
+    """
+        Read the max-age directive of a Cache-Control header
+
+        Args:
+            cache_control: The Cache-Control header value, or None
+            default: The value to use when there is no max-age
+
+        Returns:
+            int: The max-age in seconds
+    """
+    if not cache_control:
+        return default
+
+    if re.search(r"\bno-(cache|store)\b", cache_control):
+        return 0
+
+    match = re.search(r"\bmax-age=(\d+)", cache_control)
+
+    if match is None:
+        return default
+
+    return int(match.group(1))
+
+
+class JWKSStore:
+    """
+        Cache for the JSON Web Key Set of the token issuer
+
+        Keys are kept as parsed key objects until the max-age of the
+        JWKS response runs out. An unknown kid triggers a refresh, at
+        most once every min_refresh_interval seconds. Concurrent
+        refreshes are collapsed into a single fetch, and the last known
+        keys keep being served when a fetch fails.
+    """
+    def __init__(self, url, default_ttl=600, min_refresh_interval=30,
+                 timeout=5, clock=time.monotonic):
+        """
+            Constructor for JWKSStore
+
+            Args:
+                url: The JWKS url
+                default_ttl: Seconds to keep the keys without Cache-Control
+                min_refresh_interval: Minimum seconds between two fetches
+                    triggered by unknown kids or failed fetches
+                timeout: Timeout in seconds of a fetch
+                clock: Monotonic clock, replaceable in tests
+
+            Returns:
+                None
+        """
+        self.url = url
+        self.default_ttl = default_ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self.clock = clock
+
+        self._keys = {}
+        self._expires_at = 0.0
+        self._last_attempt = None
+        self._stale = False
+        self._generation = 0
+        self._refresh_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "refreshes": 0,
+            "refresh_failures": 0,
+            "stale_hits": 0
+        }
+
+    @property
+    def stats(self):
+        """
+            Counters of the store
+
+            Args:
+                None
+
+            Returns:
+                dict: A copy of the counters
+        """
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def get_key(self, kid):
+        """
+            Get the parsed public key for a kid
+
+            Args:
+                kid: The key id from the token header
+
+            Returns:
+                Key: The key, or None when the issuer does not know it
+        """
+        generation = self._generation
+        now = self.clock()
+        key = self._keys.get(kid)
+
+        if key is not None and now < self._expires_at:
+            self._count("stale_hits" if self._stale else "hits")
+            return key
+
+        self._count("misses")
+
+        if now >= self._expires_at or self._may_refresh(now):
+            self.refresh(generation)
+
+        return self._keys.get(kid)
+
+    async def get_key_async(self, kid):
+        """
+            Get the parsed public key for a kid without blocking the
+            event loop
+
+            Cached keys are returned directly, a fetch runs in the
+            default executor.
+
+            Args:
+                kid: The key id from the token header
+
+            Returns:
+                Key: The key, or None when the issuer does not know it
+        """
+        key = self._keys.get(kid)
+
+        if key is not None and self.clock() < self._expires_at:
+            return self.get_key(kid)
+
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.get_key, kid
+        )
+
+    def _may_refresh(self, now):
+        return (
+            self._last_attempt is None
+            or now - self._last_attempt >= self.min_refresh_interval
+        )
+
+    def refresh(self, generation=None):
+        """
+            Fetch the key set, unless another thread already did it
+
+            Args:
+                generation: The generation seen by the caller, a refresh
+                    finished since then makes this call a no-op
+
+            Returns:
+                None
+        """
+        if generation is None:
+            generation = self._generation
+
+        with self._refresh_lock:
+            if self._generation != generation:
+                return
+
+            now = self.clock()
+            self._last_attempt = now
+
+            try:
+                keys, ttl = self._fetch()
+            except Exception:
+                self._count("refresh_failures")
+                self._generation += 1
+
+                if not self._keys:
+                    raise
+
+                self._stale = True
+                self._expires_at = now + self.min_refresh_interval
+                return
+
+            self._keys = keys
+            self._stale = False
+            self._expires_at = now + ttl
+            self._generation += 1
+            self._count("refreshes")
+
+    def _fetch(self):
+        with urlopen(self.url, timeout=self.timeout) as response:
+            jwks = json.loads(response.read())
+            ttl = parse_max_age(
+                response.headers.get("Cache-Control"),
+                self.default_ttl
+            )
+
+        keys = {}
+
+        for key in jwks["keys"]:
+            if key.get("kty") != "RSA" or key.get("use", "sig") != "sig":
+                continue
+
+            keys[key["kid"]] = jwk.construct({
+                "kty": key["kty"],
+                "kid": key["kid"],
+                "use": key.get("use", "sig"),
+                "n": key["n"],
+                "e": key["e"]
+            }, key.get("alg", ALGORITHMS[0]))
+
+        return keys, ttl
+
+
+JWKS_STORE = JWKSStore(
+    JWKS_URL,
+    default_ttl=int(os.environ.get("JWKS_TTL", 600)),
+    min_refresh_interval=int(os.environ.get("JWKS_MIN_REFRESH_INTERVAL", 30))
+)
+
+
 def verify_decode_jwt(token):
-    jsonurl = urlopen(f"https://{AUTH0_DOMAIN}/.well-known/jwks.json")
-    jwks = json.loads(jsonurl.read())
     unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
 
     if "kid" not in unverified_header:
         raise AuthError({
@@ -92,15 +318,7 @@ def verify_decode_jwt(token):
             "description": "Authorization malformed."
         }, 401)
 
-    for key in jwks["keys"]:
-        if key["kid"] == unverified_header["kid"]:
-            rsa_key = {
-                "kty": key["kty"],
-                "kid": key["kid"],
-                "use": key["use"],
-                "n": key["n"],
-                "e": key["e"]
-            }
+    rsa_key = JWKS_STORE.get_key(unverified_header["kid"])
 
     if rsa_key:
         try:
@@ -145,22 +363,188 @@ def verify_decode_jwt(token):
         "description": message
     }, 400)
 
+class TokenCache:
+    """
+        Bounded LRU cache of verified token payloads
+
+        Entries are keyed by a SHA-256 digest of the token, so raw
+        tokens are never kept, and expire at the exp claim of the token
+        or after max_ttl seconds, whichever comes first.
+    """
+    def __init__(self, max_size=1024, max_ttl=300, clock=time.time):
+        """
+            Constructor for TokenCache
+
+            Args:
+                max_size: The maximum number of payloads, 0 disables the cache
+                max_ttl: The maximum number of seconds to keep a payload
+                clock: Wall clock returning epoch seconds, replaceable in tests
+
+            Returns:
+                None
+        """
+        self.max_size = max_size
+        self.max_ttl = max_ttl
+        self.clock = clock
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._verify_seconds = 0.0
+
+    @property
+    def stats(self):
+        """
+            Counters of the cache
+
+            The CPU saved is estimated from the mean CPU time of the
+            verifications done on misses.
+
+            Args:
+                None
+
+            Returns:
+                dict: The size, hits, misses, hit ratio and CPU figures
+        """
+        with self._lock:
+            lookups = self._hits + self._misses
+            mean_verify = self._verify_seconds / self._misses if self._misses else 0.0
+
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_ratio": self._hits / lookups if lookups else 0.0,
+                "mean_verify_cpu_seconds": mean_verify,
+                "cpu_saved_seconds": mean_verify * self._hits,
+                "cpu_saved_per_request_seconds": (
+                    mean_verify * self._hits / lookups if lookups else 0.0
+                )
+            }
+
+    def verify(self, token, verify=None):
+        """
+            Get the payload of a token, verifying it on a miss
+
+            Args:
+                token: The bearer token
+                verify: The verification function, verify_decode_jwt by default
+
+            Returns:
+                dict: The verified payload
+        """
+        verify = verify or verify_decode_jwt
+        digest = hashlib.sha256(token.encode()).digest()
+        now = self.clock()
+
+        with self._lock:
+            entry = self._entries.get(digest)
+
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(digest)
+                    self._hits += 1
+                    return entry[1]
+
+                del self._entries[digest]
+
+            self._misses += 1
+
+        started = time.thread_time()
+        payload = verify(token)
+        elapsed = time.thread_time() - started
+
+        expires_at = now + self.max_ttl
+
+        if "exp" in payload:
+            expires_at = min(expires_at, payload["exp"])
+
+        with self._lock:
+            self._verify_seconds += elapsed
+
+            if self.max_size > 0 and expires_at > now:
+                self._entries[digest] = (expires_at, payload)
+                self._entries.move_to_end(digest)
+
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+
+        return payload
+
+    def clear(self):
+        """
+            Drop every payload and reset the counters
+
+            Args:
+                None
+
+            Returns:
+                None
+        """
+        with self._lock:
+            self._entries.clear()
+            self._hits = 0
+            self._misses = 0
+            self._verify_seconds = 0.0
+
+
+TOKEN_CACHE = TokenCache(
+    max_size=int(os.environ.get("TOKEN_CACHE_SIZE", 1024)),
+    max_ttl=int(os.environ.get("TOKEN_CACHE_TTL", 300))
+)
+
+
 def requires_auth(permission=""):
+    """
+        Require a valid token with a permission to run a view
+
+        Requests are first admitted by the concurrency limiter, then
+        counted against the rate limit of their caller once the token
+        is verified, see ratelimit. Both refuse a request before the
+        view does any database work. The concurrency slot is held until
+        the response is closed, so a streamed body keeps it while it
+        reads from the database.
+
+        Args:
+            permission: The permission of the view
+
+        Returns:
+            function: The decorator
+    """
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            token = get_token_auth_header()
+            limiter = concurrency_limiter()
+            limiter.acquire()
 
             try:
-                payload = verify_decode_jwt(token)
-            except:
-                raise AuthError({
-                    "code": "invalid_token",
-                    "description": "Invalid token."
-                }, 401)
-
-            check_permissions(permission, payload)
-
-            return f(payload, *args, **kwargs)
+                with Phase("auth"):
+                    token = get_token_auth_header()
+
+                    try:
+                        payload = TOKEN_CACHE.verify(token)
+                    except:
+                        raise AuthError({
+                            "code": "invalid_token",
+                            "description": "Invalid token."
+                        }, 401)
+
+                    check_permissions(permission, payload)
+                    rate_limit(permission, payload)
+                    g.payload = payload
+
+                response = make_response(f(payload, *args, **kwargs))
+            except BaseException:
+                limiter.release()
+                raise
+
+            if response.is_streamed:
+                response.call_on_close(limiter.release)
+            else:
+                limiter.release()
+
+            return response
         return wrapper
     return requires_auth_decorator
@@ -0,0 +1,68 @@
+"""
+    Benchmark of the bulk create endpoints against one request per row
+
+    python -m benchmarks.bulk_insert [rows]
+"""
+
+import os
+import sys
+import time
+import tempfile
+
+from benchmarks.common import report
+
+
+def main(rows=5000):
+    """
+        Insert the same actors through POST /actors and POST /actors/bulk
+
+        Args:
+            rows: The number of actors of each run
+
+        Returns:
+            None
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ["DATABASE_URL"] = f"sqlite:///{directory}/bench.db"
+
+        from benchmarks.common import local_auth, seed
+        from app import APP
+        from bulk import BULK_MAX_RECORDS
+
+        issuer, headers = local_auth(["post:actor"])
+        client = APP.test_client()
+        records = [
+            {"name": f"Actor {number}", "age": 30, "gender": "Male", "movie_id": 1}
+            for number in range(rows)
+        ]
+
+        seed(APP, 1, 0)
+        started = time.perf_counter()
+
+        for record in records:
+            client.post("/actors", headers=headers, json=record)
+
+        single = time.perf_counter() - started
+
+        seed(APP, 1, 0)
+        started = time.perf_counter()
+
+        for start in range(0, rows, BULK_MAX_RECORDS):
+            client.post(
+                "/actors/bulk",
+                headers=headers,
+                json=records[start:start + BULK_MAX_RECORDS]
+            )
+
+        bulk = time.perf_counter() - started
+        issuer.stop()
+
+    report(f"actor creation, {rows} rows, SQLite file", [
+        ("POST /actors (rows/s)", f"{rows / single:.0f}"),
+        (f"POST /actors/bulk x{BULK_MAX_RECORDS} (rows/s)", f"{rows / bulk:.0f}"),
+        ("speedup", f"{single / bulk:.0f}x")
+    ])
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,131 @@
+"""
+    File for helpers shared by the benchmarks
+"""
+
+import os
+import time
+
+os.environ.setdefault("AUTH0_DOMAIN", "casting.local")
+os.environ.setdefault("ALGORITHMS", "RS256")
+os.environ.setdefault("API_AUDIENCE", "casting")
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+
+def local_auth(permissions, bits=1024):
+    """
+        Point the app at a local issuer and mint a token
+
+        Args:
+            permissions: The permissions of the token
+            bits: The size of the RSA key
+
+        Returns:
+            tuple: The issuer and the Authorization headers
+    """
+    import auth
+    from auth import JWKSStore
+    from local_issuer import LocalIssuer
+
+    issuer = LocalIssuer(bits=bits)
+    auth.JWKS_STORE = JWKSStore(issuer.serve())
+    token = issuer.mint(permissions)
+
+    return issuer, {"Authorization": "Bearer " + token}
+
+
+def seed(app, movies, actors_per_movie, batch_size=10000):
+    """
+        Fill an empty database with multi-row INSERTs
+
+        The full-text index and the actor statistics are rebuilt
+        afterwards and, on PostgreSQL, the movie id sequence moved past
+        the inserted ids.
+
+        Args:
+            app: The app
+            movies: The number of movies
+            actors_per_movie: The number of actors of each movie
+            batch_size: The number of rows per INSERT batch
+
+        Returns:
+            None
+    """
+    from datetime import datetime
+    from sqlalchemy import insert
+    from models import db, Movie, Actor
+    from search import rebuild
+    from stats import rebuild_actor_stats
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+        for start in range(0, movies, batch_size):
+            db.session.execute(insert(Movie), [
+                {
+                    "id": number + 1,
+                    "title": f"Movie {number}",
+                    "release_date": datetime(2000 + number % 25, 1 + number % 12, 1)
+                }
+                for number in range(start, min(start + batch_size, movies))
+            ])
+
+        actors = movies * actors_per_movie
+
+        for start in range(0, actors, batch_size):
+            db.session.execute(insert(Actor), [
+                {
+                    "name": f"Actor {number}",
+                    "age": 18 + number % 60,
+                    "gender": "Female" if number % 2 else "Male",
+                    "movie_id": number // actors_per_movie + 1
+                }
+                for number in range(start, min(start + batch_size, actors))
+            ])
+
+        if db.engine.dialect.name == "postgresql":
+            db.session.execute(db.text(
+                "SELECT setval(pg_get_serial_sequence('movies', 'id'), "
+                "(SELECT max(id) FROM movies))"
+            ))
+
+        rebuild(db.session, Movie)
+        rebuild(db.session, Actor)
+        rebuild_actor_stats()
+        db.session.commit()
+
+
+def timed(function, iterations):
+    """
+        Run a function repeatedly
+
+        Args:
+            function: The function to run, called without arguments
+            iterations: The number of calls
+
+        Returns:
+            float: The mean wall time of a call in seconds
+    """
+    started = time.perf_counter()
+
+    for _ in range(iterations):
+        function()
+
+    return (time.perf_counter() - started) / iterations
+
+
+def report(title, rows):
+    """
+        Print a result table
+
+        Args:
+            title: The title of the table
+            rows: A list of (label, value) pairs
+
+        Returns:
+            None
+    """
+    print(title)
+
+    for label, value in rows:
+        print(f"  {label:<40} {value}")
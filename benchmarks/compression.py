@@ -0,0 +1,64 @@
+"""
+    Benchmark of the response compression: bytes saved against CPU time,
+    by payload size, coding and level
+
+    python -m benchmarks.compression [iterations]
+
+    The payloads are GET /movies bodies built from transient movies, so
+    the figures leave out the database.
+"""
+
+import sys
+
+from benchmarks.common import report, timed
+from benchmarks.serialization import make_movies
+
+
+SETTINGS = [("gzip", 1), ("gzip", 6), ("gzip", 9), ("br", 1), ("br", 4), ("br", 9)]
+
+
+def main(iterations=5):
+    """
+        Compress list bodies of 10 to 10k movies at several levels
+
+        Args:
+            iterations: The number of runs averaged per figure
+
+        Returns:
+            None
+    """
+    from app import APP
+    from models import Movie
+    from serialization import list_response
+    from compression import brotli, compress
+
+    rows = []
+
+    for count in (10, 100, 1000, 10000):
+        with APP.test_request_context():
+            body = list_response("movies", make_movies(count), Movie).get_data()
+
+        rows.append((f"{count} movies, identity", f"{len(body)} bytes"))
+
+        for encoding, level in SETTINGS:
+            if encoding == "br" and brotli is None:
+                continue
+
+            options = {"gzip_level": level, "brotli_quality": level}
+            size = len(compress(body, encoding, **options))
+            seconds = timed(lambda: compress(body, encoding, **options), iterations)
+            rows.append((
+                f"{count} movies, {encoding} {level}",
+                f"{size} bytes, {100 - size * 100 / len(body):.1f}% saved, "
+                f"{seconds * 1e3:.3f} ms, {len(body) / seconds / 1e6:.0f} MB/s"
+            ))
+
+    report(
+        f"GET /movies body compression, 2 actors per movie, brotli "
+        f"{'installed' if brotli else 'not installed'}",
+        rows
+    )
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,261 @@
+"""
+    Benchmark of the sync WSGI app against the ASGI entry point under a
+    fixed number of concurrent clients
+
+    python -m benchmarks.concurrency [concurrency] [seconds] [database_url]
+
+    Both servers run one worker process, so they hold about the same
+    memory; the resident set of each is reported. The database is a
+    SQLite file by default, which answers in microseconds, so the
+    figures mostly show the cost of the async machinery; pass the url
+    of a networked PostgreSQL to see requests waiting on the database
+    overlap. Its movies and actors tables are replaced.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import tempfile
+import subprocess
+
+from benchmarks.common import report
+
+
+SERVERS = {
+    "sync (gunicorn, 1 sync worker)": [
+        "gunicorn", "--workers", "1", "--bind", "127.0.0.1:{port}", "app:APP"
+    ],
+    "async (uvicorn, 1 worker)": [
+        "uvicorn", "--host", "127.0.0.1", "--port", "{port}",
+        "--no-access-log", "asgi:ASGI_APP"
+    ]
+}
+PATH = "/movies?limit=20"
+
+
+def free_port():
+    """
+        Find a free local TCP port
+
+        Args:
+            None
+
+        Returns:
+            int: The port
+    """
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def tree_rss_kb(pid):
+    """
+        Sum the resident set of a process and its children
+
+        Args:
+            pid: The process id
+
+        Returns:
+            int: The resident set in kB
+    """
+    children = {}
+
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as stat:
+                    parent = int(stat.read().rsplit(")", 1)[1].split()[1])
+            except OSError:
+                continue
+
+            children.setdefault(parent, []).append(int(entry))
+
+    total = 0
+    pending = [pid]
+
+    while pending:
+        current = pending.pop()
+        pending.extend(children.get(current, ()))
+
+        try:
+            with open(f"/proc/{current}/status") as status:
+                for line in status:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+        except OSError:
+            pass
+
+    return total
+
+
+async def fetch(port, headers, method="GET", path=PATH, body=None):
+    """
+        Send one request on a new connection
+
+        Args:
+            port: The server port
+            headers: The request headers
+            method: The request method
+            path: The path and query string
+            body: The JSON body, if any
+
+        Returns:
+            int: The response status
+    """
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    raw = json.dumps(body).encode() if body is not None else b""
+    lines = [f"{method} {path} HTTP/1.1", f"Host: 127.0.0.1:{port}", "Connection: close"]
+    lines += [f"{name}: {value}" for name, value in headers.items()]
+
+    if body is not None:
+        lines += ["Content-Type: application/json", f"Content-Length: {len(raw)}"]
+
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode() + raw)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+
+    return int(response.split(b" ", 2)[1])
+
+
+async def load(port, headers, concurrency, seconds):
+    """
+        Keep a number of requests in flight for a duration
+
+        Args:
+            port: The server port
+            headers: The request headers
+            concurrency: The number of concurrent clients
+            seconds: The duration
+
+        Returns:
+            tuple: The latencies of the successful requests in seconds
+                and the number of failed ones
+    """
+    deadline = time.perf_counter() + seconds
+    latencies = []
+    failures = 0
+
+    async def client():
+        nonlocal failures
+
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+
+            try:
+                status = await fetch(port, headers)
+            except OSError:
+                status = None
+
+            if status == 200:
+                latencies.append(time.perf_counter() - started)
+            else:
+                failures += 1
+
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+
+    return latencies, failures
+
+
+def percentile(latencies, share):
+    """
+        Read a percentile of sorted latencies
+
+        Args:
+            latencies: The sorted latencies
+            share: The percentile, between 0 and 1
+
+        Returns:
+            float: The latency
+    """
+    return latencies[int(share * (len(latencies) - 1))]
+
+
+def wait_until_ready(port, timeout=30):
+    """
+        Wait for a server to accept connections
+
+        Args:
+            port: The server port
+            timeout: The maximum wait in seconds
+
+        Returns:
+            None
+    """
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+
+    raise RuntimeError(f"The server on port {port} did not start.")
+
+
+def main(concurrency=32, seconds=10, database_url=None):
+    """
+        Load each server in turn and compare the throughput
+
+        Args:
+            concurrency: The number of concurrent clients
+            seconds: The duration of each run
+            database_url: The database url, a SQLite file by default
+
+        Returns:
+            None
+    """
+    from local_issuer import LocalIssuer
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ["DATABASE_URL"] = database_url or f"sqlite:///{directory}/bench.db"
+        os.environ["RESPONSE_CACHE_BACKEND"] = "none"
+
+        from benchmarks.common import seed
+        from app import APP
+
+        seed(APP, 1000, 2)
+        issuer = LocalIssuer(bits=1024)
+        env = dict(os.environ, JWKS_URL=issuer.serve())
+        headers = {"Authorization": "Bearer " + issuer.mint(["get:movie"])}
+        rows = []
+
+        for name, command in SERVERS.items():
+            port = free_port()
+            server = subprocess.Popen(
+                [part.format(port=port) for part in command],
+                env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+
+            try:
+                wait_until_ready(port)
+                asyncio.run(load(port, headers, 1, 1))
+                latencies, failures = asyncio.run(
+                    load(port, headers, concurrency, seconds)
+                )
+                rss = tree_rss_kb(server.pid)
+            finally:
+                server.terminate()
+                server.wait()
+
+            latencies.sort()
+            rows += [
+                (f"{name} requests/s", f"{len(latencies) / seconds:.0f}"),
+                (f"{name} p50 / p99 (ms)",
+                 f"{percentile(latencies, 0.5) * 1e3:.1f} / "
+                 f"{percentile(latencies, 0.99) * 1e3:.1f}"),
+                (f"{name} failed requests", failures),
+                (f"{name} RSS (MB)", f"{rss / 1024:.0f}")
+            ]
+
+        issuer.stop()
+
+    report(f"GET {PATH}, {concurrency} concurrent clients, {seconds} s each", rows)
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:3]), *sys.argv[3:4])
@@ -0,0 +1,122 @@
+"""
+    Benchmark of the list filters and sort orders with and without indexes
+
+    python -m benchmarks.filtering [movies] [actors_per_movie] [iterations]
+"""
+
+import os
+import sys
+import tempfile
+
+from benchmarks.common import report, timed
+
+
+QUERIES = [
+    ("/movies", "title_prefix=Movie%2099&limit=20"),
+    ("/movies", "release_date_from=2010-01-01&release_date_to=2010-12-31&limit=20"),
+    ("/movies", "sort=-release_date&limit=20"),
+    ("/actors", "gender=Female&age_min=30&age_max=35&limit=20"),
+    ("/actors", "movie_id=500&limit=20"),
+    ("/actors", "sort=age&limit=20")
+]
+
+
+def plans(db, statements):
+    """
+        Read the query plan of statements
+
+        Args:
+            db: The database extension
+            statements: The SQL statements
+
+        Returns:
+            list: The plan details, one string per statement
+    """
+    return [
+        "; ".join(row[-1] for row in db.session.execute(
+            db.text("EXPLAIN QUERY PLAN " + statement)
+        ))
+        for statement in statements
+    ]
+
+
+def main(movies=20000, actors_per_movie=5, iterations=50):
+    """
+        Time the filtered and sorted lists before and after dropping the
+        indexes of the filter and sort columns
+
+        Args:
+            movies: The number of movies
+            actors_per_movie: The number of actors of each movie
+            iterations: The number of requests of each query
+
+        Returns:
+            None
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ["DATABASE_URL"] = f"sqlite:///{directory}/bench.db"
+        os.environ["RESPONSE_CACHE_BACKEND"] = "none"
+
+        from benchmarks.common import local_auth, seed
+        from app import APP
+        from models import db, Movie, Actor
+
+        issuer, headers = local_auth(["get:movie", "get:actor"])
+        client = APP.test_client()
+        seed(APP, movies, actors_per_movie)
+
+        sample = [
+            "SELECT id FROM movies WHERE title >= 'Movie 99' AND title < 'Movie 9:'",
+            "SELECT id FROM actors WHERE gender = 'Female' AND age BETWEEN 30 AND 35"
+        ]
+        indexes = [
+            index for model in (Movie, Actor) for index in model.__table__.indexes
+        ]
+
+        def run():
+            return [
+                timed(lambda: client.get(f"{url}?{query}", headers=headers), iterations)
+                for url, query in QUERIES
+            ]
+
+        with APP.app_context():
+            indexed_plans = plans(db, sample)
+
+        indexed = run()
+
+        with APP.app_context():
+            for index in indexes:
+                index.drop(db.engine)
+
+            # Pooled connections keep statements prepared with the indexes
+            db.session.remove()
+            db.engine.dispose()
+
+            plain_plans = plans(db, sample)
+
+        plain = run()
+        issuer.stop()
+
+    rows = []
+
+    for (url, query), with_index, without_index in zip(QUERIES, indexed, plain):
+        rows.append((
+            f"GET {url}?{query}",
+            f"{with_index * 1000:.2f} ms vs {without_index * 1000:.2f} ms "
+            f"({without_index / with_index:.1f}x)"
+        ))
+
+    for statement, with_index, without_index in zip(sample, indexed_plans, plain_plans):
+        rows.append((statement, ""))
+        rows.append(("  indexed plan", with_index))
+        rows.append(("  plan without indexes", without_index))
+
+    report(
+        f"filtered lists, {movies} movies, {movies * actors_per_movie} actors, "
+        "indexed vs not indexed",
+        rows
+    )
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,455 @@
+"""
+    Load test of every endpoint at a fixed concurrency
+
+    python -m benchmarks.load [--movies 1000] [--concurrency 16]
+        [--seconds 10] [--server wsgi|asgi] [--workers 2]
+        [--database-url URL] [--only TEXT] [--output FILE]
+    python -m benchmarks.load --compare OLD.json NEW.json [--threshold 0.1]
+
+    A dataset is seeded into a SQLite file, or into the database of
+    --database-url, whose movies and actors tables are replaced. Tokens
+    of the three roles are minted by a local issuer whose key set is
+    served on localhost, so no Auth0 tenant is needed. Each scenario is
+    first sent once in process to count its SQL statements, then driven
+    against a gunicorn or uvicorn server for the given duration.
+
+    The results are written as JSON, by default to
+    benchmarks/results/<commit>-<server>.json, and two result files are
+    compared with --compare.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import tempfile
+import itertools
+import subprocess
+
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+from benchmarks.common import report
+from benchmarks.concurrency import fetch, free_port, percentile, wait_until_ready
+
+
+ROLES = {
+    "casting_assistant": ["get:actor", "get:movie"],
+    "casting_director": [
+        "delete:actor", "get:actor", "get:movie", "patch:actor", "post:actor"
+    ],
+    "executive_producer": [
+        "delete:actor", "delete:movie", "get:actor", "get:movie",
+        "patch:actor", "patch:movie", "post:actor", "post:movie"
+    ],
+    "monitoring": ["get:health"]
+}
+SERVERS = {
+    "wsgi": [
+        "gunicorn", "--workers", "{workers}", "--bind", "127.0.0.1:{port}",
+        "app:APP"
+    ],
+    "asgi": [
+        "uvicorn", "--workers", "{workers}", "--host", "127.0.0.1",
+        "--port", "{port}", "--no-access-log", "asgi:ASGI_APP"
+    ]
+}
+
+
+def scenarios(movies, actors_per_movie):
+    """
+        List the scenarios, reads first and deletes last
+
+        Each scenario makes its requests from a function, so writes touch
+        a different row each time. Deletes take movies from the lowest id
+        up and actors from the highest id down, so they do not collide.
+
+        Args:
+            movies: The number of seeded movies
+            actors_per_movie: The number of seeded actors of each movie
+
+        Returns:
+            list: (name, role, request function) triples, the function
+                returning (method, path, body)
+    """
+    actors = movies * actors_per_movie
+    any_movie = lambda: random.randint(1, movies)
+    any_actor = lambda: random.randint(1, actors)
+    first_movies = itertools.count(1)
+    last_actors = itertools.count(actors, -1)
+    new_movie = lambda: {"title": "Load movie", "release_date": "2024-01-01"}
+    new_actor = lambda: {
+        "name": "Load actor", "age": 30, "gender": "Female", "movie_id": any_movie()
+    }
+
+    return [
+        ("GET /movies?limit=20", "casting_assistant",
+         lambda: ("GET", "/movies?limit=20", None)),
+        ("GET /movies?limit=20&sort=-release_date", "casting_assistant",
+         lambda: ("GET", "/movies?limit=20&sort=-release_date", None)),
+        ("GET /movies?title_prefix=...&limit=20", "casting_assistant",
+         lambda: ("GET", f"/movies?title_prefix=Movie%20{any_movie()}&limit=20", None)),
+        ("GET /movies?fields=id,title&limit=100", "casting_assistant",
+         lambda: ("GET", "/movies?fields=id,title&limit=100", None)),
+        ("GET /actors?limit=20", "casting_assistant",
+         lambda: ("GET", "/actors?limit=20", None)),
+        ("GET /actors?age_min=30&gender=Female&limit=20", "casting_assistant",
+         lambda: ("GET", "/actors?age_min=30&gender=Female&limit=20", None)),
+        ("GET /search?q=...&limit=20", "casting_assistant",
+         lambda: ("GET", f"/search?q={quote(f'movie {any_movie()}')}&limit=20", None)),
+        ("GET /health/pool", "monitoring", lambda: ("GET", "/health/pool", None)),
+        ("GET /health/cache", "monitoring", lambda: ("GET", "/health/cache", None)),
+        ("POST /movies", "executive_producer",
+         lambda: ("POST", "/movies", new_movie())),
+        ("POST /movies/bulk (10 rows)", "executive_producer",
+         lambda: ("POST", "/movies/bulk", [new_movie() for _ in range(10)])),
+        ("PATCH /movies/<id>", "executive_producer",
+         lambda: ("PATCH", f"/movies/{any_movie()}", {"title": "Patched movie"})),
+        ("POST /actors", "casting_director",
+         lambda: ("POST", "/actors", new_actor())),
+        ("POST /actors/bulk (10 rows)", "casting_director",
+         lambda: ("POST", "/actors/bulk", [new_actor() for _ in range(10)])),
+        ("PATCH /actors/<id>", "casting_director",
+         lambda: ("PATCH", f"/actors/{any_actor()}", {"age": 40})),
+        ("DELETE /actors/<id>", "casting_director",
+         lambda: ("DELETE", f"/actors/{next(last_actors)}", None)),
+        ("DELETE /movies/<id>", "executive_producer",
+         lambda: ("DELETE", f"/movies/{next(first_movies)}", None))
+    ]
+
+
+def count_queries(app, make_request, headers):
+    """
+        Send one request in process and count its SQL statements
+
+        Args:
+            app: The app
+            make_request: The request function of the scenario
+            headers: The request headers
+
+        Returns:
+            tuple: The response status and the number of statements
+    """
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    statements = []
+
+    def count(*args):
+        statements.append(args[2])
+
+    method, path, body = make_request()
+    event.listen(Engine, "before_cursor_execute", count)
+
+    try:
+        response = app.test_client().open(path, method=method, json=body, headers=headers)
+    finally:
+        event.remove(Engine, "before_cursor_execute", count)
+
+    return response.status_code, len(statements)
+
+
+async def drive(port, make_request, headers, concurrency, seconds):
+    """
+        Keep a number of requests of a scenario in flight for a duration
+
+        Args:
+            port: The server port
+            make_request: The request function of the scenario
+            headers: The request headers
+            concurrency: The number of concurrent clients
+            seconds: The duration
+
+        Returns:
+            tuple: The latencies of the 2xx responses in seconds and the
+                count of each status, None for connection errors
+    """
+    deadline = time.perf_counter() + seconds
+    latencies = []
+    statuses = {}
+
+    async def client():
+        while time.perf_counter() < deadline:
+            method, path, body = make_request()
+            started = time.perf_counter()
+
+            try:
+                status = await fetch(port, headers, method, path, body)
+            except OSError:
+                status = None
+
+            if status is not None and 200 <= status < 300:
+                latencies.append(time.perf_counter() - started)
+
+            statuses[status] = statuses.get(status, 0) + 1
+
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+
+    return latencies, statuses
+
+
+def summarize(latencies, statuses, seconds, queries):
+    """
+        Reduce the measures of a scenario to its figures
+
+        Args:
+            latencies: The latencies of the 2xx responses in seconds
+            statuses: The count of each status
+            seconds: The duration of the run
+            queries: The number of SQL statements of one request
+
+        Returns:
+            dict: The figures, latencies in milliseconds
+    """
+    latencies = sorted(latencies)
+    figures = {
+        "requests": sum(statuses.values()),
+        "throughput": round(len(latencies) / seconds, 1),
+        "failures": sum(
+            count for status, count in statuses.items()
+            if status is None or not 200 <= status < 300
+        ),
+        "statuses": {str(status): count for status, count in statuses.items()},
+        "queries_per_request": queries
+    }
+
+    if latencies:
+        figures.update({
+            "mean_ms": round(sum(latencies) / len(latencies) * 1e3, 2),
+            "p50_ms": round(percentile(latencies, 0.5) * 1e3, 2),
+            "p90_ms": round(percentile(latencies, 0.9) * 1e3, 2),
+            "p99_ms": round(percentile(latencies, 0.99) * 1e3, 2),
+            "max_ms": round(latencies[-1] * 1e3, 2)
+        })
+
+    return figures
+
+
+def git_commit():
+    """
+        Get the commit of the working tree
+
+        Args:
+            None
+
+        Returns:
+            str: The short commit hash, with -dirty when there are local
+                changes, or unknown outside a git checkout
+    """
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+    return commit + ("-dirty" if dirty else "")
+
+
+def run(options):
+    """
+        Seed the dataset, drive every scenario and write the results
+
+        Args:
+            options: The parsed command line
+
+        Returns:
+            dict: The results
+    """
+    from local_issuer import LocalIssuer
+
+    with tempfile.TemporaryDirectory() as directory:
+        database_url = options.database_url or f"sqlite:///{directory}/load.db"
+        os.environ["DATABASE_URL"] = database_url
+
+        if not options.cache:
+            os.environ["RESPONSE_CACHE_BACKEND"] = "none"
+
+        import auth
+        from auth import JWKSStore
+        from benchmarks.common import seed
+        from app import APP
+
+        started = time.perf_counter()
+        seed(APP, options.movies, options.actors_per_movie)
+        seeding = time.perf_counter() - started
+
+        issuer = LocalIssuer(bits=2048)
+        jwks_url = issuer.serve()
+        auth.JWKS_STORE = JWKSStore(jwks_url)
+        tokens = {role: issuer.mint(permissions) for role, permissions in ROLES.items()}
+        env = dict(os.environ, JWKS_URL=jwks_url)
+        results = {
+            "commit": git_commit(),
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "server": options.server,
+            "workers": options.workers,
+            "database": database_url.split(":", 1)[0],
+            "response_cache": options.cache,
+            "movies": options.movies,
+            "actors": options.movies * options.actors_per_movie,
+            "seconds_to_seed": round(seeding, 1),
+            "concurrency": options.concurrency,
+            "seconds": options.seconds,
+            "scenarios": {}
+        }
+        port = free_port()
+        server = subprocess.Popen(
+            [
+                part.format(port=port, workers=options.workers)
+                for part in SERVERS[options.server]
+            ],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+
+        try:
+            wait_until_ready(port)
+
+            for name, role, make_request in scenarios(
+                options.movies, options.actors_per_movie
+            ):
+                if options.only and options.only not in name:
+                    continue
+
+                headers = {"Authorization": "Bearer " + tokens[role]} if role else {}
+                _, queries = count_queries(APP, make_request, headers)
+                asyncio.run(drive(port, make_request, headers, 1, 0.5))
+                latencies, statuses = asyncio.run(drive(
+                    port, make_request, headers, options.concurrency, options.seconds
+                ))
+                results["scenarios"][name] = dict(
+                    summarize(latencies, statuses, options.seconds, queries), role=role
+                )
+        finally:
+            server.terminate()
+            server.wait()
+            issuer.stop()
+
+    return results
+
+
+def show(results):
+    """
+        Print the results as a table
+
+        Args:
+            results: The results
+
+        Returns:
+            None
+    """
+    rows = []
+
+    for name, figures in results["scenarios"].items():
+        rows.append((name, (
+            f"{figures['throughput']:>8} req/s  "
+            f"p50 {figures.get('p50_ms', '-')} / p90 {figures.get('p90_ms', '-')} / "
+            f"p99 {figures.get('p99_ms', '-')} ms  "
+            f"{figures['queries_per_request']} queries  "
+            f"{figures['failures']} failed"
+        )))
+
+    report(
+        f"{results['movies']} movies, {results['actors']} actors on "
+        f"{results['database']}, {results['server']} with {results['workers']} "
+        f"workers, {results['concurrency']} clients, {results['seconds']} s "
+        f"per scenario, commit {results['commit']}",
+        rows
+    )
+
+
+def compare(old, new, threshold=0.1):
+    """
+        Compare two result files scenario by scenario
+
+        Args:
+            old: The path of the reference results
+            new: The path of the new results
+            threshold: The relative change reported as a regression
+
+        Returns:
+            int: The number of regressions
+    """
+    with open(old) as reference, open(new) as current:
+        old_results, new_results = json.load(reference), json.load(current)
+
+    rows = []
+    regressions = 0
+
+    for name, figures in new_results["scenarios"].items():
+        before = old_results["scenarios"].get(name)
+
+        if before is None or not before["throughput"] or "p99_ms" not in before:
+            continue
+
+        throughput = figures["throughput"] / before["throughput"] - 1
+        p99 = figures.get("p99_ms", float("inf")) / before["p99_ms"] - 1
+        queries = figures["queries_per_request"] - before["queries_per_request"]
+        regressed = throughput < -threshold or p99 > threshold or queries > 0
+        regressions += regressed
+        rows.append((name, (
+            f"throughput {throughput:+.0%}  p99 {p99:+.0%}  "
+            f"queries {queries:+d}{'  REGRESSION' if regressed else ''}"
+        )))
+
+    report(f"{old_results['commit']} -> {new_results['commit']}", rows)
+
+    return regressions
+
+
+def main(argv=None):
+    """
+        Run the load test, or compare two result files
+
+        Args:
+            argv: The command line arguments, sys.argv by default
+
+        Returns:
+            int: The exit status, 1 when a comparison found regressions
+    """
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.load")
+    parser.add_argument("--movies", type=int, default=1000)
+    parser.add_argument("--actors-per-movie", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--server", choices=SERVERS, default="wsgi")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--database-url")
+    parser.add_argument("--cache", action="store_true",
+                        help="keep the response cache on")
+    parser.add_argument("--only", help="run the scenarios whose name contains it")
+    parser.add_argument("--output")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    parser.add_argument("--threshold", type=float, default=0.1)
+    options = parser.parse_args(argv)
+
+    if options.compare:
+        return 1 if compare(*options.compare, options.threshold) else 0
+
+    results = run(options)
+    output = options.output or os.path.join(
+        "benchmarks", "results", f"{results['commit']}-{options.server}.json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+
+    with open(output, "w") as file:
+        json.dump(results, file, indent=2)
+
+    show(results)
+    print(f"Results written to {output}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+"""
+    Benchmark of the search endpoint against the dataset size, compared
+    with a LIKE '%q%' scan
+
+    python -m benchmarks.search [largest_movie_count] [iterations]
+"""
+
+import os
+import sys
+import tempfile
+
+from benchmarks.common import report, timed
+
+
+QUERIES = ["1234", "movie 99", "actor 5"]
+
+
+def main(largest=100000, iterations=50):
+    """
+        Time GET /search on growing datasets
+
+        Args:
+            largest: The number of movies of the largest dataset, each
+                with two actors
+            iterations: The number of requests of each query
+
+        Returns:
+            None
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ["DATABASE_URL"] = f"sqlite:///{directory}/bench.db"
+        os.environ["RESPONSE_CACHE_BACKEND"] = "none"
+
+        from benchmarks.common import local_auth, seed
+        from app import APP
+        from models import db
+
+        issuer, headers = local_auth(["get:movie", "get:actor"])
+        client = APP.test_client()
+        rows = []
+        size = 1000
+
+        while size <= largest:
+            seed(APP, size, 2)
+
+            for q in QUERIES:
+                search = timed(
+                    lambda: client.get(f"/search?q={q}&limit=20", headers=headers),
+                    iterations
+                )
+
+                with APP.app_context():
+                    like = db.text(
+                        "SELECT id FROM movies WHERE title LIKE :q "
+                        "UNION ALL SELECT id FROM actors WHERE name LIKE :q"
+                    )
+                    scan = timed(
+                        lambda: db.session.execute(like, {"q": f"%{q}%"}).all(),
+                        max(1, iterations // 10)
+                    )
+
+                rows.append((
+                    f"{size} movies, {size * 2} actors, q={q}",
+                    f"{search * 1000:.2f} ms, LIKE scan {scan * 1000:.2f} ms"
+                ))
+
+            size *= 10
+
+        issuer.stop()
+
+    report("GET /search?limit=20 latency by dataset size, SQLite FTS5", rows)
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
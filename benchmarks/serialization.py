@@ -0,0 +1,111 @@
+"""
+    Microbenchmark of the list serialization, format() and jsonify
+    against the compiled row serializers
+
+    python -m benchmarks.serialization [iterations]
+
+    Rows are transient model instances, so the figures leave out the
+    database and the ORM loading.
+"""
+
+import sys
+
+from datetime import datetime
+
+from benchmarks.common import report, timed
+
+
+def make_movies(count):
+    """
+        Build transient movies with two actors each
+
+        Args:
+            count: The number of movies
+
+        Returns:
+            list: The movies
+    """
+    from models import Movie, Actor
+
+    movies = []
+
+    for number in range(count):
+        movie = Movie(
+            title=f"Movie {number}",
+            release_date=datetime(1950 + number % 70, 1 + number % 12, 1 + number % 28)
+        )
+        movie.id = number
+        movie.actors = [
+            Actor(
+                name=f"Actor {number}.{cast}", age=20 + cast,
+                gender="Female" if cast else "Male", movie_id=number
+            )
+            for cast in range(2)
+        ]
+
+        for cast, actor in enumerate(movie.actors):
+            actor.id = number * 2 + cast
+
+        movies.append(movie)
+
+    return movies
+
+
+def main(iterations=3):
+    """
+        Serialize 10k and 100k movies both ways
+
+        Args:
+            iterations: The number of runs averaged per figure
+
+        Returns:
+            None
+    """
+    from flask import jsonify
+    from flask.json.provider import DefaultJSONProvider
+    from app import APP
+    from models import Movie
+    from serialization import FastJSONProvider, list_response, orjson
+
+    rows = []
+
+    for count in (10000, 100000):
+        movies = make_movies(count)
+
+        with APP.test_request_context():
+            APP.json = DefaultJSONProvider(APP)
+            baseline = timed(
+                lambda: jsonify({
+                    "success": True,
+                    "movies": [movie.format() for movie in movies]
+                }),
+                iterations
+            )
+            expected = jsonify({
+                "success": True,
+                "movies": [movie.format() for movie in movies]
+            }).get_data()
+
+            APP.json = FastJSONProvider(APP)
+            compiled = timed(
+                lambda: list_response("movies", movies, Movie),
+                iterations
+            )
+            same = list_response("movies", movies, Movie).get_data() == expected
+
+        rows += [
+            (f"{count} movies, format() + jsonify (rows/s)", f"{count / baseline:.0f}"),
+            (f"{count} movies, compiled serializer (rows/s)", f"{count / compiled:.0f}"),
+            (f"{count} movies, speedup", f"{baseline / compiled:.1f}x"),
+            (f"{count} movies, identical bytes", same)
+        ]
+
+    report(
+        f"movie list serialization, 2 actors per movie, orjson "
+        f"{'installed' if orjson else 'not installed'}",
+        rows
+    )
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
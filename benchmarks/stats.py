@@ -0,0 +1,86 @@
+"""
+    Benchmark of the stats endpoints against the number of actors,
+    compared with a GROUP BY over the actors table
+
+    python -m benchmarks.stats [largest_actor_count] [iterations]
+"""
+
+import os
+import sys
+import tempfile
+
+from benchmarks.common import report, timed
+
+
+ACTORS_PER_MOVIE = 10
+GROUP_BY = {
+    "movie": (
+        "SELECT gender, age / 10 * 10, count(*) FROM actors "
+        "WHERE movie_id = :movie_id GROUP BY gender, age / 10 * 10"
+    ),
+    "all": (
+        "SELECT gender, age / 10 * 10, count(*), sum(movie_id IS NULL) "
+        "FROM actors GROUP BY gender, age / 10 * 10"
+    )
+}
+
+
+def main(largest=1000000, iterations=50):
+    """
+        Time GET /stats/movies/<id> and GET /stats/actors on growing
+        datasets
+
+        Args:
+            largest: The number of actors of the largest dataset, ten
+                per movie
+            iterations: The number of requests of each endpoint
+
+        Returns:
+            None
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ["DATABASE_URL"] = f"sqlite:///{directory}/bench.db"
+        os.environ["RESPONSE_CACHE_BACKEND"] = "none"
+
+        from benchmarks.common import local_auth, seed
+        from app import APP
+        from models import db
+
+        issuer, headers = local_auth(["get:actor"])
+        client = APP.test_client()
+        rows = []
+        size = 10000
+
+        while size <= largest:
+            movies = size // ACTORS_PER_MOVIE
+            seed(APP, movies, ACTORS_PER_MOVIE)
+
+            for name, url in (
+                ("movie", f"/stats/movies/{movies // 2}"),
+                ("all", "/stats/actors")
+            ):
+                endpoint = timed(lambda: client.get(url, headers=headers), iterations)
+
+                with APP.app_context():
+                    statement = db.text(GROUP_BY[name])
+                    scan = timed(
+                        lambda: db.session.execute(
+                            statement, {"movie_id": movies // 2}
+                        ).all(),
+                        max(1, iterations // 10)
+                    )
+
+                rows.append((
+                    f"{size} actors, GET {url}",
+                    f"{endpoint * 1000:.2f} ms, GROUP BY {scan * 1000:.2f} ms"
+                ))
+
+            size *= 10
+
+        issuer.stop()
+
+    report("Stats endpoint latency by dataset size, SQLite", rows)
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
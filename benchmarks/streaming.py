@@ -0,0 +1,103 @@
+"""
+    Benchmark of streamed against buffered list responses
+
+    python -m benchmarks.streaming [actors]
+
+    Each mode runs in its own process so that peak RSS is not shared.
+"""
+
+import os
+import sys
+import json
+import time
+import resource
+import tempfile
+import subprocess
+
+from benchmarks.common import report
+
+
+def measure(mode, url):
+    """
+        Fetch a list in this process and print the figures as JSON
+
+        Args:
+            mode: buffered or stream
+            url: The url of the list
+
+        Returns:
+            None
+    """
+    from benchmarks.common import local_auth
+    from app import APP
+
+    issuer, headers = local_auth(["get:actor", "get:movie"])
+    client = APP.test_client()
+    url = url + ("?stream=true" if mode == "stream" else "")
+
+    client.get(url + ("&" if "?" in url else "?") + "limit=1", headers=headers)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    started = time.perf_counter()
+    response = client.get(url, headers=headers, buffered=False)
+    chunks = response.iter_encoded()
+    size = len(next(chunks))
+    first_byte = time.perf_counter() - started
+
+    for chunk in chunks:
+        size += len(chunk)
+
+    total = time.perf_counter() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    issuer.stop()
+
+    print(json.dumps({
+        "ttfb": first_byte,
+        "total": total,
+        "bytes": size,
+        "peak_rss_growth_kb": peak - baseline
+    }))
+
+
+def main(actors=200000):
+    """
+        Seed a SQLite file and compare both modes on /actors and /movies
+
+        Args:
+            actors: The number of actors, one movie per 10 actors
+
+        Returns:
+            None
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{directory}/bench.db")
+        os.environ.update(env)
+
+        from benchmarks.common import seed
+        from app import APP
+
+        seed(APP, max(actors // 10, 1), 10)
+
+        for url in ("/actors", "/movies"):
+            rows = []
+
+            for mode in ("buffered", "stream"):
+                output = subprocess.run(
+                    [sys.executable, "-m", "benchmarks.streaming", "--measure", mode, url],
+                    env=env, check=True, capture_output=True, text=True
+                ).stdout
+                result = json.loads(output.strip().splitlines()[-1])
+
+                rows.append((f"{mode} time to first byte (ms)", f"{result['ttfb'] * 1e3:.1f}"))
+                rows.append((f"{mode} total (ms)", f"{result['total'] * 1e3:.1f}"))
+                rows.append((f"{mode} peak RSS growth (MB)", f"{result['peak_rss_growth_kb'] / 1024:.1f}"))
+
+            rows.append(("body size (MB)", f"{result['bytes'] / 2 ** 20:.1f}"))
+            report(f"GET {url}, {actors} actors", rows)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--measure"]:
+        measure(sys.argv[2], sys.argv[3])
+    else:
+        main(*map(int, sys.argv[1:]))
@@ -0,0 +1,50 @@
+"""
+    Benchmark of the verified token cache against full RS256 verification
+
+    python -m benchmarks.token_cache [iterations]
+"""
+
+import sys
+
+from benchmarks.common import report, timed
+
+import auth
+from auth import JWKSStore, TokenCache, verify_decode_jwt
+from local_issuer import LocalIssuer
+
+
+def main(iterations=2000):
+    """
+        Compare the cached and the uncached verification paths
+
+        Args:
+            iterations: The number of verifications of each path
+
+        Returns:
+            None
+    """
+    issuer = LocalIssuer()
+    auth.JWKS_STORE = JWKSStore(issuer.serve())
+    token = issuer.mint(["get:movie", "get:actor"])
+    cache = TokenCache()
+
+    try:
+        uncached = timed(lambda: verify_decode_jwt(token), iterations)
+        cached = timed(lambda: cache.verify(token), iterations)
+    finally:
+        issuer.stop()
+
+    stats = cache.stats
+
+    report(f"token verification, {iterations} calls per path", [
+        ("uncached (us/call)", f"{uncached * 1e6:.1f}"),
+        ("cached (us/call)", f"{cached * 1e6:.1f}"),
+        ("speedup", f"{uncached / cached:.0f}x"),
+        ("hit ratio", f"{stats['hit_ratio']:.4f}"),
+        ("mean verify CPU (us)", f"{stats['mean_verify_cpu_seconds'] * 1e6:.1f}"),
+        ("CPU saved per request (us)", f"{stats['cpu_saved_per_request_seconds'] * 1e6:.1f}")
+    ])
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
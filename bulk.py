@@ -0,0 +1,523 @@
+"""
+    File for validating and writing bulk requests
+"""
+
+import os
+
+from datetime import datetime
+from flask import request, abort, jsonify
+from sqlalchemy import delete, insert, select, update
+from models import (
+    db, Movie, Actor, STAT_FIELDS, actor_groups, bump_versions, update_actor_stats
+)
+from search import reindex
+
+
+BULK_MAX_RECORDS = int(os.environ.get("BULK_MAX_RECORDS", 1000))
+
+
+def get_records():
+    """
+        Get the array of records of a bulk request
+
+        Args:
+            None
+
+        Returns:
+            list: The records
+    """
+    records = request.get_json(silent=True)
+
+    if not isinstance(records, list) or not records:
+        abort(400, "Expected a non-empty array of records.")
+
+    if len(records) > BULK_MAX_RECORDS:
+        abort(400, f"At most {BULK_MAX_RECORDS} records per request.")
+
+    return records
+
+
+def parse_date(value):
+    """
+        Parse an ISO 8601 date or datetime
+
+        Args:
+            value: The value from the request
+
+        Returns:
+            datetime: The parsed value, or None when it is not a date
+    """
+    if not isinstance(value, str):
+        return None
+
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def validate_movie(record):
+    """
+        Validate a movie record
+
+        Args:
+            record: The record from the request
+
+        Returns:
+            tuple: The column values and None, or None and the error message
+    """
+    if not isinstance(record, dict):
+        return None, "Expected an object."
+
+    title = record.get("title", None)
+    release_date = parse_date(record.get("release_date", None))
+
+    if not isinstance(title, str) or not title:
+        return None, "Missing title."
+
+    if release_date is None:
+        return None, "Missing or invalid release_date."
+
+    return {"title": title, "release_date": release_date}, None
+
+
+def validate_actor(record):
+    """
+        Validate an actor record
+
+        Args:
+            record: The record from the request
+
+        Returns:
+            tuple: The column values and None, or None and the error message
+    """
+    if not isinstance(record, dict):
+        return None, "Expected an object."
+
+    name = record.get("name", None)
+    age = record.get("age", None)
+    gender = record.get("gender", None)
+    movie_id = record.get("movie_id", None)
+
+    if not isinstance(name, str) or not name:
+        return None, "Missing name."
+
+    if not isinstance(age, int) or isinstance(age, bool) or age < 0:
+        return None, "Missing or invalid age."
+
+    if not isinstance(gender, str) or not gender:
+        return None, "Missing gender."
+
+    if not isinstance(movie_id, int) or isinstance(movie_id, bool):
+        return None, "Missing or invalid movie_id."
+
+    return {
+        "name": name,
+        "age": age,
+        "gender": gender,
+        "movie_id": movie_id
+    }, None
+
+
+def validate_movie_patch(patch):
+    """
+        Validate the patch of a batch update of movies
+
+        Args:
+            patch: The patch from the request, with some movie fields
+
+        Returns:
+            tuple: The column values and None, or None and the error message
+    """
+    if not isinstance(patch, dict) or not patch:
+        return None, "Expected a non-empty patch object."
+
+    values = {}
+
+    if "title" in patch:
+        if not isinstance(patch["title"], str) or not patch["title"]:
+            return None, "Invalid title."
+        values["title"] = patch["title"]
+
+    if "release_date" in patch:
+        values["release_date"] = parse_date(patch["release_date"])
+
+        if values["release_date"] is None:
+            return None, "Invalid release_date."
+
+    if len(values) != len(patch):
+        return None, "Unknown fields in patch."
+
+    return values, None
+
+
+def validate_actor_patch(patch):
+    """
+        Validate the patch of a batch update of actors
+
+        Args:
+            patch: The patch from the request, with some actor fields
+
+        Returns:
+            tuple: The column values and None, or None and the error message
+    """
+    if not isinstance(patch, dict) or not patch:
+        return None, "Expected a non-empty patch object."
+
+    values = {}
+
+    for field in ("name", "gender"):
+        if field in patch:
+            if not isinstance(patch[field], str) or not patch[field]:
+                return None, f"Invalid {field}."
+            values[field] = patch[field]
+
+    for field in ("age", "movie_id"):
+        if field in patch:
+            value = patch[field]
+
+            if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+                return None, f"Invalid {field}."
+            values[field] = value
+
+    if len(values) != len(patch):
+        return None, "Unknown fields in patch."
+
+    if "movie_id" in values and db.session.get(Movie, values["movie_id"]) is None:
+        return None, "Movie not found."
+
+    return values, None
+
+
+def validate_records(records, validate):
+    """
+        Validate every record of a bulk request
+
+        Args:
+            records: The records from the request
+            validate: The validation function of one record
+
+        Returns:
+            tuple: The column values of each record and the errors
+    """
+    rows = []
+    errors = []
+
+    for index, record in enumerate(records):
+        row, message = validate(record)
+
+        if message is not None:
+            errors.append({"index": index, "message": message})
+
+        rows.append(row)
+
+    return rows, errors
+
+
+def validate_movie_ids(rows, errors):
+    """
+        Check the movie_id of every actor row with a single query
+
+        Args:
+            rows: The column values of the actors, None for invalid records
+            errors: The errors so far, missing movies are appended
+
+        Returns:
+            list: The errors, ordered by index
+    """
+    movie_ids = {row["movie_id"] for row in rows if row is not None}
+    known_ids = set(db.session.scalars(
+        select(Movie.id).where(Movie.id.in_(movie_ids))
+    )) if movie_ids else set()
+
+    for index, row in enumerate(rows):
+        if row is not None and row["movie_id"] not in known_ids:
+            errors.append({"index": index, "message": "Movie not found."})
+
+    return sorted(errors, key=lambda error: error["index"])
+
+
+def bulk_errors(errors):
+    """
+        Build the response of a rejected bulk request
+
+        Args:
+            errors: The errors, each with the index of its record
+
+        Returns:
+            tuple: The response object and the status code
+    """
+    return jsonify({
+        "success": False,
+        "error": 400,
+        "message": "Invalid records.",
+        "errors": errors
+    }), 400
+
+
+def bulk_insert(model, rows):
+    """
+        Insert rows with multi-row INSERTs in a single transaction
+
+        SQLite cannot tell which row a RETURNING id belongs to within a
+        multi-row INSERT, so there the rows are inserted one at a time.
+
+        Args:
+            model: The model of the rows
+            rows: The column values
+
+        Returns:
+            list: The ids of the new rows, in the order of rows
+    """
+    # RETURNING gives no row order of its own; sort_by_parameter_order
+    # matches the ids to the rows, in batches on PostgreSQL.
+    statement = insert(model).returning(model.id, sort_by_parameter_order=True)
+
+    try:
+        ids = db.session.scalars(statement, rows).all()
+
+        if model is Actor:
+            update_actor_stats(actor_groups(Actor.id.in_(ids)))
+
+        reindex(db.session, model, ids)
+        bump_versions(*model.versioned_tables)
+        db.session.commit()
+    except BaseException:
+        db.session.rollback()
+        raise
+
+    return ids
+
+
+def get_batch(validate_patch=None):
+    """
+        Get the ids, and the patch if any, of a batch request
+
+        Args:
+            validate_patch: The validation function of the patch, None
+                for requests without a patch
+
+        Returns:
+            tuple: The distinct ids, in the request order, and the column
+                values of the patch
+    """
+    body = request.get_json(silent=True)
+
+    if not isinstance(body, dict):
+        abort(400, "Expected an object with ids.")
+
+    ids = body.get("ids")
+
+    if (
+        not isinstance(ids, list) or not ids
+        or not all(isinstance(id_, int) and not isinstance(id_, bool) for id_ in ids)
+    ):
+        abort(400, "Expected a non-empty array of ids.")
+
+    if len(ids) > BULK_MAX_RECORDS:
+        abort(400, f"At most {BULK_MAX_RECORDS} ids per request.")
+
+    if validate_patch is None:
+        return list(dict.fromkeys(ids)), None
+
+    values, message = validate_patch(body.get("patch"))
+
+    if message is not None:
+        abort(400, message)
+
+    return list(dict.fromkeys(ids)), values
+
+
+def returning_ids(statement, model):
+    """
+        Run an UPDATE or DELETE and get the ids of the rows it matched
+
+        The ids come back with RETURNING in the same round trip. Dialects
+        without RETURNING for the statement read them with a SELECT ...
+        FOR UPDATE first.
+
+        Args:
+            statement: The UPDATE or DELETE
+            model: The model of the rows
+
+        Returns:
+            list: The ids of the matched rows, in increasing order
+    """
+    options = {"synchronize_session": False}
+    dialect = db.session.get_bind().dialect
+    supported = (
+        dialect.update_returning if statement.is_update else dialect.delete_returning
+    )
+
+    if supported:
+        return sorted(db.session.scalars(
+            statement.returning(model.id), execution_options=options
+        ))
+
+    matched = sorted(db.session.scalars(
+        select(model.id).where(statement.whereclause).with_for_update()
+    ))
+    db.session.execute(statement, execution_options=options)
+
+    return matched
+
+
+def batch_update(model, ids, values):
+    """
+        Update rows with one set-based UPDATE in a single transaction
+
+        Nothing is committed when no row matched.
+
+        Args:
+            model: The model of the rows
+            ids: The ids of the rows
+            values: The column values to set
+
+        Returns:
+            list: The ids of the updated rows, in increasing order
+    """
+    counted = model is Actor and not STAT_FIELDS.isdisjoint(values)
+
+    try:
+        if counted:
+            removed = actor_groups(Actor.id.in_(ids))
+
+        updated = returning_ids(
+            update(model).where(model.id.in_(ids)).values(values), model
+        )
+
+        if not updated:
+            db.session.rollback()
+            return updated
+
+        if counted:
+            update_actor_stats(actor_groups(Actor.id.in_(updated)), removed)
+
+        reindex(db.session, model, updated)
+        bump_versions(*model.versioned_tables)
+        db.session.commit()
+    except BaseException:
+        db.session.rollback()
+        raise
+
+    return updated
+
+
+def batch_delete(model, ids):
+    """
+        Delete rows with one set-based DELETE in a single transaction
+
+        The actors of deleted movies are kept without a movie, as the
+        single delete did. Nothing is committed when no row matched.
+
+        Args:
+            model: The model of the rows
+            ids: The ids of the rows
+
+        Returns:
+            list: The ids of the deleted rows, in increasing order
+    """
+    tables = set(model.versioned_tables)
+
+    try:
+        if model is Movie:
+            removed = actor_groups(Actor.movie_id.in_(ids))
+            detached = returning_ids(
+                update(Actor).where(Actor.movie_id.in_(ids)).values(movie_id=None),
+                Actor
+            )
+            update_actor_stats(actor_groups(Actor.id.in_(detached)), removed)
+            tables.add("actors")
+        elif model is Actor:
+            update_actor_stats(removed=actor_groups(Actor.id.in_(ids)))
+
+        deleted = returning_ids(delete(model).where(model.id.in_(ids)), model)
+
+        if not deleted:
+            db.session.rollback()
+            return deleted
+
+        reindex(db.session, model, deleted)
+        bump_versions(*tables)
+        db.session.commit()
+    except BaseException:
+        db.session.rollback()
+        raise
+
+    return deleted
+
+
+def update_one(model, id_, values):
+    """
+        Update one row with a single UPDATE ... RETURNING and format it
+
+        The row is formatted before the commit, which would expire it,
+        so only relationships cost another query. Without values nothing
+        is written.
+
+        Args:
+            model: The model of the row
+            id_: The id of the row
+            values: The column values to set
+
+        Returns:
+            dict: The formatted row, or None when no row has the id
+    """
+    counted = model is Actor and not STAT_FIELDS.isdisjoint(values)
+
+    try:
+        if counted:
+            removed = actor_groups(Actor.id == id_)
+
+        if values and db.session.get_bind().dialect.update_returning:
+            row = db.session.scalars(
+                update(model).where(model.id == id_).values(values).returning(model),
+                execution_options={
+                    "synchronize_session": False, "populate_existing": True
+                }
+            ).one_or_none()
+        else:
+            if values:
+                db.session.execute(
+                    update(model).where(model.id == id_).values(values),
+                    execution_options={"synchronize_session": False}
+                )
+            row = db.session.get(model, id_)
+
+        if row is None or not values:
+            db.session.rollback()
+            return row and row.format()
+
+        if counted:
+            update_actor_stats(actor_groups(Actor.id == id_), removed)
+
+        formatted = row.format()
+        reindex(db.session, model, [id_])
+        bump_versions(*model.versioned_tables)
+        db.session.commit()
+    except BaseException:
+        db.session.rollback()
+        raise
+
+    return formatted
+
+
+def batch_result(key, ids, affected):
+    """
+        Build the response of a batch request
+
+        Args:
+            key: updated or deleted
+            ids: The requested ids
+            affected: The ids of the affected rows
+
+        Returns:
+            Response: The response object
+    """
+    found = set(affected)
+
+    return jsonify({
+        "success": True,
+        key: affected,
+        "not_found": [id_ for id_ in ids if id_ not in found]
+    })
@@ -0,0 +1,270 @@
+"""
+    File for the server-side response cache of the read endpoints
+"""
+
+import os
+import time
+import threading
+
+from collections import OrderedDict
+from functools import wraps
+from flask import Response, g, request
+from settings import load_object
+
+
+class CacheBackend:
+    """
+        Interface of the response cache backends
+
+        Entries are tagged with the tables they were built from, so a
+        write can drop exactly the entries of the tables it changed.
+    """
+    def get(self, key):
+        """
+            Get an entry
+
+            Args:
+                key: The key
+
+            Returns:
+                object: The value, or None on a miss
+        """
+        raise NotImplementedError
+
+    def set(self, key, value, size, tags):
+        """
+            Store an entry
+
+            Args:
+                key: The key
+                value: The value
+                size: The size of the value in bytes
+                tags: The names of the tables the value was built from
+
+            Returns:
+                None
+        """
+        raise NotImplementedError
+
+    def invalidate(self, tags):
+        """
+            Drop every entry carrying one of the tags
+
+            Args:
+                tags: The names of the written tables
+
+            Returns:
+                None
+        """
+        raise NotImplementedError
+
+    def stats(self):
+        """
+            Statistics of the backend
+
+            Args:
+                None
+
+            Returns:
+                dict: The statistics
+        """
+        return {}
+
+
+class NullCacheBackend(CacheBackend):
+    """
+        Backend caching nothing
+    """
+    def get(self, key):
+        return None
+
+    def set(self, key, value, size, tags):
+        pass
+
+    def invalidate(self, tags):
+        pass
+
+
+class MemoryCacheBackend(CacheBackend):
+    """
+        In-process LRU backend bounded by entries, bytes and age
+    """
+    def __init__(self, max_entries=1024, max_bytes=64 * 2 ** 20, ttl=60,
+                 clock=time.monotonic):
+        """
+            Constructor for MemoryCacheBackend
+
+            Args:
+                max_entries: The maximum number of entries
+                max_bytes: The maximum total size of the values
+                ttl: The maximum age of an entry in seconds
+                clock: Monotonic clock, replaceable in tests
+
+            Returns:
+                None
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None and entry[0] <= self.clock():
+                self._remove(key)
+                entry = None
+
+            if entry is None:
+                self._misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._hits += 1
+
+            return entry[1]
+
+    def set(self, key, value, size, tags):
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (self.clock() + self.ttl, value, size, tuple(tags))
+            self._bytes += size
+
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._evictions += 1
+
+    def invalidate(self, tags):
+        with self._lock:
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+                    self._invalidations += 1
+
+    def _remove(self, key):
+        _, _, size, tags = self._entries.pop(key)
+        self._bytes -= size
+
+        for tag in tags:
+            keys = self._tags.get(tag)
+
+            if keys is not None:
+                keys.discard(key)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_ratio": self._hits / lookups if lookups else 0.0,
+                "evictions": self._evictions,
+                "invalidations": self._invalidations
+            }
+
+
+def load_backend(name):
+    """
+        Build the backend named by RESPONSE_CACHE_BACKEND
+
+        Args:
+            name: memory, none, or the module:Class path of a backend
+
+        Returns:
+            CacheBackend: The backend
+    """
+    if name == "none":
+        return NullCacheBackend()
+
+    if name == "memory":
+        return MemoryCacheBackend(
+            max_entries=int(os.environ.get("RESPONSE_CACHE_SIZE", 1024)),
+            max_bytes=int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", 64 * 2 ** 20)),
+            ttl=float(os.environ.get("RESPONSE_CACHE_TTL", 60))
+        )
+
+    return load_object(name)()
+
+
+RESPONSE_CACHE = load_backend(os.environ.get("RESPONSE_CACHE_BACKEND", "memory"))
+
+
+def invalidate(tables):
+    """
+        Drop the cached responses built from written tables
+
+        Args:
+            tables: The names of the tables
+
+        Returns:
+            None
+    """
+    RESPONSE_CACHE.invalidate(tables)
+
+
+def cached(*tables):
+    """
+        Serve the response of a read endpoint from the response cache
+
+        The key is made of the endpoint, the query parameters, the
+        permissions of the caller and the ETag of the conditional
+        decorator, which carries the table versions. Entries of other
+        workers therefore never outlive a write either.
+
+        Args:
+            tables: The names of the tables the response is built from
+
+        Returns:
+            function: The decorator
+    """
+    def cached_decorator(f):
+        @wraps(f)
+        def wrapper(payload, *args, **kwargs):
+            key = (
+                request.endpoint,
+                tuple(sorted(request.args.items(multi=True))),
+                tuple(sorted(payload.get("permissions", ()))),
+                g.get("list_etag")
+            )
+            entry = RESPONSE_CACHE.get(key)
+
+            if entry is not None:
+                body, mimetype = entry
+                return Response(body, mimetype=mimetype)
+
+            response = f(payload, *args, **kwargs)
+
+            if (
+                isinstance(response, Response)
+                and response.status_code == 200
+                and not response.is_streamed
+            ):
+                body = response.get_data()
+                RESPONSE_CACHE.set(key, (body, response.mimetype), len(body), tables)
+
+            return response
+        return wrapper
+    return cached_decorator
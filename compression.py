@@ -0,0 +1,236 @@
+"""
+    File for the gzip and brotli compression of the responses, negotiated
+    from Accept-Encoding
+"""
+
+import os
+import gzip
+import zlib
+
+from flask import request
+from settings import get_bool
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+COMPRESSION_ENABLED = get_bool("COMPRESSION_ENABLED", True)
+COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", 1024))
+GZIP_LEVEL = int(os.environ.get("GZIP_LEVEL", 6))
+BROTLI_QUALITY = int(os.environ.get("BROTLI_QUALITY", 4))
+COMPRESSIBLE = frozenset((
+    "application/json", "application/x-ndjson", "text/csv", "text/plain"
+))
+ENCODINGS = ("br", "gzip")
+
+
+def available_encodings():
+    """
+        List the encodings the server can produce, preferred first
+
+        Args:
+            None
+
+        Returns:
+            tuple: The content codings
+    """
+    return ENCODINGS if brotli is not None else ENCODINGS[1:]
+
+
+def negotiate():
+    """
+        Pick the content coding of the current response
+
+        Args:
+            None
+
+        Returns:
+            str: The coding with the highest quality in Accept-Encoding,
+                br on a tie, or None for identity
+    """
+    return request.accept_encodings.best_match(available_encodings())
+
+
+class Compressor:
+    """
+        Incremental compressor of one response body
+
+        Attributes:
+            encoding: The content coding, br or gzip
+    """
+    def __init__(self, encoding, gzip_level=None, brotli_quality=None):
+        self.encoding = encoding
+
+        if encoding == "br":
+            self._compressor = brotli.Compressor(
+                quality=BROTLI_QUALITY if brotli_quality is None else brotli_quality
+            )
+        else:
+            self._compressor = zlib.compressobj(
+                GZIP_LEVEL if gzip_level is None else gzip_level,
+                zlib.DEFLATED, 16 + zlib.MAX_WBITS
+            )
+
+    def compress(self, data):
+        """
+            Compress a chunk and flush it, so the client can decode it
+            before the next one is sent
+
+            Args:
+                data: The bytes of the chunk
+
+            Returns:
+                bytes: The compressed bytes
+        """
+        if self.encoding == "br":
+            return self._compressor.process(data) + self._compressor.flush()
+
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        """
+            End the compressed stream
+
+            Args:
+                None
+
+            Returns:
+                bytes: The last compressed bytes
+        """
+        if self.encoding == "br":
+            return self._compressor.finish()
+
+        return self._compressor.flush()
+
+
+def compress(data, encoding, gzip_level=None, brotli_quality=None):
+    """
+        Compress a whole body
+
+        Args:
+            data: The bytes of the body
+            encoding: The content coding, br or gzip
+            gzip_level: The gzip level, GZIP_LEVEL by default
+            brotli_quality: The brotli quality, BROTLI_QUALITY by default
+
+        Returns:
+            bytes: The compressed body
+    """
+    if encoding == "br":
+        return brotli.compress(
+            data, quality=BROTLI_QUALITY if brotli_quality is None else brotli_quality
+        )
+
+    return gzip.compress(
+        data, GZIP_LEVEL if gzip_level is None else gzip_level, mtime=0
+    )
+
+
+def compress_stream(chunks, compressor):
+    """
+        Compress a streamed body chunk by chunk
+
+        Args:
+            chunks: The bytes of the chunks
+            compressor: The Compressor of the response
+
+        Returns:
+            generator: The compressed chunks
+    """
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+
+        if data:
+            yield data
+
+    yield compressor.finish()
+
+
+def representation_etag(response, encoding):
+    """
+        Give a compressed response an ETag of its own
+
+        The body differs from the identity one byte for byte, so a
+        strong ETag must differ too. The coding is appended, e.g.
+        "3.1-abc-gzip", and etags.conditional accepts both.
+
+        Args:
+            response: The response
+            encoding: The content coding
+
+        Returns:
+            None
+    """
+    etag, weak = response.get_etag()
+
+    if etag is not None:
+        response.set_etag(f"{etag}-{encoding}", weak)
+
+
+def setup_compression(app):
+    """
+        Compress the responses of an app negotiated from Accept-Encoding
+
+        Buffered bodies of COMPRESSION_MIN_SIZE bytes or more are
+        compressed whole, streamed bodies chunk by chunk as they are
+        written. Only successful responses of the COMPRESSIBLE types
+        are compressed, and they all vary on Accept-Encoding.
+
+        Args:
+            app: The app
+
+        Returns:
+            None
+    """
+    @app.after_request
+    def compress_response(response):
+        if response.status_code == 304:
+            response.vary.add("Accept-Encoding")
+
+        if response.mimetype not in COMPRESSIBLE:
+            return response
+
+        response.vary.add("Accept-Encoding")
+
+        if (
+            response.status_code != 200
+            or response.direct_passthrough
+            or "Content-Encoding" in response.headers
+            or request.method == "HEAD"
+        ):
+            return response
+
+        encoding = negotiate()
+
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            chunks = response.response
+
+            if hasattr(chunks, "close"):
+                response.call_on_close(chunks.close)
+
+            response.response = compress_stream(
+                response.iter_encoded(), Compressor(encoding)
+            )
+            response.headers.pop("Content-Length", None)
+        else:
+            data = response.get_data()
+
+            if len(data) < COMPRESSION_MIN_SIZE:
+                return response
+
+            compressed = compress(data, encoding)
+
+            if len(compressed) >= len(data):
+                return response
+
+            response.set_data(compressed)
+
+        response.headers["Content-Encoding"] = encoding
+        representation_etag(response, encoding)
+
+        return response
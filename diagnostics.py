@@ -0,0 +1,201 @@
+"""
+    File for the query diagnostics: the slow-query log, the N+1 detector
+    and the query budgets of the endpoints
+"""
+
+import os
+import re
+import logging
+
+from collections import Counter
+from functools import lru_cache, wraps
+from time import perf_counter
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", 200))
+N_PLUS_ONE_THRESHOLD = int(os.environ.get("N_PLUS_ONE_THRESHOLD", 5))
+LOGGER = logging.getLogger(__name__)
+PLACEHOLDER = r"(?:\?|%\(\w+\)s|\$\d+)"
+
+
+class QueryBudgetExceeded(AssertionError):
+    """
+        A request ran more SQL statements than the budget of its endpoint
+    """
+
+
+@lru_cache(maxsize=1024)
+def statement_shape(statement):
+    """
+        Reduce a statement to its shape
+
+        Expanded IN lists of any length and runs of whitespace are
+        collapsed, so the statements of a lazy load run once per row
+        share their shape.
+
+        Args:
+            statement: The SQL statement
+
+        Returns:
+            str: The shape
+    """
+    statement = re.sub(r"\s+", " ", statement).strip()
+
+    return re.sub(rf"\({PLACEHOLDER}(?:, {PLACEHOLDER})*\)", "(?)", statement)
+
+
+def redact(parameters):
+    """
+        Replace statement parameters with their type names
+
+        Args:
+            parameters: The parameters, a sequence or a mapping, or a list
+                of them for executemany
+
+        Returns:
+            object: The parameters with the values redacted
+    """
+    if isinstance(parameters, dict):
+        return {name: type(value).__name__ for name, value in parameters.items()}
+
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (dict, list, tuple)):
+            return [redact(parameters[0]), f"... {len(parameters)} rows"]
+
+        return tuple(type(value).__name__ for value in parameters)
+
+    return type(parameters).__name__
+
+
+def route():
+    """
+        Describe the request running the current statement
+
+        Args:
+            None
+
+        Returns:
+            str: The method and url rule, or - outside requests
+    """
+    if not has_request_context():
+        return "-"
+
+    rule = request.url_rule.rule if request.url_rule else request.path
+
+    return f"{request.method} {rule}"
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context.diagnostics_started = perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "diagnostics_started", None)
+
+    if started is None:
+        return
+
+    milliseconds = (perf_counter() - started) * 1e3
+
+    if SLOW_QUERY_MS >= 0 and milliseconds >= SLOW_QUERY_MS:
+        LOGGER.warning(
+            "Slow query, %.1f ms, %s: %s %s",
+            milliseconds, route(), statement_shape(statement), redact(parameters)
+        )
+
+    if has_request_context() and "diagnostics_shapes" in g:
+        shape = statement_shape(statement)
+        g.diagnostics_shapes[shape] += 1
+
+        # An executemany with RETURNING runs in batches, one per row on
+        # SQLite, on the same context: the batches after the first are
+        # one call of the code, not an N+1.
+        if getattr(context, "diagnostics_counted", False):
+            g.diagnostics_batches[shape] += 1
+
+        context.diagnostics_counted = True
+
+
+def query_budget(limit):
+    """
+        Set the number of SQL statements an endpoint may run per request
+
+        The statements of the whole request count, from the decorators
+        to the response, but not the chunks of a streamed body. Over the
+        budget the request fails with QueryBudgetExceeded when the app
+        is testing, and is logged otherwise.
+
+        Args:
+            limit: The number of statements
+
+        Returns:
+            function: The decorator
+    """
+    def query_budget_decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            g.query_budget = limit
+
+            return f(*args, **kwargs)
+        return wrapper
+    return query_budget_decorator
+
+
+def setup_diagnostics(app):
+    """
+        Attach the query diagnostics to an app
+
+        The slow-query log covers every statement, the N+1 detector and
+        the query budgets every request of the app. The N+1 detector
+        counts the batches of one executemany once, so bulk inserts,
+        which SQLite runs row by row, are not reported.
+
+        Args:
+            app: The app
+
+        Returns:
+            None
+    """
+    if not event.contains(Engine, "before_cursor_execute", before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", after_cursor_execute)
+
+    @app.before_request
+    def start_diagnostics():
+        g.diagnostics_shapes = Counter()
+        g.diagnostics_batches = Counter()
+
+    @app.after_request
+    def check_diagnostics(response):
+        shapes = g.pop("diagnostics_shapes", None)
+        batches = g.pop("diagnostics_batches", Counter())
+
+        if shapes is None:
+            return response
+
+        if N_PLUS_ONE_THRESHOLD > 0:
+            for shape, count in (shapes - batches).items():
+                if count >= N_PLUS_ONE_THRESHOLD:
+                    LOGGER.warning(
+                        "Statement repeated %d times, possible N+1, %s: %s",
+                        count, route(), shape
+                    )
+
+        budget = g.get("query_budget")
+        statements = sum(shapes.values())
+
+        if budget is not None and statements > budget:
+            message = (
+                f"{route()} ran {statements} statements, "
+                f"over its budget of {budget}: {list(shapes)}"
+            )
+
+            if app.testing:
+                raise QueryBudgetExceeded(message)
+
+            LOGGER.warning(message)
+
+        return response
@@ -0,0 +1,95 @@
+"""
+    File for conditional GET support of the list endpoints
+"""
+
+import hashlib
+
+from functools import wraps
+from flask import g, request, make_response
+from models import get_versions
+from compression import ENCODINGS
+
+
+def list_etag(tables):
+    """
+        Build the ETag of the current request from table versions
+
+        The ETag covers the path, the query string and the permissions
+        of the caller, so every page, filter and format of a list gets
+        its own tag, as does every body permissions shape, e.g. /search
+        with or without get:actor. Versions are read before the rows,
+        so a write in between can only make the tag older than the
+        body, which costs one extra download.
+
+        Args:
+            tables: The names of the tables the response is built from
+
+        Returns:
+            str: The ETag, without quotes
+    """
+    versions = ".".join(map(str, get_versions(*tables)))
+    permissions = sorted(g.get("payload", {}).get("permissions", ()))
+    digest = hashlib.sha1(
+        request.path.encode() + b"?" + request.query_string + b"#"
+        + " ".join(permissions).encode()
+    ).hexdigest()[:16]
+
+    return f"{versions}-{digest}"
+
+
+def matching_etag(etag):
+    """
+        Find the tag of If-None-Match matching an ETag
+
+        Compressed responses carry the ETag with their coding appended,
+        see compression.representation_etag, so those tags match too.
+
+        Args:
+            etag: The ETag of the identity response
+
+        Returns:
+            str: The matching tag, or None
+    """
+    for tag in (etag,) + tuple(f"{etag}-{coding}" for coding in ENCODINGS):
+        if tag in request.if_none_match:
+            return tag
+
+    return None
+
+
+def conditional(*tables):
+    """
+        Answer If-None-Match with 304 before the view runs
+
+        The 304 carries the tag the client sent, so a compressed
+        representation keeps its own tag. Both vary on Authorization,
+        as the tag depends on the permissions of the caller.
+
+        Args:
+            tables: The names of the tables the response is built from
+
+        Returns:
+            function: The decorator
+    """
+    def conditional_decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            etag = g.list_etag = list_etag(tables)
+
+            tag = matching_etag(etag)
+
+            if tag is not None:
+                response = make_response("", 304)
+                response.set_etag(tag)
+                response.vary.add("Authorization")
+                return response
+
+            response = make_response(f(*args, **kwargs))
+
+            if response.status_code == 200:
+                response.set_etag(etag)
+                response.vary.add("Authorization")
+
+            return response
+        return wrapper
+    return conditional_decorator
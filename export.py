@@ -0,0 +1,181 @@
+"""
+    File for the NDJSON and CSV exports of whole tables
+"""
+
+import io
+import os
+import csv
+
+from datetime import date
+from flask import Response, abort, request, stream_with_context
+from sqlalchemy import DateTime, inspect, select
+from models import db
+from filters import get_int
+from serialization import encode_any, encode_int, encode_str
+
+
+EXPORT_CHUNK_SIZE = int(os.environ.get("EXPORT_CHUNK_SIZE", 10000))
+FORMATS = ("application/x-ndjson", "text/csv")
+EXTENSIONS = {"application/x-ndjson": "ndjson", "text/csv": "csv"}
+
+
+def export_format():
+    """
+        Negotiate the export format from the Accept header
+
+        Args:
+            None
+
+        Returns:
+            str: The mimetype, NDJSON when the header is missing
+    """
+    if not request.accept_mimetypes:
+        return FORMATS[0]
+
+    mimetype = request.accept_mimetypes.best_match(FORMATS)
+
+    if mimetype is None:
+        abort(406, "Exports are available as application/x-ndjson or text/csv.")
+
+    return mimetype
+
+
+def get_after():
+    """
+        Read the id an export resumes after
+
+        Args:
+            None
+
+        Returns:
+            int: The after query parameter, 0 when missing
+    """
+    after = get_int("after") or 0
+
+    if after < 0:
+        abort(400, "Invalid after.")
+
+    return after
+
+
+def encode_iso(value):
+    return "null" if value is None else '"' + value.isoformat() + '"'
+
+
+def ndjson_serializer(columns):
+    """
+        Compile the serializer of the lines of an NDJSON export
+
+        Dates are written in ISO 8601, as the write endpoints read them.
+
+        Args:
+            columns: The columns of the table
+
+        Returns:
+            function: The serializer, from a row to its JSON line
+    """
+    encoders = []
+
+    for column in columns:
+        if isinstance(column.type, DateTime):
+            encoders.append(encode_iso)
+        else:
+            try:
+                python_type = column.type.python_type
+            except NotImplementedError:
+                python_type = None
+
+            encoders.append(
+                encode_int if python_type is int
+                else encode_str if python_type is str
+                else encode_any
+            )
+
+    template = "{" + ",".join(
+        encode_str(column.key) + ":%s" for column in columns
+    ) + "}\n"
+
+    def serialize(row):
+        return template % tuple([
+            encode(value) for encode, value in zip(encoders, row)
+        ])
+
+    return serialize
+
+
+def csv_value(value):
+    if value is None:
+        return ""
+
+    if isinstance(value, date):
+        return value.isoformat()
+
+    return value
+
+
+def stream_export(model, chunk_size=None):
+    """
+        Stream every row of a table with an id above the after parameter
+
+        The rows are read by id from one SELECT on a server-side cursor,
+        chunk_size at a time, so the export is a consistent snapshot and
+        memory does not grow with the table. Each chunk is sent before
+        the next one is read. A client whose connection dropped resumes
+        with the id of the last row it received as after, in a new
+        snapshot.
+
+        Args:
+            model: The model of the table
+            chunk_size: The number of rows per chunk, EXPORT_CHUNK_SIZE
+                by default
+
+        Returns:
+            Response: The streamed response
+    """
+    mimetype = export_format()
+    after = get_after()
+    chunk_size = chunk_size or EXPORT_CHUNK_SIZE
+    columns = list(inspect(model).columns)
+    statement = (
+        select(*columns)
+        .where(model.id > after)
+        .order_by(model.id)
+        .execution_options(yield_per=chunk_size)
+    )
+
+    def generate_ndjson(rows):
+        serialize = ndjson_serializer(columns)
+
+        for chunk in rows.partitions():
+            yield "".join(map(serialize, chunk))
+
+    def generate_csv(rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        writer.writerow([column.key for column in columns])
+
+        for chunk in rows.partitions():
+            writer.writerows([map(csv_value, row) for row in chunk])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    def generate():
+        rows = db.session.execute(statement)
+
+        if mimetype == "text/csv":
+            yield from generate_csv(rows)
+        else:
+            yield from generate_ndjson(rows)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype=mimetype,
+        headers={
+            "Content-Disposition": "attachment; filename="
+            f"{model.__tablename__}.{EXTENSIONS[mimetype]}"
+        }
+    )
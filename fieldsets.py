@@ -0,0 +1,70 @@
+"""
+    File for sparse fieldsets of the list endpoints
+"""
+
+from flask import request, abort
+from sqlalchemy import inspect
+from sqlalchemy.orm import load_only, noload
+
+
+def get_fields(model):
+    """
+        Read the fields query parameter
+
+        Args:
+            model: The model of the list
+
+        Returns:
+            tuple: The requested fields, or None for every field
+    """
+    if "fields" not in request.args:
+        return None
+
+    fields = tuple(dict.fromkeys(
+        field.strip() for field in request.args["fields"].split(",") if field.strip()
+    ))
+
+    if not fields:
+        abort(400, "Empty fields.")
+
+    unknown = [field for field in fields if field not in model.format_fields]
+
+    if unknown:
+        abort(400, f"Unknown fields: {', '.join(unknown)}.")
+
+    return fields
+
+
+def select_fields(query, model, fields, sort="id"):
+    """
+        Restrict a query to the columns and relationships of a fieldset
+
+        The primary key and the sort field are always loaded, pagination
+        needs them, and relationships left out are not loaded at all.
+
+        Args:
+            query: The query
+            model: The model of the query
+            fields: The requested fields, or None for every field
+            sort: The sort field of the list
+
+        Returns:
+            Query: The restricted query
+    """
+    if fields is None:
+        return query
+
+    mapper = inspect(model)
+    columns = [
+        getattr(model, field) for field in (sort, *fields)
+        if field in mapper.column_attrs
+    ]
+    skipped = [
+        relationship.class_attribute for relationship in mapper.relationships
+        if relationship.key not in fields
+    ]
+
+    return query.options(
+        load_only(model.id, *columns),
+        *map(noload, skipped)
+    )
@@ -0,0 +1,168 @@
+"""
+    File for filtering and sorting the list endpoints
+"""
+
+import sys
+
+from datetime import datetime
+from flask import request, abort
+from models import db
+
+
+def get_int(name):
+    """
+        Read an integer query parameter
+
+        Args:
+            name: The parameter name
+
+        Returns:
+            int: The value, or None when the parameter is missing
+    """
+    value = request.args.get(name)
+
+    if value is None:
+        return None
+
+    try:
+        return int(value)
+    except ValueError:
+        abort(400, f"Invalid {name}.")
+
+
+def get_date(name):
+    """
+        Read an ISO 8601 date query parameter
+
+        Args:
+            name: The parameter name
+
+        Returns:
+            datetime: The value, or None when the parameter is missing
+    """
+    value = request.args.get(name)
+
+    if value is None:
+        return None
+
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        abort(400, f"Invalid {name}.")
+
+
+def prefix_range(column, prefix):
+    """
+        Match a case-sensitive prefix with a range an index can serve
+
+        LIKE 'prefix%' only uses an index under some collations, while
+        prefix <= column < next_prefix works with any B-tree index. The
+        range is only exact in code point order, so on PostgreSQL it is
+        compared in the C collation, served by ix_movies_title_c, and
+        the LIKE rechecks the rows elsewhere.
+
+        Args:
+            column: The column
+            prefix: The prefix
+
+        Returns:
+            ColumnElement: The condition
+    """
+    if db.session.get_bind().dialect.name == "postgresql":
+        ranged = column.collate("C")
+    else:
+        ranged = column
+
+    condition = (ranged >= prefix) & column.startswith(prefix, autoescape=True)
+
+    # A prefix of only the last code point has no upper bound.
+    stripped = prefix.rstrip(chr(sys.maxunicode))
+
+    if stripped:
+        upper = ord(stripped[-1]) + 1
+
+        if 0xD800 <= upper <= 0xDFFF:
+            upper = 0xE000
+
+        condition &= ranged < stripped[:-1] + chr(upper)
+
+    return condition
+
+
+def filter_movies(query, model):
+    """
+        Apply the movie filters of the request
+
+        title_prefix, release_date_from and release_date_to, the dates
+        being inclusive.
+
+        Args:
+            query: The query
+            model: The Movie model
+
+        Returns:
+            Query: The filtered query
+    """
+    title_prefix = request.args.get("title_prefix")
+    release_date_from = get_date("release_date_from")
+    release_date_to = get_date("release_date_to")
+
+    if title_prefix:
+        query = query.filter(prefix_range(model.title, title_prefix))
+    if release_date_from is not None:
+        query = query.filter(model.release_date >= release_date_from)
+    if release_date_to is not None:
+        query = query.filter(model.release_date <= release_date_to)
+
+    return query
+
+
+def filter_actors(query, model):
+    """
+        Apply the actor filters of the request
+
+        age_min and age_max, inclusive, gender and movie_id.
+
+        Args:
+            query: The query
+            model: The Actor model
+
+        Returns:
+            Query: The filtered query
+    """
+    age_min = get_int("age_min")
+    age_max = get_int("age_max")
+    gender = request.args.get("gender")
+    movie_id = get_int("movie_id")
+
+    if gender is not None:
+        query = query.filter(model.gender == gender)
+    if age_min is not None:
+        query = query.filter(model.age >= age_min)
+    if age_max is not None:
+        query = query.filter(model.age <= age_max)
+    if movie_id is not None:
+        query = query.filter(model.movie_id == movie_id)
+
+    return query
+
+
+def get_sort(model):
+    """
+        Read the sort query parameter
+
+        A leading - sorts in descending order, e.g. sort=-release_date.
+
+        Args:
+            model: The model of the list
+
+        Returns:
+            tuple: The sort field and whether it is descending
+    """
+    sort = request.args.get("sort", "id")
+    name = sort.lstrip("-")
+
+    if name not in model.sort_fields or len(sort) - len(name) > 1:
+        abort(400, f"Invalid sort, expected one of: {', '.join(model.sort_fields)}.")
+
+    return name, sort.startswith("-")
@@ -0,0 +1,388 @@
+"""
+    File for importing NDJSON and CSV files of movies and actors
+"""
+
+import io
+import os
+import csv
+import json
+import itertools
+
+from time import perf_counter
+from flask import abort, jsonify, request
+from sqlalchemy import insert, text
+from sqlalchemy.exc import IntegrityError
+from models import db, Movie, Actor, actor_groups, bump_versions, update_actor_stats
+from search import reindex
+from bulk import validate_movie, validate_actor, validate_records, validate_movie_ids
+from settings import get_bool
+
+
+IMPORT_ENABLED = get_bool("IMPORT_ENABLED", False)
+IMPORT_BATCH_SIZE = int(os.environ.get("IMPORT_BATCH_SIZE", 5000))
+FORMATS = {"application/x-ndjson": "ndjson", "text/csv": "csv"}
+COMMIT_MODES = ("atomic", "batch")
+INTEGER_FIELDS = ("id", "age", "movie_id")
+VALIDATORS = {Movie: validate_movie, Actor: validate_actor}
+
+
+class ImportFailed(Exception):
+    """
+        An import stopped on invalid records or a constraint violation
+
+        Attributes:
+            message: The reason
+            errors: The errors, each with the index of its record
+            imported: The number of records committed before the failure
+    """
+    def __init__(self, message, errors=(), imported=0):
+        super().__init__(message)
+        self.message = message
+        self.errors = list(errors)
+        self.imported = imported
+
+
+def read_ndjson(lines):
+    """
+        Read the records of an NDJSON file
+
+        Blank lines are skipped, a line that is not JSON is read as None
+        and rejected by the validation.
+
+        Args:
+            lines: The lines of the file
+
+        Returns:
+            generator: The records
+    """
+    for line in lines:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield None
+
+
+def read_csv(lines):
+    """
+        Read the records of a CSV file with a header row
+
+        Empty values are missing, integer columns are converted.
+
+        Args:
+            lines: The lines of the file
+
+        Returns:
+            generator: The records
+    """
+    for record in csv.DictReader(lines):
+        record = {key: value for key, value in record.items() if value}
+
+        for field in INTEGER_FIELDS:
+            value = record.get(field, "")
+
+            if value.isascii() and value.isdecimal():
+                record[field] = int(value)
+
+        yield record
+
+
+def read_records(lines, format_):
+    """
+        Read the records of a file
+
+        Args:
+            lines: The lines of the file
+            format_: ndjson or csv
+
+        Returns:
+            generator: The records
+    """
+    return read_csv(lines) if format_ == "csv" else read_ndjson(lines)
+
+
+def validator(model, with_ids):
+    """
+        Get the validation function of the imported records of a model
+
+        Records may carry their id, e.g. when the file is an export, in
+        which case every record of the file must.
+
+        Args:
+            model: The model of the records
+            with_ids: Whether the records carry their id
+
+        Returns:
+            function: The validation function of one record
+    """
+    validate = VALIDATORS[model]
+
+    def validate_record(record):
+        row, message = validate(record)
+
+        if message is not None:
+            return None, message
+
+        if not with_ids:
+            if "id" in record:
+                return None, "Unexpected id, the first record has none."
+            return row, None
+
+        id_ = record.get("id")
+
+        if not isinstance(id_, int) or isinstance(id_, bool) or id_ < 1:
+            return None, "Missing or invalid id."
+
+        return dict(row, id=id_), None
+
+    return validate_record
+
+
+def copy_rows(model, rows):
+    """
+        Insert rows with COPY on PostgreSQL through psycopg2
+
+        The rows are copied into a temporary table of the imported
+        columns only, then moved into the table with one INSERT ...
+        SELECT, which assigns the ids.
+
+        Args:
+            model: The model of the rows
+            rows: The column values, with the same keys
+
+        Returns:
+            list: The ids of the new rows
+    """
+    table = model.__tablename__
+    staging = f"import_{table}"
+    columns = list(rows[0])
+    names = ", ".join(columns)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+
+    for row in rows:
+        writer.writerow([
+            "" if row[column] is None
+            else row[column].isoformat() if hasattr(row[column], "isoformat")
+            else row[column]
+            for column in columns
+        ])
+
+    buffer.seek(0)
+    # Without the defaults of the table, the staging rows do not take
+    # values from its id sequence.
+    db.session.execute(text(
+        f"CREATE TEMP TABLE IF NOT EXISTS {staging} ON COMMIT DROP "
+        f"AS SELECT {names} FROM {table} WITH NO DATA"
+    ))
+    cursor = db.session.connection().connection.dbapi_connection.cursor()
+
+    try:
+        cursor.copy_expert(
+            f"COPY {staging} ({names}) FROM STDIN WITH (FORMAT csv)", buffer
+        )
+    finally:
+        cursor.close()
+
+    ids = db.session.scalars(text(
+        f"INSERT INTO {table} ({names}) SELECT {names} FROM {staging} RETURNING id"
+    )).all()
+    db.session.execute(text(f"TRUNCATE {staging}"))
+
+    return ids
+
+
+def insert_rows(model, rows):
+    """
+        Insert rows with the fastest path of the database
+
+        COPY on PostgreSQL with psycopg2, batched multi-row INSERTs
+        otherwise, e.g. with asyncpg under the ASGI app, which has no
+        copy_expert.
+
+        Args:
+            model: The model of the rows
+            rows: The column values, with the same keys
+
+        Returns:
+            list: The ids of the new rows, in no particular order
+    """
+    dialect = db.session.get_bind().dialect
+
+    if dialect.name == "postgresql" and dialect.driver == "psycopg2":
+        return copy_rows(model, rows)
+
+    return db.session.scalars(insert(model).returning(model.id), rows).all()
+
+
+def advance_sequence(model):
+    """
+        Move the id sequence of a table past its largest id, after rows
+        were inserted with explicit ids
+
+        Args:
+            model: The model of the table
+
+        Returns:
+            None
+    """
+    if db.session.get_bind().dialect.name == "postgresql":
+        table = model.__tablename__
+        db.session.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+            f"(SELECT max(id) FROM {table}))"
+        ))
+
+
+def import_records(
+    model, records, mode="atomic", batch_size=None, progress=None
+):
+    """
+        Validate and insert records in batches
+
+        Each batch is validated in one pass, the movie_id of actors with
+        one query, then inserted with insert_rows. The search index,
+        the actor statistics and the table versions are kept up to date
+        as by the bulk endpoints. In atomic mode the whole import is one
+        transaction; in batch mode each batch is committed, so a failure
+        keeps the batches before it.
+
+        Args:
+            model: Movie or Actor
+            records: The records, e.g. from read_records
+            mode: atomic or batch
+            batch_size: The number of records per batch,
+                IMPORT_BATCH_SIZE by default
+            progress: Called after each batch with the number of records
+                imported so far and the seconds elapsed
+
+        Returns:
+            dict: The number of records imported, the seconds taken and
+                the rows per second
+
+        Raises:
+            ImportFailed: When a batch has invalid records or violates a
+                constraint, after rolling back what was not committed
+    """
+    if mode not in COMMIT_MODES:
+        raise ValueError(f"Unknown commit mode {mode}.")
+
+    batch_size = batch_size or IMPORT_BATCH_SIZE
+    records = iter(records)
+    first = next(records, None)
+
+    if first is None:
+        raise ImportFailed("The file has no records.")
+
+    with_ids = isinstance(first, dict) and "id" in first
+    validate = validator(model, with_ids)
+    records = itertools.chain([first], records)
+    started = perf_counter()
+    committed = imported = 0
+
+    try:
+        for start in itertools.count(0, batch_size):
+            batch = list(itertools.islice(records, batch_size))
+
+            if not batch:
+                break
+
+            rows, errors = validate_records(batch, validate)
+
+            if model is Actor:
+                errors = validate_movie_ids(rows, errors)
+
+            if errors:
+                raise ImportFailed("Invalid records.", [
+                    dict(error, index=start + error["index"]) for error in errors
+                ])
+
+            ids = insert_rows(model, rows)
+
+            if model is Actor:
+                update_actor_stats(actor_groups(Actor.id.in_(ids)))
+
+            reindex(db.session, model, ids)
+            imported += len(ids)
+
+            if mode == "batch":
+                # Committed rows must never be ahead of the sequence,
+                # whatever happens to the next batches.
+                if with_ids:
+                    advance_sequence(model)
+
+                bump_versions(*model.versioned_tables)
+                db.session.commit()
+                committed = imported
+
+            if progress is not None:
+                progress(imported, perf_counter() - started)
+
+        if mode == "atomic":
+            if with_ids:
+                advance_sequence(model)
+
+            bump_versions(*model.versioned_tables)
+
+        db.session.commit()
+    except IntegrityError as error:
+        db.session.rollback()
+        raise ImportFailed(
+            f"Constraint violated: {error.orig}", imported=committed
+        ) from error
+    except ImportFailed as error:
+        db.session.rollback()
+        error.imported = committed
+        raise
+    except BaseException:
+        db.session.rollback()
+        raise
+
+    seconds = perf_counter() - started
+
+    return {
+        "imported": imported,
+        "seconds": round(seconds, 3),
+        "rows_per_second": round(imported / seconds) if seconds else imported
+    }
+
+
+def upload(model):
+    """
+        Import the file in the body of a request
+
+        The format is read from the Content-Type, the commit mode from
+        the mode query parameter, atomic by default. The body is read
+        as it is validated, one batch at a time.
+
+        Args:
+            model: Movie or Actor
+
+        Returns:
+            tuple: The response object and the status code
+    """
+    format_ = FORMATS.get(request.mimetype)
+    mode = request.args.get("mode", "atomic")
+
+    if format_ is None:
+        abort(415, "Uploads are accepted as application/x-ndjson or text/csv.")
+
+    if mode not in COMMIT_MODES:
+        abort(400, "mode must be atomic or batch.")
+
+    lines = io.TextIOWrapper(request.stream, encoding="utf-8", newline="")
+
+    try:
+        result = import_records(model, read_records(lines, format_), mode)
+    except ImportFailed as error:
+        return jsonify({
+            "success": False,
+            "error": 400,
+            "message": error.message,
+            "errors": error.errors,
+            "imported": error.imported
+        }), 400
+    except UnicodeDecodeError:
+        abort(400, "The file is not UTF-8.")
+
+    return jsonify(dict(result, success=True)), 200
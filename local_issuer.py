@@ -0,0 +1,149 @@
+"""
+    File for a local token issuer, a stand-in for Auth0 in tests and benchmarks
+"""
+
+import os
+import json
+import time
+import threading
+
+import rsa
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from jose import jwk, jwt
+
+
+class LocalIssuer:
+    """
+        RS256 token issuer with a JWKS endpoint served on localhost
+
+        Attributes:
+            domain: The domain used in the iss claim
+            audience: The aud claim
+            kid: The id of the signing key
+            jwks: The public key set
+            jwks_requests: The number of JWKS requests served
+            fail: Answer JWKS requests with a 503 when True
+            delay: Seconds to wait before answering a JWKS request
+            cache_control: The Cache-Control header of the JWKS response
+    """
+    def __init__(self, domain=None, audience=None, kid="local-key", bits=2048):
+        """
+            Constructor for LocalIssuer
+
+            Args:
+                domain: The issuer domain, AUTH0_DOMAIN by default
+                audience: The audience, API_AUDIENCE by default
+                kid: The id of the signing key
+                bits: The size of the RSA key
+
+            Returns:
+                None
+        """
+        self.domain = domain or os.environ["AUTH0_DOMAIN"]
+        self.audience = audience or os.environ["API_AUDIENCE"]
+        self.kid = kid
+
+        _, private_key = rsa.newkeys(bits)
+        self.private_pem = private_key.save_pkcs1().decode()
+
+        public_jwk = jwk.construct(self.private_pem, "RS256").public_key()
+        self.jwks = {"keys": [
+            dict(public_jwk.to_dict(), kid=kid, use="sig")
+        ]}
+
+        self.jwks_requests = 0
+        self.fail = False
+        self.delay = 0
+        self.cache_control = "max-age=600"
+        self._server = None
+
+    def mint(self, permissions, sub="local|user", expires_in=3600, **claims):
+        """
+            Mint a signed token
+
+            Args:
+                permissions: The permissions claim
+                sub: The subject
+                expires_in: Seconds until the token expires
+                claims: Extra claims
+
+            Returns:
+                str: The token
+        """
+        now = int(time.time())
+        payload = {
+            "iss": f"https://{self.domain}/",
+            "sub": sub,
+            "aud": self.audience,
+            "iat": now,
+            "exp": now + expires_in,
+            "permissions": list(permissions)
+        }
+        payload.update(claims)
+
+        return jwt.encode(
+            payload,
+            self.private_pem,
+            algorithm="RS256",
+            headers={"kid": self.kid}
+        )
+
+    def serve(self):
+        """
+            Serve the JWKS on a free localhost port
+
+            Args:
+                None
+
+            Returns:
+                str: The JWKS url
+        """
+        issuer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                issuer.jwks_requests += 1
+
+                if issuer.delay:
+                    time.sleep(issuer.delay)
+
+                if issuer.fail:
+                    self.send_response(503)
+                    self.end_headers()
+                    return
+
+                body = json.dumps(issuer.jwks).encode()
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Cache-Control", issuer.cache_control)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+
+        thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        thread.start()
+
+        return f"http://127.0.0.1:{self._server.server_port}/.well-known/jwks.json"
+
+    def stop(self):
+        """
+            Stop serving the JWKS
+
+            Args:
+                None
+
+            Returns:
+                None
+        """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
@@ -1,16 +1,90 @@
 """
     File for database configuration
 """
-from flask_script import Manager
+import sys
+
+from flask_script import Command, Manager, Option
 from flask_migrate import Migrate, MigrateCommand
 from app import APP
-from models import db
+from models import db, Movie, Actor
+from stats import rebuild_actor_stats
+from importer import (
+    COMMIT_MODES, IMPORT_BATCH_SIZE, ImportFailed, import_records, read_records
+)
+
+
+class ImportCommand(Command):
+    """
+        Import the movies or actors of an NDJSON or CSV file
+    """
+    option_list = (
+        Option("table", choices=("movies", "actors")),
+        Option("path", help="the file, - for the standard input"),
+        Option(
+            "--format", dest="format_", choices=("ndjson", "csv"),
+            help="the format, from the file extension by default"
+        ),
+        Option("--mode", choices=COMMIT_MODES, default="atomic"),
+        Option("--batch-size", dest="batch_size", type=int, default=IMPORT_BATCH_SIZE)
+    )
+
+    def run(self, table, path, format_, mode, batch_size):
+        model = Movie if table == "movies" else Actor
+        format_ = format_ or ("csv" if path.endswith(".csv") else "ndjson")
+
+        def progress(imported, seconds):
+            print(
+                f"\r{imported} records, {imported / seconds:.0f} rows/s",
+                end="", file=sys.stderr, flush=True
+            )
+
+        with APP.app_context():
+            with (
+                sys.stdin if path == "-"
+                else open(path, encoding="utf-8", newline="")
+            ) as lines:
+                try:
+                    result = import_records(
+                        model, read_records(lines, format_), mode, batch_size, progress
+                    )
+                except ImportFailed as error:
+                    print(file=sys.stderr)
+
+                    for record in error.errors[:20]:
+                        print(
+                            f"record {record['index']}: {record['message']}",
+                            file=sys.stderr
+                        )
+
+                    sys.exit(
+                        f"Import failed: {error.message} "
+                        f"{error.imported} records were committed."
+                    )
+
+        print(file=sys.stderr)
+        print(
+            f"Imported {result['imported']} {table} in {result['seconds']} s, "
+            f"{result['rows_per_second']} rows/s"
+        )
 
 
 migrate = Migrate(APP, db)
 manager = Manager(APP)
 
 manager.add_command("db", MigrateCommand)
+manager.add_command("import", ImportCommand())
+
+
+@manager.command
+def rebuild_stats():
+    """
+        Recompute the actor statistics from the actors table
+    """
+    with APP.app_context():
+        rows = rebuild_actor_stats()
+        db.session.commit()
+
+    print(f"Rebuilt {rows} actor statistics rows")
 
 
 if __name__ == "__main__":
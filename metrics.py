@@ -0,0 +1,293 @@
+"""
+    File for the per-request phase timings, the Server-Timing header and
+    the Prometheus metrics
+"""
+
+import threading
+
+from bisect import bisect_left
+from time import perf_counter
+from flask import g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from settings import get_bool
+
+
+METRICS_ENABLED = get_bool("METRICS_ENABLED", False)
+DURATION_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5
+)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+PHASES = ("auth", "db", "serialization")
+
+
+class Phase:
+    """
+        Context manager adding the time spent in its block to a phase of
+        the current request
+
+        Does nothing but one lookup in g when the app is not instrumented.
+
+        Attributes:
+            name: The phase, one of PHASES
+    """
+    __slots__ = ("name", "timings", "started")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.timings = g.get("timings")
+
+        if self.timings is not None:
+            self.started = perf_counter()
+
+    def __exit__(self, *exc_info):
+        if self.timings is not None:
+            self.timings[self.name] += perf_counter() - self.started
+
+
+class Histogram:
+    """
+        Cumulative histogram in the Prometheus sense
+
+        Attributes:
+            buckets: The upper bounds of the buckets
+            counts: The number of observations of each bucket, the last
+                one for the values above every bound
+            sum: The sum of the observations
+    """
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Registry:
+    """
+        Metrics of the requests served by this process
+
+        Attributes:
+            durations: The duration histograms by (route, method, phase)
+            queries: The statement count histograms by (route, method)
+            requests: The request counts by (route, method, status)
+    """
+    def __init__(self):
+        self.durations = {}
+        self.queries = {}
+        self.requests = {}
+        self._lock = threading.Lock()
+
+    def observe(self, route, method, status, timings, queries):
+        """
+            Record a finished request
+
+            Args:
+                route: The url rule of the request
+                method: The request method
+                status: The response status
+                timings: The seconds of each phase, with the total
+                queries: The number of SQL statements
+
+            Returns:
+                None
+        """
+        with self._lock:
+            for name, seconds in timings.items():
+                key = (route, method, name)
+
+                if key not in self.durations:
+                    self.durations[key] = Histogram(DURATION_BUCKETS)
+
+                self.durations[key].observe(seconds)
+
+            if (route, method) not in self.queries:
+                self.queries[route, method] = Histogram(QUERY_BUCKETS)
+
+            self.queries[route, method].observe(queries)
+            key = (route, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+    def render(self, gauges=None):
+        """
+            Write the metrics in the Prometheus text format
+
+            Args:
+                gauges: Numeric statistics exported as gauges, by prefix,
+                    e.g. {"pool": {"checked_out": 1}}
+
+            Returns:
+                str: The metrics
+        """
+        lines = []
+
+        with self._lock:
+            lines += [
+                "# HELP casting_requests_total Requests served, by route, method and status.",
+                "# TYPE casting_requests_total counter"
+            ]
+            lines += [
+                f"casting_requests_total{labels(route=route, method=method, status=status)} {count}"
+                for (route, method, status), count in sorted(self.requests.items())
+            ]
+            lines += [
+                "# HELP casting_request_duration_seconds Time spent in each phase of a request.",
+                "# TYPE casting_request_duration_seconds histogram"
+            ]
+
+            for (route, method, name), histogram in sorted(self.durations.items()):
+                lines += histogram_lines(
+                    "casting_request_duration_seconds", histogram,
+                    route=route, method=method, phase=name
+                )
+
+            lines += [
+                "# HELP casting_request_queries SQL statements run by a request.",
+                "# TYPE casting_request_queries histogram"
+            ]
+
+            for (route, method), histogram in sorted(self.queries.items()):
+                lines += histogram_lines(
+                    "casting_request_queries", histogram, route=route, method=method
+                )
+
+        for prefix, stats in (gauges or {}).items():
+            for name, value in stats.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines += [
+                        f"# TYPE casting_{prefix}_{name} gauge",
+                        f"casting_{prefix}_{name} {value}"
+                    ]
+
+        return "\n".join(lines) + "\n"
+
+
+def labels(**values):
+    """
+        Format Prometheus labels
+
+        Args:
+            values: The label values
+
+        Returns:
+            str: The labels, e.g. {route="/movies",method="GET"}
+    """
+    return "{" + ",".join(
+        f'{name}="' + str(value).replace("\\", "\\\\").replace('"', '\\"')
+        .replace("\n", "\\n") + '"'
+        for name, value in values.items()
+    ) + "}"
+
+
+def histogram_lines(name, histogram, **values):
+    """
+        Format the samples of a histogram
+
+        Args:
+            name: The metric name
+            histogram: The histogram
+            values: The label values
+
+        Returns:
+            list: The lines
+    """
+    lines = []
+    count = 0
+
+    for bound, bucket in zip(histogram.buckets + ("+Inf",), histogram.counts):
+        count += bucket
+        lines.append(f"{name}_bucket{labels(**values, le=bound)} {count}")
+
+    return lines + [
+        f"{name}_sum{labels(**values)} {histogram.sum}",
+        f"{name}_count{labels(**values)} {count}"
+    ]
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_app_context() and g.get("timings") is not None:
+        context.metrics_started = perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "metrics_started", None)
+
+    if started is not None and has_app_context() and g.get("timings") is not None:
+        g.timings["db"] += perf_counter() - started
+        g.queries += 1
+
+
+def server_timing(timings, queries):
+    """
+        Format the Server-Timing header
+
+        Args:
+            timings: The seconds of each phase, with the total
+            queries: The number of SQL statements
+
+        Returns:
+            str: The header value, durations in milliseconds
+    """
+    return ", ".join(
+        f"{name};dur={seconds * 1e3:.2f}"
+        + (f';desc="{queries} queries"' if name == "db" else "")
+        for name, seconds in timings.items()
+    )
+
+
+def setup_metrics(app):
+    """
+        Time the phases of every request of an app
+
+        The auth and serialization phases are timed where they happen,
+        by requires_auth, the JSON provider and list_response, the db
+        phase by engine events. A lazy load run while serializing counts
+        in both. Streamed bodies are written after the response is
+        finished, so their serialization is not measured.
+
+        Args:
+            app: The app
+
+        Returns:
+            Registry: The registry of the app
+    """
+    registry = app.extensions["metrics"] = Registry()
+    provider_response = app.json.response
+
+    def timed_response(*args, **kwargs):
+        with Phase("serialization"):
+            return provider_response(*args, **kwargs)
+
+    app.json.response = timed_response
+
+    if not event.contains(Engine, "before_cursor_execute", before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", after_cursor_execute)
+
+    @app.before_request
+    def start_timer():
+        g.timings = dict.fromkeys(PHASES, 0.0)
+        g.queries = 0
+        g.request_started = perf_counter()
+
+    @app.after_request
+    def record_timings(response):
+        timings = g.pop("timings", None)
+
+        if timings is None:
+            return response
+
+        timings["total"] = perf_counter() - g.request_started
+        response.headers["Server-Timing"] = server_timing(timings, g.queries)
+        registry.observe(
+            request.url_rule.rule if request.url_rule else "<unmatched>",
+            request.method, response.status_code, timings, g.queries
+        )
+
+        return response
+
+    return registry
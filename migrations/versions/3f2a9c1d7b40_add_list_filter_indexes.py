@@ -0,0 +1,34 @@
+"""add list filter indexes
+
+Revision ID: 3f2a9c1d7b40
+Revises: 
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f2a9c1d7b40'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_movies_title', 'movies', ['title'], unique=False, if_not_exists=True)
+    op.create_index('ix_movies_release_date', 'movies', ['release_date'], unique=False, if_not_exists=True)
+    op.create_index('ix_actors_movie_id', 'actors', ['movie_id'], unique=False, if_not_exists=True)
+    op.create_index('ix_actors_age', 'actors', ['age'], unique=False, if_not_exists=True)
+    op.create_index('ix_actors_gender_age', 'actors', ['gender', 'age'], unique=False, if_not_exists=True)
+    op.create_index('ix_actors_name', 'actors', ['name'], unique=False, if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index('ix_actors_name', table_name='actors')
+    op.drop_index('ix_actors_gender_age', table_name='actors')
+    op.drop_index('ix_actors_age', table_name='actors')
+    op.drop_index('ix_actors_movie_id', table_name='actors')
+    op.drop_index('ix_movies_release_date', table_name='movies')
+    op.drop_index('ix_movies_title', table_name='movies')
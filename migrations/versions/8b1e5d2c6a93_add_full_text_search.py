@@ -0,0 +1,44 @@
+"""add full text search
+
+Revision ID: 8b1e5d2c6a93
+Revises: 3f2a9c1d7b40
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b1e5d2c6a93'
+down_revision = '3f2a9c1d7b40'
+branch_labels = None
+depends_on = None
+
+
+SEARCHABLE = [('movies', 'title'), ('actors', 'name')]
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+
+    for table, column in SEARCHABLE:
+        if dialect == 'postgresql':
+            op.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_vector tsvector")
+            op.execute(f"UPDATE {table} SET search_vector = to_tsvector('simple', coalesce({column}, ''))")
+            op.execute(f"CREATE INDEX IF NOT EXISTS ix_{table}_search_vector ON {table} USING gin (search_vector)")
+        elif dialect == 'sqlite':
+            op.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts USING fts5({column}, prefix='2 3')")
+            op.execute(f"DELETE FROM {table}_fts")
+            op.execute(f"INSERT INTO {table}_fts (rowid, {column}) SELECT id, {column} FROM {table} WHERE {column} IS NOT NULL")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+
+    for table, _ in reversed(SEARCHABLE):
+        if dialect == 'postgresql':
+            op.execute(f"DROP INDEX IF EXISTS ix_{table}_search_vector")
+            op.execute(f"ALTER TABLE {table} DROP COLUMN IF EXISTS search_vector")
+        elif dialect == 'sqlite':
+            op.execute(f"DROP TABLE IF EXISTS {table}_fts")
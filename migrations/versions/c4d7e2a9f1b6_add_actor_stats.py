@@ -0,0 +1,42 @@
+"""add actor stats
+
+Revision ID: c4d7e2a9f1b6
+Revises: 8b1e5d2c6a93
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4d7e2a9f1b6'
+down_revision = '8b1e5d2c6a93'
+branch_labels = None
+depends_on = None
+
+
+GENDER = "coalesce(gender, '')"
+AGE_BUCKET = "CASE WHEN age IS NULL THEN -1 ELSE age / 10 * 10 END"
+
+
+def upgrade():
+    # app.py runs db.create_all() at import, so the table may already
+    # exist, empty, when the migration runs.
+    op.execute(
+        "CREATE TABLE IF NOT EXISTS actor_stats ("
+        "movie_id INTEGER NOT NULL, "
+        "gender VARCHAR NOT NULL, "
+        "age_bucket INTEGER NOT NULL, "
+        "count INTEGER NOT NULL, "
+        "PRIMARY KEY (movie_id, gender, age_bucket))"
+    )
+    op.execute("DELETE FROM actor_stats")
+    op.execute(
+        "INSERT INTO actor_stats (movie_id, gender, age_bucket, count) "
+        f"SELECT coalesce(movie_id, 0), {GENDER}, {AGE_BUCKET}, count(*) FROM actors "
+        f"GROUP BY movie_id, {GENDER}, {AGE_BUCKET}"
+    )
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS actor_stats")
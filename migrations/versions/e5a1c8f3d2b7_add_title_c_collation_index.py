@@ -0,0 +1,29 @@
+"""add title C collation index
+
+Revision ID: e5a1c8f3d2b7
+Revises: c4d7e2a9f1b6
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a1c8f3d2b7'
+down_revision = 'c4d7e2a9f1b6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # filters.prefix_range compares titles in the C collation on
+    # PostgreSQL; SQLite compares them in code point order already.
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute(
+            'CREATE INDEX IF NOT EXISTS ix_movies_title_c ON movies (title COLLATE "C")'
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute("DROP INDEX IF EXISTS ix_movies_title_c")
@@ -4,9 +4,18 @@
 
 import os
 
-from sqlalchemy import ForeignKey, Column, String, Integer, DateTime
+from collections import Counter
+from sqlalchemy import (
+    ForeignKey, Column, String, Integer, DateTime, Index, select, func, case
+)
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import relationship
 from flask_sqlalchemy import SQLAlchemy
+from pool import engine_options
+from cache import invalidate
+from replicas import REPLICA_PATHS, RoutingSession, replica_binds, setup_replicas
+from search import searchable, reindex
+from diagnostics import setup_diagnostics
 
 
 DATABASE_PATH = os.environ["DATABASE_URL"]
@@ -14,25 +23,227 @@ DATABASE_PATH = os.environ["DATABASE_URL"]
 if DATABASE_PATH.startswith("postgres://"):
     DATABASE_PATH = DATABASE_PATH.replace("postgres://", "postgresql://", 1)
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 
-def setup_db(app):
+def setup_db(app, database_path=None, replica_paths=None):
     """
         Setup the database
 
+        The connection pools are configured from the environment, see
+        pool.engine_options. Replicas get a bind each, used by the views
+        wrapped with replicas.use_replica, see replicas.setup_replicas
+        for the reads of recent writers. The statements are watched by
+        the query diagnostics, see diagnostics.setup_diagnostics.
+
         Args:
             app: The app
+            database_path: The primary database url, DATABASE_URL by default
+            replica_paths: The replica database urls,
+                DATABASE_REPLICA_URLS by default
 
         Returns:
             None
     """
-    app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_PATH
+    database_path = database_path or DATABASE_PATH
+    binds = replica_binds(
+        REPLICA_PATHS if replica_paths is None else replica_paths
+    )
+
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_path
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(database_path)
+    app.config["SQLALCHEMY_BINDS"] = {
+        key: dict(engine_options(url), url=url) for key, url in binds.items()
+    }
+    app.config["REPLICA_BINDS"] = list(binds)
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
     db.app = app
     db.init_app(app)
+    setup_replicas(app)
+    setup_diagnostics(app)
+
+
+class TableVersion(db.Model):
+    """
+        Table of version counters, bumped by every write to a table
+
+        Attributes:
+            name: The name of the table
+            version: The number of writes to the table
+    """
+    __tablename__ = "table_versions"
+
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+def bump_versions(*tables):
+    """
+        Bump the version counters of tables in the current transaction
+
+        The cached responses built from the tables are dropped as well.
+
+        Args:
+            tables: The names of the tables
+
+        Returns:
+            None
+    """
+    dialect = db.session.get_bind().dialect.name
+    tables = sorted(set(tables))
+    invalidate(tables)
+
+    if dialect in ("postgresql", "sqlite"):
+        insert = (postgresql if dialect == "postgresql" else sqlite).insert
+        statement = insert(TableVersion).values([
+            {"name": name, "version": 1} for name in tables
+        ])
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=[TableVersion.name],
+            set_={"version": TableVersion.version + 1}
+        ))
+        return
+
+    for name in tables:
+        row = db.session.get(TableVersion, name, with_for_update=True)
+
+        if row is None:
+            db.session.add(TableVersion(name=name, version=1))
+        else:
+            row.version += 1
+
+    db.session.flush()
+
+
+def get_versions(*tables):
+    """
+        Read the version counters of tables
+
+        Args:
+            tables: The names of the tables
+
+        Returns:
+            tuple: The versions, in the order of tables
+    """
+    versions = dict(db.session.execute(
+        select(TableVersion.name, TableVersion.version)
+        .where(TableVersion.name.in_(tables))
+    ).all())
+
+    return tuple(versions.get(name, 0) for name in tables)
 
 
+class ActorStat(db.Model):
+    """
+        Table of actor counts by movie, gender and age bucket, kept up to
+        date by every write to actors
+
+        Attributes:
+            movie_id: The movie, NO_MOVIE for actors without one
+            gender: The gender, "" when unknown
+            age_bucket: The first age of the bucket, -1 when unknown
+            count: The number of actors
+    """
+    __tablename__ = "actor_stats"
+
+    movie_id = Column(Integer, primary_key=True, autoincrement=False)
+    gender = Column(String, primary_key=True)
+    age_bucket = Column(Integer, primary_key=True, autoincrement=False)
+    count = Column(Integer, nullable=False, default=0)
+
+
+NO_MOVIE = 0
+AGE_BUCKET_SIZE = 10
+STAT_FIELDS = frozenset(("movie_id", "age", "gender"))
+STATS_UPSERT_ROWS = 200
+
+
+def actor_groups(condition):
+    """
+        Count actors by movie, gender and age bucket
+
+        Args:
+            condition: The condition selecting the actors
+
+        Returns:
+            Counter: The number of actors of each (movie_id, gender,
+                age_bucket) group
+    """
+    gender = func.coalesce(Actor.gender, "")
+    bucket = case(
+        (Actor.age.is_(None), -1), else_=Actor.age // AGE_BUCKET_SIZE * AGE_BUCKET_SIZE
+    )
+    movie_id = func.coalesce(Actor.movie_id, NO_MOVIE)
+
+    return Counter({
+        (movie_id, gender, bucket): count
+        for movie_id, gender, bucket, count in db.session.execute(
+            select(movie_id, gender, bucket, func.count())
+            .where(condition).group_by(movie_id, gender, bucket)
+        )
+    })
+
+
+def update_actor_stats(added=(), removed=()):
+    """
+        Apply the net change of a write to the statistics, in the
+        current transaction
+
+        Count the actors a write changes or deletes with actor_groups
+        before it, and the actors it inserts or changes after it. Only
+        the groups whose count changed are written, with one upsert
+        locking their rows in key order, so concurrent writes never
+        wait on each other in a cycle. Large changes, e.g. a rebuild,
+        take one upsert per STATS_UPSERT_ROWS groups.
+
+        Args:
+            added: The groups of the actors after the write
+            removed: The groups of the actors before the write
+
+        Returns:
+            None
+    """
+    changes = Counter(added)
+    changes.subtract(removed)
+    rows = [
+        {"movie_id": movie_id, "gender": gender, "age_bucket": bucket, "count": change}
+        for (movie_id, gender, bucket), change in sorted(changes.items())
+        if change
+    ]
+
+    if not rows:
+        return
+
+    dialect = db.session.get_bind().dialect.name
+
+    if dialect in ("postgresql", "sqlite"):
+        insert = (postgresql if dialect == "postgresql" else sqlite).insert
+
+        # Chunks of rows stay under the bound parameter limit of SQLite,
+        # and still lock the rows in key order.
+        for start in range(0, len(rows), STATS_UPSERT_ROWS):
+            statement = insert(ActorStat).values(rows[start:start + STATS_UPSERT_ROWS])
+            db.session.execute(statement.on_conflict_do_update(
+                index_elements=[ActorStat.movie_id, ActorStat.gender, ActorStat.age_bucket],
+                set_={"count": ActorStat.count + statement.excluded["count"]}
+            ))
+        return
+
+    for row in rows:
+        stat = db.session.get(
+            ActorStat, (row["movie_id"], row["gender"], row["age_bucket"]),
+            with_for_update=True
+        )
+
+        if stat is None:
+            db.session.add(ActorStat(**row))
+        else:
+            stat.count += row["count"]
+
+    db.session.flush()
+
+
+@searchable
 class Movie(db.Model):
     """
         Table for movies
@@ -41,14 +252,25 @@ class Movie(db.Model):
             id: The id of the movie
             title: The title of the movie
             release_date: The release date of the movie
-            actors: The actors in the movie
+            actors: The actors in the movie, loaded for every movie of a
+                query with one extra SELECT ... WHERE movie_id IN (...)
+            versioned_tables: The tables whose responses a write changes
+            format_fields: The keys of the formatted movie
+            sort_fields: The fields the list can be sorted by
+            search_field: The field of the full-text index
+            search_kind: The type of the movie in search results
     """
     __tablename__ = "movies"
+    versioned_tables = ("movies",)
+    format_fields = ("id", "title", "release_date", "actors")
+    sort_fields = ("id", "title", "release_date")
+    search_field = "title"
+    search_kind = "movie"
 
     id = Column(Integer, primary_key=True)
-    title = Column(String)
-    release_date = Column(DateTime)
-    actors = relationship("Actor", backref="movie", lazy=True)
+    title = Column(String, index=True)
+    release_date = Column(DateTime, index=True)
+    actors = relationship("Actor", backref="movie", lazy="selectin")
 
     def __init__(self, title, release_date):
         """
@@ -75,6 +297,9 @@ class Movie(db.Model):
                 None
         """
         db.session.add(self)
+        db.session.flush()
+        reindex(db.session, type(self), [self.id])
+        bump_versions(*self.versioned_tables)
         db.session.commit()
 
     def update(self):
@@ -87,6 +312,9 @@ class Movie(db.Model):
             Returns:
                 None
         """
+        db.session.flush()
+        reindex(db.session, type(self), [self.id])
+        bump_versions(*self.versioned_tables)
         db.session.commit()
 
     def delete(self):
@@ -99,26 +327,39 @@ class Movie(db.Model):
             Returns:
                 None
         """
+        cast = [actor.id for actor in self.actors]
+        removed = actor_groups(Actor.movie_id == self.id)
         db.session.delete(self)
+        db.session.flush()
+        update_actor_stats(actor_groups(Actor.id.in_(cast)), removed)
+        reindex(db.session, type(self), [self.id])
+        bump_versions("actors", *self.versioned_tables)
         db.session.commit()
 
-    def format(self):
+    def format(self, fields=None):
         """
             Format the movie
 
+            Only the requested attributes are read, so attributes left
+            out of the query are not loaded.
+
             Args:
-                None
+                fields: The keys to include, format_fields by default
 
             Returns:
                 dict: The formatted movie
         """
-        return {
-            "id": self.id,
-            "title": self.title,
-            "release_date": self.release_date,
-            "actors": list(map(lambda actor: actor.format(), self.actors))
-        }
+        formatted = {}
+
+        for field in fields or self.format_fields:
+            if field == "actors":
+                formatted["actors"] = [actor.format() for actor in self.actors]
+            else:
+                formatted[field] = getattr(self, field)
 
+        return formatted
+
+@searchable
 class Actor(db.Model):
     """
         Table for actors
@@ -127,14 +368,28 @@ class Actor(db.Model):
             id: The id of the actor
             name: The name of the actor
             age: The age of the
+            versioned_tables: The tables whose responses a write changes,
+                movies embed their actors
+            format_fields: The keys of the formatted actor
+            sort_fields: The fields the list can be sorted by
+            search_field: The field of the full-text index
+            search_kind: The type of the actor in search results
     """
     __tablename__ = "actors"
+    __table_args__ = (Index("ix_actors_gender_age", "gender", "age"),)
+    versioned_tables = ("actors", "movies")
+    format_fields = ("id", "name", "age", "gender", "movie_id")
+    sort_fields = ("id", "name", "age")
+    search_field = "name"
+    search_kind = "actor"
 
     id = Column(Integer, primary_key=True)
-    name = Column(String)
-    age = Column(Integer)
+    name = Column(String, index=True)
+    age = Column(Integer, index=True)
     gender = Column(String)
-    movie_id = Column(Integer, ForeignKey("movies.id"), nullable=True)
+    movie_id = Column(
+        Integer, ForeignKey("movies.id"), nullable=True, index=True
+    )
 
     def __init__(self, name, age, gender, movie_id):
         """
@@ -162,6 +417,10 @@ class Actor(db.Model):
                 None
         """
         db.session.add(self)
+        db.session.flush()
+        update_actor_stats(actor_groups(Actor.id == self.id))
+        reindex(db.session, type(self), [self.id])
+        bump_versions(*self.versioned_tables)
         db.session.commit()
 
     def update(self):
@@ -174,6 +433,13 @@ class Actor(db.Model):
             Returns:
                 None
         """
+        with db.session.no_autoflush:
+            removed = actor_groups(Actor.id == self.id)
+
+        db.session.flush()
+        update_actor_stats(actor_groups(Actor.id == self.id), removed)
+        reindex(db.session, type(self), [self.id])
+        bump_versions(*self.versioned_tables)
         db.session.commit()
 
     def delete(self):
@@ -186,23 +452,24 @@ class Actor(db.Model):
             Returns:
                 None
         """
+        removed = actor_groups(Actor.id == self.id)
         db.session.delete(self)
+        db.session.flush()
+        update_actor_stats(removed=removed)
+        reindex(db.session, type(self), [self.id])
+        bump_versions(*self.versioned_tables)
         db.session.commit()
 
-    def format(self):
+    def format(self, fields=None):
         """
             Format the actor
 
             Args:
-                None
+                fields: The keys to include, format_fields by default
 
             Returns:
                 dict: The formatted actor
         """
         return {
-            "id": self.id,
-            "name": self.name,
-            "age": self.age,
-            "gender": self.gender,
-            "movie_id": self.movie_id
+            field: getattr(self, field) for field in fields or self.format_fields
         }
@@ -0,0 +1,206 @@
+"""
+    File for keyset pagination of the list endpoints
+"""
+
+import os
+import json
+import base64
+
+from datetime import datetime
+from flask import request, abort
+from sqlalchemy import DateTime, and_, or_
+
+
+MAX_PAGE_SIZE = int(os.environ.get("MAX_PAGE_SIZE", 100))
+
+
+def encode_cursor(last_id, sort="id", value=None):
+    """
+        Encode an opaque cursor pointing after a row
+
+        Args:
+            last_id: The id of the last row of the page
+            sort: The sort field of the list
+            value: The sort field value of the last row
+
+        Returns:
+            str: The cursor
+    """
+    position = {"id": last_id}
+
+    if sort != "id":
+        if isinstance(value, datetime):
+            value = value.isoformat()
+
+        position.update(sort=sort, value=value)
+
+    raw = json.dumps(position, separators=(",", ":")).encode()
+
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+        Decode a cursor made by encode_cursor
+
+        Args:
+            cursor: The cursor
+
+        Returns:
+            dict: The id of the last row, and the sort field and its
+                value when the list is not sorted by id
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        position = json.loads(raw)
+        last_id = position["id"]
+    except (ValueError, TypeError, KeyError):
+        abort(400, "Invalid cursor.")
+
+    if not isinstance(last_id, int) or isinstance(last_id, bool):
+        abort(400, "Invalid cursor.")
+
+    return position
+
+
+def get_page_args():
+    """
+        Read the limit and cursor query parameters
+
+        Args:
+            None
+
+        Returns:
+            tuple: The page size and the decoded cursor, or None when
+                the request is not paginated
+    """
+    if "limit" not in request.args and "cursor" not in request.args:
+        return None
+
+    limit = request.args.get("limit", MAX_PAGE_SIZE)
+
+    try:
+        limit = int(limit)
+    except ValueError:
+        abort(400, "Invalid limit.")
+
+    if limit < 1:
+        abort(400, "Invalid limit.")
+
+    cursor = request.args.get("cursor")
+    after = decode_cursor(cursor) if cursor else None
+
+    return min(limit, MAX_PAGE_SIZE), after
+
+
+def order_by_sort(query, model, sort):
+    """
+        Order a query by a sort field, then by id
+
+        NULLs come last in both directions, on every database.
+
+        Args:
+            query: The query
+            model: The model of the query
+            sort: The sort field and whether it is descending
+
+        Returns:
+            Query: The ordered query
+    """
+    name, descending = sort
+    direction = "desc" if descending else "asc"
+    order = [getattr(model.id, direction)()]
+
+    if name != "id":
+        order.insert(0, getattr(getattr(model, name), direction)().nulls_last())
+
+    return query.order_by(*order)
+
+
+def after_position(model, sort, position):
+    """
+        Build the condition selecting the rows after a cursor
+
+        The cursor value must have the type of the sort column, so a
+        tampered cursor is refused rather than compared by the database.
+
+        Args:
+            model: The model of the query
+            sort: The sort field and whether it is descending
+            position: The decoded cursor
+
+        Returns:
+            ColumnElement: The condition
+    """
+    name, descending = sort
+    last_id = position["id"]
+    same = model.id < last_id if descending else model.id > last_id
+
+    if position.get("sort", "id") != name:
+        abort(400, "Cursor of another sort order.")
+
+    if name == "id":
+        return same
+
+    column = getattr(model, name)
+    value = position.get("value")
+
+    if value is None:
+        return and_(column.is_(None), same)
+
+    if isinstance(column.type, DateTime):
+        try:
+            value = datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            abort(400, "Invalid cursor.")
+    elif (
+        isinstance(value, bool)
+        or not isinstance(value, column.type.python_type)
+    ):
+        abort(400, "Invalid cursor.")
+
+    return or_(
+        column < value if descending else column > value,
+        and_(column == value, same),
+        column.is_(None)
+    )
+
+
+def paginate(query, model, sort=("id", False)):
+    """
+        Apply the page of the current request to a query
+
+        Rows are ordered by the sort field, then id, and the page starts
+        after the position carried by the cursor, so every page costs
+        the same as the first one.
+
+        Args:
+            query: The query to paginate
+            model: The model of the query
+            sort: The sort field and whether it is descending
+
+        Returns:
+            tuple: The rows and the pagination fields of the response,
+                empty when the request is not paginated
+    """
+    page = get_page_args()
+    query = order_by_sort(query, model, sort)
+
+    if page is None:
+        return query.all(), {}
+
+    limit, after = page
+
+    if after is not None:
+        query = query.filter(after_position(model, sort, after))
+
+    rows = query.limit(limit + 1).all()
+
+    if len(rows) <= limit:
+        return rows, {"next_cursor": None}
+
+    last = rows[limit - 1]
+
+    return rows[:limit], {
+        "next_cursor": encode_cursor(last.id, sort[0], getattr(last, sort[0]))
+    }
@@ -0,0 +1,172 @@
+"""
+    File for the database connection pool configuration and statistics
+"""
+
+import os
+import time
+import threading
+
+from collections import deque
+from sqlalchemy import exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from settings import get_bool
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+        QueuePool recording checkout waits and new connections
+
+        Attributes:
+            rate_window: Seconds over which the connection creation rate
+                is computed
+    """
+    rate_window = 60
+
+    def __init__(self, *args, **kwargs):
+        """
+            Constructor for InstrumentedQueuePool
+
+            Args:
+                args: The QueuePool arguments
+                kwargs: The QueuePool keyword arguments
+
+            Returns:
+                None
+        """
+        super().__init__(*args, **kwargs)
+
+        self._stats_lock = threading.Lock()
+        self._checkouts = 0
+        self._wait_seconds = 0.0
+        self._max_wait_seconds = 0.0
+        self._timeouts = 0
+        self._connections_created = 0
+        self._created_at = deque()
+
+    def _do_get(self):
+        started = time.perf_counter()
+
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self._timeouts += 1
+            raise
+
+        waited = time.perf_counter() - started
+
+        with self._stats_lock:
+            self._checkouts += 1
+            self._wait_seconds += waited
+            self._max_wait_seconds = max(self._max_wait_seconds, waited)
+
+        return connection
+
+    def _create_connection(self):
+        connection = super()._create_connection()
+
+        with self._stats_lock:
+            self._connections_created += 1
+            self._created_at.append(time.monotonic())
+
+        return connection
+
+    def stats(self):
+        """
+            Statistics of the pool
+
+            Wait times include opening a new connection when the pool
+            has to grow.
+
+            Args:
+                None
+
+            Returns:
+                dict: The pool statistics
+        """
+        now = time.monotonic()
+
+        with self._stats_lock:
+            while self._created_at and now - self._created_at[0] > self.rate_window:
+                self._created_at.popleft()
+
+            return {
+                "size": self.size(),
+                "checked_out": self.checkedout(),
+                "checked_in": self.checkedin(),
+                "overflow": max(self.overflow(), 0),
+                "max_overflow": self._max_overflow,
+                "checkouts": self._checkouts,
+                "checkout_timeouts": self._timeouts,
+                "checkout_wait_seconds_total": self._wait_seconds,
+                "checkout_wait_seconds_max": self._max_wait_seconds,
+                "checkout_wait_seconds_mean": (
+                    self._wait_seconds / self._checkouts if self._checkouts else 0.0
+                ),
+                "connections_created": self._connections_created,
+                "connections_created_per_minute": (
+                    len(self._created_at) * 60 / self.rate_window
+                )
+            }
+
+
+class InstrumentedAsyncQueuePool(InstrumentedQueuePool, AsyncAdaptedQueuePool):
+    """
+        InstrumentedQueuePool for the engines of asyncio drivers
+    """
+
+
+def engine_options(database_url, asynchronous=False):
+    """
+        Build the engine options of a database from the environment
+
+        In-memory SQLite keeps its single shared connection, every other
+        database gets a sized, instrumented queue pool.
+
+        Args:
+            database_url: The database url
+            asynchronous: Whether the options are for an async engine
+
+        Returns:
+            dict: The engine options
+    """
+    options = {
+        "pool_pre_ping": get_bool("DB_POOL_PRE_PING", True),
+        "pool_recycle": int(os.environ.get("DB_POOL_RECYCLE", 1800))
+    }
+
+    url = make_url(database_url)
+
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return options
+
+    options.update({
+        "poolclass": (
+            InstrumentedAsyncQueuePool if asynchronous else InstrumentedQueuePool
+        ),
+        "pool_size": int(os.environ.get("DB_POOL_SIZE", 5)),
+        "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", 10)),
+        "pool_timeout": float(os.environ.get("DB_POOL_TIMEOUT", 30))
+    })
+
+    return options
+
+
+def pool_stats(engine):
+    """
+        Statistics of the pool of an engine
+
+        Args:
+            engine: The engine
+
+        Returns:
+            dict: The pool statistics
+    """
+    pool = engine.pool
+    stats = {"pool": type(pool).__name__, "status": pool.status()}
+
+    if isinstance(pool, InstrumentedQueuePool):
+        stats.update(pool.stats())
+
+    return stats
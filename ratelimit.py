@@ -0,0 +1,318 @@
+"""
+    File for the admission control of the authenticated endpoints: the
+    per-subject rate limits and the concurrency limit
+"""
+
+import os
+import math
+import time
+import threading
+
+from collections import OrderedDict
+from flask import current_app
+from settings import load_object
+
+
+class AdmissionError(Exception):
+    """
+        A request was refused before any work, to be retried later
+
+        Attributes:
+            status_code: 429 when the caller is over its rate limit, 503
+                when the worker is at its concurrency limit
+            description: The error message
+            retry_after: The seconds to wait before retrying
+    """
+    def __init__(self, status_code, description, retry_after):
+        super().__init__(description)
+        self.status_code = status_code
+        self.description = description
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class RateLimitBackend:
+    """
+        Interface of the rate limit backends
+
+        A backend holds one token bucket per key. A shared backend lets
+        the workers of a deployment enforce one limit together.
+    """
+    def acquire(self, key, rate, burst):
+        """
+            Take a token from a bucket
+
+            Args:
+                key: The key of the bucket, a string
+                rate: The tokens added per second
+                burst: The size of the bucket, full when first used
+
+            Returns:
+                float: 0 when a token was taken, otherwise the seconds
+                    until one is available
+        """
+        raise NotImplementedError
+
+    def stats(self):
+        """
+            Statistics of the backend
+
+            Args:
+                None
+
+            Returns:
+                dict: The statistics
+        """
+        return {}
+
+
+class MemoryRateLimitBackend(RateLimitBackend):
+    """
+        In-process backend, each worker enforcing the limits on its own
+
+        The buckets least recently used are dropped past max_keys, which
+        only lets their callers start again with a full bucket.
+    """
+    def __init__(self, max_keys=10000, clock=time.monotonic):
+        """
+            Constructor for MemoryRateLimitBackend
+
+            Args:
+                max_keys: The maximum number of buckets
+                clock: Monotonic clock, replaceable in tests
+
+            Returns:
+                None
+        """
+        self.max_keys = max_keys
+        self.clock = clock
+
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self._limited = 0
+
+    def acquire(self, key, rate, burst):
+        now = self.clock()
+
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / rate
+                self._limited += 1
+
+            self._buckets[key] = (tokens, now)
+
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+
+            return wait
+
+    def stats(self):
+        with self._lock:
+            return {"buckets": len(self._buckets), "limited": self._limited}
+
+
+def load_backend(name):
+    """
+        Build the backend named by RATE_LIMIT_BACKEND
+
+        Args:
+            name: memory, or the module:Class path of a backend
+
+        Returns:
+            RateLimitBackend: The backend
+    """
+    if name == "memory":
+        return MemoryRateLimitBackend(
+            max_keys=int(os.environ.get("RATE_LIMIT_MAX_KEYS", 10000))
+        )
+
+    return load_object(name)()
+
+
+def parse_limits(value):
+    """
+        Parse the rate limits of RATE_LIMITS
+
+        Args:
+            value: Comma separated permission=rate:burst items, rate in
+                requests per second and burst optional, equal to rate by
+                default. The permission * is the limit of every other
+                permission. E.g. *=20:40,get:movie=5
+
+        Returns:
+            dict: The (rate, burst) of each permission
+    """
+    limits = {}
+
+    for item in filter(None, (item.strip() for item in value.split(","))):
+        permission, _, limit = item.rpartition("=")
+        rate, _, burst = limit.partition(":")
+
+        try:
+            rate = float(rate)
+            burst = float(burst) if burst else rate
+        except ValueError:
+            raise ValueError(f"Invalid rate limit {item}.") from None
+
+        if not permission or rate <= 0 or burst < 1:
+            raise ValueError(f"Invalid rate limit {item}.")
+
+        limits[permission] = (rate, burst)
+
+    return limits
+
+
+class ConcurrencyLimiter:
+    """
+        Bound on the requests a worker serves at once
+
+        Used as a context manager around a request, or with acquire and
+        release when the slot outlives the view, e.g. for a streamed
+        body. Past the limit the request waits up to wait seconds, then
+        is refused with a 503.
+
+        Attributes:
+            limit: The number of requests, 0 for no limit
+            wait: The seconds a request may wait for a slot
+    """
+    def __init__(self, limit, wait=0.0):
+        self.limit = limit
+        self.wait = wait
+
+        self._semaphore = threading.BoundedSemaphore(limit) if limit else None
+        self._lock = threading.Lock()
+        self._active = 0
+        self._shed = 0
+
+    def acquire(self):
+        """
+            Take a slot, waiting up to wait seconds for one
+
+            Args:
+                None
+
+            Returns:
+                None
+
+            Raises:
+                AdmissionError: 503 when no slot was freed in time
+        """
+        if self._semaphore is None:
+            return
+
+        if not self._semaphore.acquire(timeout=self.wait):
+            with self._lock:
+                self._shed += 1
+
+            raise AdmissionError(503, "Server busy, retry later.", 1)
+
+        with self._lock:
+            self._active += 1
+
+    def release(self):
+        """
+            Give back the slot taken by acquire
+
+            Args:
+                None
+
+            Returns:
+                None
+        """
+        if self._semaphore is not None:
+            with self._lock:
+                self._active -= 1
+
+            self._semaphore.release()
+
+    def __enter__(self):
+        self.acquire()
+
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def stats(self):
+        with self._lock:
+            return {"limit": self.limit, "active": self._active, "shed": self._shed}
+
+
+RATE_LIMITS = parse_limits(os.environ.get("RATE_LIMITS", ""))
+RATE_LIMITER = load_backend(os.environ.get("RATE_LIMIT_BACKEND", "memory"))
+CONCURRENCY_LIMITER = ConcurrencyLimiter(
+    int(os.environ.get("MAX_CONCURRENT_REQUESTS", 0)),
+    float(os.environ.get("CONCURRENCY_WAIT", 0))
+)
+SUBJECT_CLAIMS = ("sub", "azp", "client_id")
+
+
+def rate_limit(permission, payload):
+    """
+        Count a request against the rate limit of its caller
+
+        The bucket is keyed by the caller and the permission of the
+        endpoint when RATE_LIMITS has a limit for it, otherwise by the
+        caller alone under the * limit, if any. The caller is the first
+        of the SUBJECT_CLAIMS in the token; a token with none of them is
+        not limited, rather than sharing one bucket with every other.
+
+        Args:
+            permission: The permission of the endpoint
+            payload: The verified token payload
+
+        Returns:
+            None
+
+        Raises:
+            AdmissionError: 429 when the caller is over its limit
+    """
+    scope = permission if permission in RATE_LIMITS else "*"
+    limit = RATE_LIMITS.get(scope)
+
+    if limit is None:
+        return
+
+    subject = next(filter(None, map(payload.get, SUBJECT_CLAIMS)), None)
+
+    if subject is None:
+        return
+
+    wait = RATE_LIMITER.acquire(f"{subject} {scope}", *limit)
+
+    if wait > 0:
+        raise AdmissionError(429, "Rate limit exceeded.", wait)
+
+
+def concurrency_limiter():
+    """
+        Get the concurrency limiter of the current app
+
+        An app may have one of its own in app.extensions, e.g. the ASGI
+        app, whose requests must not wait for a slot.
+
+        Args:
+            None
+
+        Returns:
+            ConcurrencyLimiter: The limiter, CONCURRENCY_LIMITER by default
+    """
+    return current_app.extensions.get("concurrency_limiter", CONCURRENCY_LIMITER)
+
+
+def admission_stats():
+    """
+        Statistics of the admission control of this worker
+
+        Args:
+            None
+
+        Returns:
+            dict: The concurrency limiter and rate limiter statistics
+    """
+    return dict(concurrency_limiter().stats(), **RATE_LIMITER.stats())
@@ -0,0 +1,266 @@
+"""
+    File for routing read-only requests to database replicas
+"""
+
+import os
+import time
+import itertools
+import threading
+
+from functools import wraps
+from flask import current_app, g, has_app_context, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, exc
+
+
+REPLICA_PATHS = [
+    url for url in os.environ.get("DATABASE_REPLICA_URLS", "").split(",") if url
+]
+PRIMARY_COOKIE = "read_primary_until"
+
+
+class ReplicaRouter:
+    """
+        Choice of the replica serving a read-only request
+
+        A client that wrote recently reads from the primary for
+        sticky_seconds, so it sees its own writes despite replication
+        lag. The router only knows the writes of its own process; the
+        PRIMARY_COOKIE carries them to the other workers. A replica that
+        fails is skipped for retry_seconds.
+    """
+    def __init__(self, sticky_seconds=5, retry_seconds=30, clock=time.monotonic):
+        """
+            Constructor for ReplicaRouter
+
+            Args:
+                sticky_seconds: Seconds a writer keeps reading the primary
+                retry_seconds: Seconds a failed replica is skipped
+                clock: Monotonic clock, replaceable in tests
+
+            Returns:
+                None
+        """
+        self.sticky_seconds = sticky_seconds
+        self.retry_seconds = retry_seconds
+        self.clock = clock
+
+        self._writers = {}
+        self._unhealthy = {}
+        self._turn = itertools.count()
+        self._lock = threading.Lock()
+
+    def choose(self, bind_keys, subject):
+        """
+            Choose the replica of a read-only request
+
+            Args:
+                bind_keys: The bind keys of the replicas
+                subject: The sub claim of the caller, or None
+
+            Returns:
+                str: The bind key, or None to use the primary
+        """
+        now = self.clock()
+
+        with self._lock:
+            if subject is not None and self._writers.get(subject, 0) > now:
+                return None
+
+            healthy = [
+                key for key in bind_keys if self._unhealthy.get(key, 0) <= now
+            ]
+
+            if not healthy:
+                return None
+
+            return healthy[next(self._turn) % len(healthy)]
+
+    def record_write(self, subject):
+        """
+            Make a client read from the primary for sticky_seconds
+
+            Args:
+                subject: The sub claim of the writer
+
+            Returns:
+                None
+        """
+        now = self.clock()
+
+        with self._lock:
+            self._writers[subject] = now + self.sticky_seconds
+
+            if len(self._writers) > 10000:
+                self._writers = {
+                    key: until for key, until in self._writers.items() if until > now
+                }
+
+    def mark_unhealthy(self, bind_key):
+        """
+            Skip a replica for retry_seconds
+
+            Args:
+                bind_key: The bind key of the replica
+
+            Returns:
+                None
+        """
+        with self._lock:
+            self._unhealthy[bind_key] = self.clock() + self.retry_seconds
+
+
+ROUTER = ReplicaRouter(
+    sticky_seconds=float(os.environ.get("REPLICA_STICKY_SECONDS", 5)),
+    retry_seconds=float(os.environ.get("REPLICA_RETRY_SECONDS", 30))
+)
+
+
+def replica_binds(replica_paths):
+    """
+        Build the SQLALCHEMY_BINDS entries of the replicas
+
+        Args:
+            replica_paths: The replica database urls
+
+        Returns:
+            dict: The binds, keyed replica_0, replica_1, ...
+    """
+    return {
+        f"replica_{number}": url for number, url in enumerate(replica_paths)
+    }
+
+
+class RoutingSession(Session):
+    """
+        Session sending the statements of read-only requests to a replica
+    """
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        """
+            Select the replica chosen for the request, if any
+
+            Flushes always go to the primary.
+
+            Args:
+                mapper: The mapper of the statement
+                clause: The statement
+                bind: An explicit bind
+                kwargs: Other arguments of Session.get_bind
+
+            Returns:
+                Engine: The engine
+        """
+        if bind is None and not self._flushing and has_app_context():
+            bind_key = g.get("db_replica")
+
+            if bind_key is not None:
+                return self._db.engines[bind_key]
+
+        return super().get_bind(mapper, clause, bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def after_commit(session):
+    """
+        Make the committing client sticky to the primary
+
+        The subject is recorded by the router of this process, and the
+        response sets the PRIMARY_COOKIE for the other workers.
+
+        Args:
+            session: The session
+
+        Returns:
+            None
+    """
+    if has_request_context():
+        g.read_primary_until = time.time() + ROUTER.sticky_seconds
+
+    if has_app_context() and g.get("payload") and "sub" in g.payload:
+        ROUTER.record_write(g.payload["sub"])
+
+
+def reads_primary():
+    """
+        Check the PRIMARY_COOKIE of the current request
+
+        Args:
+            None
+
+        Returns:
+            bool: True while the client must read its writes, never
+                longer than sticky_seconds from now
+    """
+    try:
+        until = float(request.cookies.get(PRIMARY_COOKIE, 0))
+    except ValueError:
+        return False
+
+    now = time.time()
+
+    return now < until <= now + ROUTER.sticky_seconds
+
+
+def setup_replicas(app):
+    """
+        Send the PRIMARY_COOKIE to the clients that wrote
+
+        Any worker serving the next reads of the client then reads from
+        the primary until the cookie expires.
+
+        Args:
+            app: The app
+
+        Returns:
+            None
+    """
+    @app.after_request
+    def set_primary_cookie(response):
+        until = g.pop("read_primary_until", None)
+
+        if until is not None:
+            response.set_cookie(
+                PRIMARY_COOKIE, f"{until:.3f}",
+                max_age=max(1, int(ROUTER.sticky_seconds + 1)),
+                httponly=True, samesite="Lax"
+            )
+
+        return response
+
+
+def use_replica(f):
+    """
+        Run a read-only view against a replica
+
+        Clients that wrote recently, known to this process or carrying
+        the PRIMARY_COOKIE, read from the primary. The view runs again
+        on the primary when the replica fails with a connection error.
+
+        Args:
+            f: The view
+
+        Returns:
+            function: The wrapped view
+    """
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        payload = g.get("payload") or {}
+        bind_key = None if reads_primary() else ROUTER.choose(
+            current_app.config.get("REPLICA_BINDS", ()),
+            payload.get("sub")
+        )
+
+        if bind_key is None:
+            return f(*args, **kwargs)
+
+        g.db_replica = bind_key
+
+        try:
+            return f(*args, **kwargs)
+        except (exc.OperationalError, exc.InterfaceError):
+            ROUTER.mark_unhealthy(bind_key)
+            current_app.extensions["sqlalchemy"].session.rollback()
+            g.db_replica = None
+
+            return f(*args, **kwargs)
+    return wrapper
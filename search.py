@@ -0,0 +1,335 @@
+"""
+    File for full-text search over movie titles and actor names
+"""
+
+import re
+
+from flask import request, abort
+from sqlalchemy import bindparam, event, text
+from pagination import MAX_PAGE_SIZE, encode_cursor, get_page_args
+
+
+MAX_SEARCH_TERMS = 8
+
+
+class SearchBackend:
+    """
+        SQL of a full-text index, formatted with the table, the column
+        and the kind of a searchable model
+
+        Attributes:
+            create: Statements creating the index of a table
+            drop: Statements dropping it, before its table is dropped
+            reindex: Statements rebuilding the entries of the rows of :ids
+            rebuild: Statements rebuilding the whole index of a table
+            match: SELECT of the kind, id, label and score of the rows
+                matching :query, higher scores first
+    """
+    create = ()
+    drop = ()
+    reindex = ()
+    rebuild = ()
+    match = ""
+
+    def query(self, terms):
+        """
+            Build the full-text query matching every term as a prefix
+
+            Args:
+                terms: The search terms, made of word characters only
+
+            Returns:
+                str: The query
+        """
+        raise NotImplementedError
+
+
+class PostgresSearch(SearchBackend):
+    """
+        tsvector column with a GIN index, ranked by ts_rank
+
+        The simple configuration neither stems nor drops stop words,
+        which suits titles and names.
+    """
+    create = (
+        "ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_vector tsvector",
+        "CREATE INDEX IF NOT EXISTS ix_{table}_search_vector "
+        "ON {table} USING gin (search_vector)"
+    )
+    reindex = (
+        "UPDATE {table} SET search_vector = "
+        "to_tsvector('simple', coalesce({column}, '')) WHERE id IN :ids",
+    )
+    rebuild = (
+        "UPDATE {table} SET search_vector = "
+        "to_tsvector('simple', coalesce({column}, ''))",
+    )
+    match = (
+        "SELECT '{kind}' AS kind, id, {column} AS label, "
+        "ts_rank(search_vector, to_tsquery('simple', :query))::float8 AS score "
+        "FROM {table} WHERE search_vector @@ to_tsquery('simple', :query)"
+    )
+
+    def query(self, terms):
+        return " & ".join(f"{term}:*" for term in terms)
+
+
+class SQLiteSearch(SearchBackend):
+    """
+        FTS5 table keyed by the row id, ranked by bm25
+
+        bm25 scores are lower for better matches, so they are negated.
+    """
+    create = (
+        "CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts "
+        "USING fts5({column}, prefix='2 3')",
+    )
+    drop = ("DROP TABLE IF EXISTS {table}_fts",)
+    reindex = (
+        "DELETE FROM {table}_fts WHERE rowid IN :ids",
+        "INSERT INTO {table}_fts (rowid, {column}) "
+        "SELECT id, {column} FROM {table} "
+        "WHERE id IN :ids AND {column} IS NOT NULL"
+    )
+    rebuild = (
+        "DELETE FROM {table}_fts",
+        "INSERT INTO {table}_fts (rowid, {column}) "
+        "SELECT id, {column} FROM {table} WHERE {column} IS NOT NULL"
+    )
+    match = (
+        "SELECT '{kind}' AS kind, rowid AS id, {column} AS label, "
+        "-rank AS score FROM {table}_fts WHERE {table}_fts MATCH :query"
+    )
+
+    def query(self, terms):
+        return " ".join(f'"{term}"*' for term in terms)
+
+
+BACKENDS = {
+    "postgresql": PostgresSearch(),
+    "sqlite": SQLiteSearch()
+}
+
+
+def names(model):
+    """
+        Get the names formatting the SQL of a searchable model
+
+        Args:
+            model: The model
+
+        Returns:
+            dict: The table, the column and the kind of the model
+    """
+    return {
+        "table": model.__tablename__,
+        "column": model.search_field,
+        "kind": model.search_kind
+    }
+
+
+def run_ddl(statements, model):
+    """
+        Build a DDL event listener running statements for a model
+
+        Args:
+            statements: The name of the statements attribute of backends
+            model: The model
+
+        Returns:
+            function: The listener
+    """
+    def listener(target, connection, **kwargs):
+        backend = BACKENDS.get(connection.dialect.name)
+
+        if backend is None:
+            return
+
+        for statement in getattr(backend, statements):
+            connection.exec_driver_sql(statement.format(**names(model)))
+    return listener
+
+
+def searchable(model):
+    """
+        Create the full-text index of a model along with its table
+
+        The model names its indexed column in search_field and its
+        result type in search_kind. Its writes must call reindex.
+
+        Args:
+            model: The model
+
+        Returns:
+            type: The model
+    """
+    event.listen(model.__table__, "after_create", run_ddl("create", model))
+    event.listen(model.__table__, "before_drop", run_ddl("drop", model))
+
+    return model
+
+
+def reindex(session, model, ids):
+    """
+        Bring the full-text index of rows in line with the table
+
+        Runs in the current transaction, after the rows were flushed.
+        Inserted, updated and deleted rows are all handled.
+
+        Args:
+            session: The session
+            model: The model of the rows
+            ids: The ids of the rows
+
+        Returns:
+            None
+    """
+    backend = BACKENDS.get(session.get_bind().dialect.name)
+
+    if backend is None or not ids:
+        return
+
+    for statement in backend.reindex:
+        session.execute(
+            text(statement.format(**names(model)))
+            .bindparams(bindparam("ids", expanding=True)),
+            {"ids": list(ids)}
+        )
+
+
+def rebuild(session, model):
+    """
+        Rebuild the full-text index of a whole table
+
+        For rows written without the model methods or bulk_insert, e.g.
+        loaded with raw SQL.
+
+        Args:
+            session: The session
+            model: The model
+
+        Returns:
+            None
+    """
+    backend = BACKENDS.get(session.get_bind().dialect.name)
+
+    if backend is None:
+        return
+
+    for statement in backend.rebuild:
+        session.execute(text(statement.format(**names(model))))
+
+
+def search_terms(q):
+    """
+        Split a search string into terms
+
+        Only word characters are kept, so the terms are safe to embed in
+        the full-text query languages.
+
+        Args:
+            q: The search string
+
+        Returns:
+            list: The lowercase terms, at most MAX_SEARCH_TERMS
+    """
+    return re.findall(r"\w+", q.lower())[:MAX_SEARCH_TERMS]
+
+
+def get_search_args():
+    """
+        Read the q, limit and cursor query parameters
+
+        Args:
+            None
+
+        Returns:
+            tuple: The search terms, the page size and the position of
+                the cursor, or None on the first page
+    """
+    terms = search_terms(request.args.get("q", ""))
+
+    if not terms:
+        abort(400, "Missing search terms.")
+
+    limit, position = get_page_args() or (MAX_PAGE_SIZE, None)
+
+    if position is None:
+        return terms, limit, None
+
+    value = position.get("value")
+
+    if (
+        position.get("sort") != "rank"
+        or not isinstance(value, list) or len(value) != 2
+        or not isinstance(value[0], (int, float))
+        or not isinstance(value[1], str)
+    ):
+        abort(400, "Invalid cursor.")
+
+    return terms, limit, (value[0], value[1], position["id"])
+
+
+def search_cursor(rows, limit):
+    """
+        Build the cursor of the page following search results
+
+        Args:
+            rows: The results, one more than the page size if there are
+                more of them
+            limit: The page size
+
+        Returns:
+            str: The cursor, or None on the last page
+    """
+    if len(rows) <= limit:
+        return None
+
+    kind, last_id, _, score = rows[limit - 1]
+
+    return encode_cursor(last_id, "rank", [score, kind])
+
+
+def search(session, models, terms, limit, after=None):
+    """
+        Search models for rows matching every term, best matches first
+
+        Rows are ordered by score, kind and id, and the page starts after
+        the position of the cursor, as for the list endpoints.
+
+        Args:
+            session: The session
+            models: The searchable models
+            terms: The search terms
+            limit: The number of rows to return
+            after: The (score, kind, id) of the last row of the previous
+                page, or None
+
+        Returns:
+            list: The kind, id, label and score of the rows
+
+        Raises:
+            NotImplementedError: The database has no full-text backend
+    """
+    backend = BACKENDS.get(session.get_bind().dialect.name)
+
+    if backend is None:
+        raise NotImplementedError("Full-text search is not supported.")
+
+    union = " UNION ALL ".join(
+        backend.match.format(**names(model)) for model in models
+    )
+    params = {"query": backend.query(terms), "limit": limit}
+    where = ""
+
+    if after is not None:
+        where = (
+            "WHERE score < :score OR (score = :score AND "
+            "(kind > :kind OR (kind = :kind AND id > :id)))"
+        )
+        params.update(zip(("score", "kind", "id"), after))
+
+    return session.execute(text(
+        f"SELECT kind, id, label, score FROM ({union}) results {where} "
+        "ORDER BY score DESC, kind, id LIMIT :limit"
+    ), params).all()
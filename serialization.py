@@ -0,0 +1,282 @@
+"""
+    File for the JSON provider and the row serializers of the list endpoints
+"""
+
+import os
+import json
+
+from datetime import date, datetime, timezone
+from functools import lru_cache
+from json.encoder import encode_basestring_ascii
+from operator import attrgetter
+from flask import current_app
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import DateTime, Integer, String, inspect
+from metrics import Phase
+from settings import load_object
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+DAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+MONTHS = (
+    "Jan", "Feb", "Mar", "Apr", "May", "Jun",
+    "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"
+)
+
+
+def http_date(value):
+    """
+        Format a date as werkzeug.http.http_date does, three times faster
+
+        Naive datetimes are taken as UTC, dates as midnight UTC.
+
+        Args:
+            value: The date or datetime
+
+        Returns:
+            str: The date, e.g. Fri, 25 May 1979 00:00:00 GMT
+    """
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    elif value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+
+    return "%s, %02d %s %04d %02d:%02d:%02d GMT" % (
+        DAYS[value.weekday()], value.day, MONTHS[value.month - 1],
+        value.year, value.hour, value.minute, value.second
+    )
+
+
+def default(value):
+    """
+        Encode the values JSON has no type for, as DefaultJSONProvider
+
+        Args:
+            value: The value
+
+        Returns:
+            object: A value JSON can encode
+    """
+    if isinstance(value, date):
+        return http_date(value)
+
+    return DefaultJSONProvider.default(value)
+
+
+def has_float(value):
+    """
+        Check whether a document holds a float
+
+        orjson writes floats in another notation than the json module,
+        e.g. 1e-7 for 1e-07, and infinities and NaN as null.
+
+        Args:
+            value: The document
+
+        Returns:
+            bool: True when a float is found
+    """
+    stack = [value]
+
+    while stack:
+        value = stack.pop()
+
+        if isinstance(value, float):
+            return True
+
+        if isinstance(value, dict):
+            stack.extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            stack.extend(value)
+
+    return False
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+        JSON provider encoding with orjson when it is installed
+
+        The output keeps the bytes of DefaultJSONProvider: sorted keys,
+        HTTP dates and escaped non-ASCII text. Documents orjson would
+        encode differently, pretty-printed, not ASCII or holding floats,
+        go through the json module.
+    """
+    default = staticmethod(default)
+
+    def dumps(self, obj, **kwargs):
+        if (
+            orjson is None or not self.sort_keys or not self.ensure_ascii
+            or kwargs.get("separators") != (",", ":") or kwargs.get("indent")
+            or has_float(obj)
+        ):
+            return super().dumps(obj, **kwargs)
+
+        try:
+            text = orjson.dumps(
+                obj,
+                default=self.default,
+                option=orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+            ).decode()
+        except TypeError:
+            return super().dumps(obj, **kwargs)
+
+        if not text.isascii():
+            return super().dumps(obj, **kwargs)
+
+        return text
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+
+        return orjson.loads(s)
+
+
+def load_provider(name):
+    """
+        Get the JSON provider class named by JSON_PROVIDER
+
+        Args:
+            name: default, fast, or the module:Class path of a provider
+
+        Returns:
+            type: The JSONProvider subclass
+    """
+    if name == "default":
+        return DefaultJSONProvider
+
+    if name == "fast":
+        return FastJSONProvider
+
+    return load_object(name)
+
+
+JSON_PROVIDER = load_provider(os.environ.get("JSON_PROVIDER", "fast"))
+
+
+# The typed encoders trust the column type only when the value has it;
+# SQLite keeps whatever was written, e.g. a string in an integer column.
+def encode_int(value):
+    return str(value) if type(value) is int else encode_any(value)
+
+
+def encode_str(value):
+    return encode_basestring_ascii(value) if isinstance(value, str) else encode_any(value)
+
+
+def encode_date(value):
+    return '"' + http_date(value) + '"' if isinstance(value, date) else encode_any(value)
+
+
+def encode_any(value):
+    return json.dumps(value, default=default, sort_keys=True, separators=(",", ":"))
+
+
+ENCODERS = [(Integer, encode_int), (String, encode_str), (DateTime, encode_date)]
+
+
+def field_encoder(model, field):
+    """
+        Pick the encoder of a field from its column type
+
+        Args:
+            model: The model
+            field: The field
+
+        Returns:
+            function: The encoder, from the value to its JSON text
+    """
+    mapper = inspect(model)
+
+    if field in mapper.relationships:
+        serialize = row_serializer(mapper.relationships[field].mapper.class_)
+
+        def encode_rows(rows):
+            return "[" + ",".join(map(serialize, rows)) + "]"
+        return encode_rows
+
+    column_type = mapper.columns[field].type
+
+    for type_, encoder in ENCODERS:
+        if isinstance(column_type, type_):
+            return encoder
+
+    return encode_any
+
+
+@lru_cache(maxsize=None)
+def row_serializer(model, fields=None):
+    """
+        Compile the serializer of the rows of a model
+
+        The serializer writes the JSON text of format(fields) directly,
+        with sorted keys like jsonify, without building a dict per row.
+
+        Args:
+            model: The model, with format_fields
+            fields: The fields to include, format_fields by default
+
+        Returns:
+            function: The serializer, from a row to its JSON text
+    """
+    names = sorted(fields or model.format_fields)
+    getter = attrgetter(*names)
+    encoders = tuple(field_encoder(model, name) for name in names)
+    template = "{" + ",".join(
+        encode_basestring_ascii(name) + ":%s" for name in names
+    ) + "}"
+
+    if len(names) == 1:
+        encoder = encoders[0]
+
+        def serialize(row):
+            return template % encoder(getter(row))
+    else:
+        def serialize(row):
+            return template % tuple([
+                encode(value) for encode, value in zip(encoders, getter(row))
+            ])
+
+    return serialize
+
+
+def list_response(key, rows, model, fields=None, **extra):
+    """
+        Build the response of a list endpoint, byte for byte as jsonify
+
+        Args:
+            key: The key of the row list
+            rows: The rows
+            model: The model of the rows
+            fields: The fields of each row, format_fields by default
+            extra: The other keys of the response
+
+        Returns:
+            Response: The response
+    """
+    provider = current_app.json
+    document = dict(extra, success=True)
+    compact = getattr(provider, "compact", False)
+
+    if (compact is None and current_app.debug) or compact is False:
+        document[key] = [row.format(fields) for row in rows]
+        return provider.response(document)
+
+    with Phase("serialization"):
+        serialize = row_serializer(model, fields)
+        document[key] = None
+        body = ",".join(
+            encode_basestring_ascii(name) + ":" + (
+                "[" + ",".join(map(serialize, rows)) + "]" if name == key
+                else provider.dumps(value, separators=(",", ":"))
+            )
+            for name, value in sorted(document.items())
+        )
+
+    return current_app.response_class(
+        "{" + body + "}\n", mimetype=provider.mimetype
+    )
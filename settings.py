@@ -0,0 +1,41 @@
+"""
+    File for reading the configuration from the environment
+"""
+
+import os
+import importlib
+
+
+def get_bool(name, default):
+    """
+        Read a boolean environment variable
+
+        Args:
+            name: The variable name
+            default: The value when the variable is not set
+
+        Returns:
+            bool: The value
+    """
+    value = os.environ.get(name)
+
+    if value is None:
+        return default
+
+    return value.lower() in ("1", "true", "yes", "on")
+
+
+def load_object(path):
+    """
+        Import the object named by a module:attribute path, such as the
+        class of a pluggable backend
+
+        Args:
+            path: The path, e.g. mypackage.backends:RedisBackend
+
+        Returns:
+            object: The attribute of the module
+    """
+    module, _, attribute = path.partition(":")
+
+    return getattr(importlib.import_module(module), attribute)
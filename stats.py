@@ -0,0 +1,140 @@
+"""
+    File for the actor statistics, read from the actor_stats aggregates
+"""
+
+from sqlalchemy import delete, func, select, true
+from models import (
+    db, ActorStat, NO_MOVIE, AGE_BUCKET_SIZE, actor_groups, update_actor_stats
+)
+
+
+def age_label(bucket):
+    """
+        Name an age bucket
+
+        Args:
+            bucket: The first age of the bucket, -1 when unknown
+
+        Returns:
+            str: The label, e.g. 20-29
+    """
+    if bucket < 0:
+        return "unknown"
+
+    return f"{bucket}-{bucket + AGE_BUCKET_SIZE - 1}"
+
+
+def summarize(rows):
+    """
+        Sum aggregate rows into an actor count, gender split and age
+        histogram
+
+        Args:
+            rows: The (gender, age_bucket, count) rows
+
+        Returns:
+            dict: The statistics
+    """
+    genders = {}
+    ages = {}
+    total = 0
+
+    for gender, bucket, count in rows:
+        if count:
+            genders[gender or "unknown"] = genders.get(gender or "unknown", 0) + count
+            ages[age_label(bucket)] = ages.get(age_label(bucket), 0) + count
+            total += count
+
+    return {"actors": total, "genders": genders, "ages": ages}
+
+
+def movie_stats(movie_ids):
+    """
+        Read the statistics of movies
+
+        Args:
+            movie_ids: The ids of the movies
+
+        Returns:
+            dict: The statistics by movie id, for the movies with actors
+    """
+    groups = {}
+
+    for movie_id, gender, bucket, count in db.session.execute(
+        select(
+            ActorStat.movie_id, ActorStat.gender, ActorStat.age_bucket, ActorStat.count
+        ).where(ActorStat.movie_id.in_(movie_ids), ActorStat.count > 0)
+    ):
+        groups.setdefault(movie_id, []).append((gender, bucket, count))
+
+    return {movie_id: summarize(rows) for movie_id, rows in groups.items()}
+
+
+def list_movie_stats(limit, after_id=None):
+    """
+        Read the statistics of a page of movies with actors, by id
+
+        Args:
+            limit: The number of movies
+            after_id: The id of the last movie of the previous page
+
+        Returns:
+            tuple: The statistics of each movie, with its movie_id, and
+                whether more movies follow
+    """
+    movie_ids = db.session.scalars(
+        select(ActorStat.movie_id).distinct()
+        .where(ActorStat.movie_id > max(after_id or NO_MOVIE, NO_MOVIE), ActorStat.count > 0)
+        .order_by(ActorStat.movie_id)
+        .limit(limit + 1)
+    ).all()
+    stats = movie_stats(movie_ids[:limit])
+
+    return [
+        dict(stats[movie_id], movie_id=movie_id) for movie_id in movie_ids[:limit]
+    ], len(movie_ids) > limit
+
+
+def actor_stats():
+    """
+        Read the statistics of every actor
+
+        The counts of every movie are summed in the query; the table
+        holds a few rows per movie, far fewer than the actors.
+
+        Args:
+            None
+
+        Returns:
+            dict: The statistics, with the number of actors without a movie
+    """
+    without_movie = ActorStat.movie_id == NO_MOVIE
+    rows = db.session.execute(
+        select(
+            ActorStat.gender, ActorStat.age_bucket,
+            func.sum(ActorStat.count),
+            func.sum(ActorStat.count).filter(without_movie)
+        ).group_by(ActorStat.gender, ActorStat.age_bucket)
+    ).all()
+
+    return dict(
+        summarize(row[:3] for row in rows),
+        without_movie=sum(row[3] or 0 for row in rows)
+    )
+
+
+def rebuild_actor_stats():
+    """
+        Recompute the statistics from the actors table, in the current
+        transaction
+
+        Args:
+            None
+
+        Returns:
+            int: The number of aggregate rows
+    """
+    db.session.execute(delete(ActorStat))
+    update_actor_stats(actor_groups(true()))
+
+    return db.session.query(ActorStat).count()
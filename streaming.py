@@ -0,0 +1,77 @@
+"""
+    File for streaming JSON responses of the list endpoints
+"""
+
+import os
+
+from flask import Response, abort, request, stream_with_context
+from serialization import row_serializer
+
+
+STREAM_CHUNK_SIZE = int(os.environ.get("STREAM_CHUNK_SIZE", 1000))
+
+
+def wants_stream():
+    """
+        Check whether the request asks for a streamed response
+
+        Args:
+            None
+
+        Returns:
+            bool: True when the stream query parameter is true
+    """
+    if request.args.get("stream", "").lower() not in ("1", "true"):
+        return False
+
+    if "limit" in request.args or "cursor" in request.args:
+        abort(400, "Streaming cannot be combined with limit or cursor.")
+
+    return True
+
+
+def stream_list(key, query, fields=None, chunk_size=None):
+    """
+        Stream the rows of a query as {"<key>": [...], "success": true}
+
+        Rows are read from a server-side cursor chunk_size at a time and
+        each chunk is serialized and sent before the next one is read, so
+        memory does not grow with the number of rows. Keys are in the
+        same order as jsonify, which sorts them.
+
+        Args:
+            key: The key of the row list
+            query: The query of the rows of one model
+            fields: The fields of each row, None for every field
+            chunk_size: The number of rows per chunk, STREAM_CHUNK_SIZE
+                by default
+
+        Returns:
+            Response: The streamed response
+    """
+    chunk_size = chunk_size or STREAM_CHUNK_SIZE
+    serialize = row_serializer(query.column_descriptions[0]["entity"], fields)
+
+    def generate():
+        yield '{"%s":[' % key
+
+        separator = ""
+        chunk = []
+
+        for row in query.yield_per(chunk_size):
+            chunk.append(serialize(row))
+
+            if len(chunk) == chunk_size:
+                yield separator + ",".join(chunk)
+                separator = ","
+                chunk = []
+
+        if chunk:
+            yield separator + ",".join(chunk)
+
+        yield '],"success":true}'
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="application/json"
+    )
@@ -0,0 +1,1798 @@
+"""
+    File for testing the endpoints against SQLite and a local issuer
+"""
+
+
+import io
+import os
+import csv
+import gzip
+import json
+import zlib
+import tempfile
+import unittest
+import unittest.mock
+
+from contextlib import ExitStack, contextmanager
+from datetime import date, datetime, timedelta, timezone
+from sqlalchemy import event, text
+
+os.environ.setdefault("AUTH0_DOMAIN", "casting.local")
+os.environ.setdefault("ALGORITHMS", "RS256")
+os.environ.setdefault("API_AUDIENCE", "casting")
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import auth
+import compression
+from app import APP, create_app
+from auth import JWKSStore
+from local_issuer import LocalIssuer
+from cache import invalidate
+from models import db, Movie, Actor, bump_versions
+from pagination import encode_cursor
+from ratelimit import ConcurrencyLimiter, MemoryRateLimitBackend
+
+PERMISSIONS = [
+    "get:movie", "post:movie", "patch:movie", "delete:movie",
+    "get:actor", "post:actor", "patch:actor", "delete:actor", "get:health"
+]
+
+
+ISSUER = LocalIssuer(bits=1024)
+
+
+def setUpModule():
+    """Serve the keys of the local issuer for the whole module."""
+    auth.JWKS_STORE = JWKSStore(ISSUER.serve())
+
+
+def tearDownModule():
+    ISSUER.stop()
+
+
+class APITestCase(unittest.TestCase):
+    """Base test case with an empty database and a producer token"""
+
+    issuer = ISSUER
+    token = ISSUER.mint(PERMISSIONS)
+
+    def setUp(self):
+        """Define test variables and reset the database."""
+        self.app = APP
+        self.app.testing = True
+        self.client = self.app.test_client()
+        self.headers = {"Authorization": "Bearer " + self.token}
+
+        with self.app.app_context():
+            db.drop_all()
+            db.create_all()
+
+        invalidate(("movies", "actors"))
+
+    def seed(self, movies, actors_per_movie=0):
+        """Insert movies with their casts."""
+        with self.app.app_context():
+            for number in range(movies):
+                movie = Movie(title=f"Movie {number}", release_date=None)
+                db.session.add(movie)
+                db.session.flush()
+
+                for actor in range(actors_per_movie):
+                    db.session.add(Actor(
+                        name=f"Actor {number}.{actor}",
+                        age=20 + actor,
+                        gender="Female" if actor % 2 else "Male",
+                        movie_id=movie.id
+                    ))
+
+            bump_versions("movies", "actors")
+            db.session.commit()
+
+    def get(self, url, headers=None, **kwargs):
+        return self.client.get(url, headers=headers or self.headers, **kwargs)
+
+    @contextmanager
+    def count_queries(self):
+        """Collect the SQL statements run inside the block."""
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        with self.app.app_context():
+            engine = db.engine
+
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+
+        try:
+            yield statements
+        finally:
+            event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+class FileAppTestCase(unittest.TestCase):
+    """Base test case with an app of its own on SQLite files"""
+
+    features = {}
+    replicas = 0
+
+    def setUp(self):
+        """Create the app, with the features enabled, and its tables."""
+        self.directory = tempfile.TemporaryDirectory()
+        database = f"sqlite:///{self.directory.name}/primary.db"
+        replica_paths = [
+            f"sqlite:///{self.directory.name}/replica_{number}.db"
+            for number in range(self.replicas)
+        ]
+
+        with ExitStack() as stack:
+            for name, value in self.features.items():
+                stack.enter_context(unittest.mock.patch(f"app.{name}", value))
+
+            self.app = create_app(database, replica_paths)
+
+        with self.app.app_context():
+            db.create_all(bind_key=None)
+
+            for bind_key in self.app.config["REPLICA_BINDS"]:
+                db.metadata.create_all(db.engines[bind_key])
+
+        invalidate(("movies", "actors"))
+        self.client = self.app.test_client()
+        self.headers = {"Authorization": "Bearer " + ISSUER.mint(PERMISSIONS)}
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+
+            for engine in db.engines.values():
+                engine.dispose()
+
+        self.directory.cleanup()
+
+
+class PaginationTestCase(APITestCase):
+    """This class represents the keyset pagination test case"""
+
+    def test_no_parameters_return_everything(self):
+        """Test unpaginated requests keep the old response"""
+        self.seed(5)
+        data = self.get("/movies").get_json()
+
+        self.assertEqual(len(data["movies"]), 5)
+        self.assertNotIn("next_cursor", data)
+
+    def test_pages_follow_the_cursor(self):
+        """Test walking every page with next_cursor"""
+        self.seed(5)
+        ids = []
+        url = "/movies?limit=2"
+
+        while True:
+            data = self.get(url).get_json()
+            ids.extend(movie["id"] for movie in data["movies"])
+
+            if data["next_cursor"] is None:
+                break
+
+            url = f"/movies?limit=2&cursor={data['next_cursor']}"
+
+        self.assertEqual(ids, [1, 2, 3, 4, 5])
+
+    def test_page_size_is_capped(self):
+        """Test the limit cannot exceed MAX_PAGE_SIZE"""
+        self.seed(3, actors_per_movie=1)
+
+        with unittest.mock.patch("pagination.MAX_PAGE_SIZE", 2):
+            data = self.get("/actors?limit=1000").get_json()
+            self.assertEqual(len(data["actors"]), 2)
+
+            data = self.get("/movies?limit=1000").get_json()
+            self.assertEqual(len(data["movies"]), 2)
+            self.assertIsNotNone(data["next_cursor"])
+
+    def test_invalid_cursor(self):
+        """Test a malformed cursor is rejected"""
+        response = self.get("/movies?cursor=not-a-cursor")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.get_json()["success"])
+
+    def test_invalid_limit(self):
+        """Test a non positive limit is rejected"""
+        self.assertEqual(self.get("/actors?limit=0").status_code, 400)
+        self.assertEqual(self.get("/actors?limit=ten").status_code, 400)
+
+
+class QueryCountTestCase(APITestCase):
+    """This class represents the N+1 query test case"""
+
+    def test_movie_list_query_count_is_fixed(self):
+        """Test listing movies costs the same number of queries at any size"""
+        self.seed(2, actors_per_movie=2)
+
+        with self.count_queries() as few:
+            self.assertEqual(len(self.get("/movies").get_json()["movies"]), 2)
+
+        self.seed(20, actors_per_movie=2)
+
+        with self.count_queries() as many:
+            data = self.get("/movies?limit=15").get_json()
+
+        self.assertEqual(len(data["movies"]), 15)
+        self.assertEqual(len(data["movies"][-1]["actors"]), 2)
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(
+            len([s for s in many if "table_versions" not in s]), 2
+        )
+
+    def test_update_movie_loads_cast_in_one_query(self):
+        """Test the update response does not load actors one by one"""
+        self.seed(1, actors_per_movie=5)
+
+        with self.count_queries() as statements:
+            response = self.client.patch(
+                "/movies/1",
+                headers=self.headers,
+                json={"title": "Recast"}
+            )
+
+        self.assertEqual(len(response.get_json()["updated"]["actors"]), 5)
+        self.assertEqual(
+            len([s for s in statements if "FROM actors" in s]), 1
+        )
+
+
+    def test_single_writes_take_one_statement(self):
+        """Test single updates and deletes do not read the row first"""
+        self.seed(1, actors_per_movie=2)
+
+        def rows_read(statements):
+            # The actor statistics count the groups before and after.
+            return [s for s in statements if s.startswith("SELECT") and "count(*)" not in s]
+
+        with self.count_queries() as statements:
+            response = self.client.patch(
+                "/actors/1", headers=self.headers, json={"age": 41}
+            )
+
+        self.assertEqual(response.get_json()["updated"], {
+            "id": 1, "name": "Actor 0.0", "age": 41, "gender": "Male", "movie_id": 1
+        })
+        self.assertEqual(rows_read(statements), [])
+        self.assertEqual(
+            len([s for s in statements if s.startswith("UPDATE actors SET")]), 1
+        )
+
+        for method, url, body, count in [
+            ("PATCH", "/actors/9", {"age": 41}, 2),
+            ("PATCH", "/actors/9", {"name": "Missing"}, 1),
+            ("PATCH", "/movies/9", {"title": "Missing"}, 1),
+            ("DELETE", "/actors/9", None, 2)
+        ]:
+            with self.count_queries() as statements:
+                response = self.client.open(
+                    url, method=method, headers=self.headers, json=body
+                )
+
+            self.assertEqual(response.status_code, 404)
+            self.assertEqual(len(statements), count, statements)
+
+        with self.count_queries() as statements:
+            response = self.client.delete("/actors/2", headers=self.headers)
+
+        self.assertEqual(response.get_json(), {"success": True, "deleted": 2})
+        self.assertEqual(rows_read(statements), [])
+        self.assertEqual(self.client.delete("/actors/2", headers=self.headers).status_code, 404)
+
+
+class StreamingTestCase(APITestCase):
+    """This class represents the streamed list test case"""
+
+    def test_stream_matches_the_buffered_response(self):
+        """Test the streamed body decodes to the same document"""
+        self.seed(7, actors_per_movie=2)
+
+        for resource in ("movies", "actors"):
+            buffered = self.get(f"/{resource}").get_json()
+
+            with unittest.mock.patch("streaming.STREAM_CHUNK_SIZE", 3):
+                response = self.get(f"/{resource}?stream=true", buffered=False)
+                body = b"".join(response.iter_encoded())
+
+            self.assertEqual(response.mimetype, "application/json")
+            self.assertEqual(json.loads(body), buffered)
+
+    def test_stream_sends_rows_in_chunks(self):
+        """Test rows are written chunk by chunk"""
+        self.seed(7)
+
+        with unittest.mock.patch("streaming.STREAM_CHUNK_SIZE", 3):
+            response = self.get("/movies?stream=true", buffered=False)
+            chunks = list(response.iter_encoded())
+
+        self.assertEqual(len(chunks), 5)
+        self.assertEqual(json.loads(b"".join(chunks))["movies"][6]["id"], 7)
+
+    def test_empty_stream(self):
+        """Test streaming an empty table"""
+        data = self.get("/actors?stream=true").get_json()
+
+        self.assertEqual(data, {"actors": [], "success": True})
+
+    def test_stream_rejects_pagination(self):
+        """Test stream cannot be combined with a page"""
+        self.assertEqual(self.get("/actors?stream=1&limit=2").status_code, 400)
+
+
+class ExportTestCase(APITestCase):
+    """This class represents the table export test case"""
+
+    def export(self, url, accept=None):
+        headers = dict(self.headers, **({"Accept": accept} if accept else {}))
+
+        with unittest.mock.patch("export.EXPORT_CHUNK_SIZE", 3):
+            response = self.get(url, headers=headers, buffered=False)
+            chunks = list(response.iter_encoded())
+
+        return response, chunks
+
+    def test_ndjson_export(self):
+        """Test every row is streamed as one JSON line, chunk by chunk"""
+        self.seed(7, actors_per_movie=2)
+        self.client.patch("/movies/1", headers=self.headers, json={
+            "release_date": "1979-05-25"
+        })
+
+        response, chunks = self.export("/export/movies")
+        lines = b"".join(chunks).decode().splitlines()
+
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual([json.loads(line)["id"] for line in lines], list(range(1, 8)))
+        self.assertEqual(json.loads(lines[0]), {
+            "id": 1, "title": "Movie 0", "release_date": "1979-05-25T00:00:00"
+        })
+
+        response, chunks = self.export("/export/actors", "application/x-ndjson")
+        lines = b"".join(chunks).decode().splitlines()
+
+        self.assertEqual(len(lines), 14)
+        self.assertEqual(json.loads(lines[13]), {
+            "id": 14, "name": "Actor 6.1", "age": 21, "gender": "Female", "movie_id": 7
+        })
+
+    def test_csv_export(self):
+        """Test the CSV export has a header and the same rows"""
+        self.seed(2, actors_per_movie=2)
+        self.client.patch("/actors/1", headers=self.headers, json={"gender": 'Say "hi", ok'})
+
+        response, chunks = self.export("/export/actors", "text/csv, */*;q=0.1")
+        rows = list(csv.reader(b"".join(chunks).decode().splitlines()))
+
+        self.assertEqual(response.mimetype, "text/csv")
+        self.assertIn("actors.csv", response.headers["Content-Disposition"])
+        self.assertEqual(rows[0], ["id", "name", "age", "gender", "movie_id"])
+        self.assertEqual(rows[1], ["1", "Actor 0.0", "20", 'Say "hi", ok', "1"])
+        self.assertEqual(len(rows), 5)
+
+        response, chunks = self.export("/export/movies", "text/csv")
+        self.assertEqual(b"".join(chunks).decode().splitlines()[1], "1,Movie 0,")
+
+    def test_resume_after_an_id(self):
+        """Test an export resumes after the last id received"""
+        self.seed(7)
+
+        _, chunks = self.export("/export/movies?after=5")
+        self.assertEqual(
+            [json.loads(line)["id"] for line in b"".join(chunks).splitlines()], [6, 7]
+        )
+
+        _, chunks = self.export("/export/movies?after=7", "text/csv")
+        self.assertEqual(b"".join(chunks), b"id,title,release_date\n")
+
+        self.assertEqual(self.get("/export/movies?after=-1").status_code, 400)
+        self.assertEqual(self.get("/export/movies?after=%C2%B2").status_code, 400)
+
+    def test_export_negotiation(self):
+        """Test unsupported formats and missing permissions are refused"""
+        response = self.get("/export/movies", headers=dict(self.headers, Accept="application/json"))
+        self.assertEqual(response.status_code, 406)
+
+        token = self.issuer.mint(["get:movie"])
+        response = self.get("/export/actors", headers={"Authorization": "Bearer " + token})
+        self.assertEqual(response.status_code, 403)
+
+
+class BulkCreateTestCase(APITestCase):
+    """This class represents the bulk create test case"""
+
+    def post(self, url, body):
+        return self.client.post(url, headers=self.headers, json=body)
+
+    def test_bulk_create_movies(self):
+        """Test creating movies in one request"""
+        response = self.post("/movies/bulk", [
+            {"title": f"Movie {number}", "release_date": "2023-01-0%d" % (number + 1)}
+            for number in range(3)
+        ])
+        data = response.get_json()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data["created"], [1, 2, 3])
+        self.assertEqual(len(self.get("/movies").get_json()["movies"]), 3)
+
+    def test_bulk_create_actors_in_one_transaction(self):
+        """Test the actors are written in one transaction, with one INSERT
+        where the database can match RETURNING to the rows in batches,
+        and one INSERT per row on SQLite"""
+        self.seed(1)
+
+        with self.count_queries() as statements:
+            response = self.post("/actors/bulk", [
+                {"name": f"Actor {number}", "age": 30, "gender": "Male", "movie_id": 1}
+                for number in range(50)
+            ])
+
+        with self.app.app_context():
+            dialect = db.engine.dialect.name
+
+        self.assertEqual(response.get_json()["created"], list(range(1, 51)))
+        self.assertEqual(
+            len([s for s in statements if s.startswith("INSERT INTO actors (")]),
+            1 if dialect == "postgresql" else 50
+        )
+
+    def test_errors_are_reported_by_index(self):
+        """Test nothing is written when a record is invalid"""
+        self.seed(1)
+        response = self.post("/actors/bulk", [
+            {"name": "Valid", "age": 30, "gender": "Male", "movie_id": 1},
+            {"name": "No age", "gender": "Male", "movie_id": 1},
+            {"name": "No movie", "age": 30, "gender": "Male", "movie_id": 99}
+        ])
+        data = response.get_json()
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error["index"] for error in data["errors"]], [1, 2])
+        self.assertEqual(self.get("/actors").get_json()["actors"], [])
+
+    def test_batch_cap(self):
+        """Test requests over BULK_MAX_RECORDS are rejected"""
+        with unittest.mock.patch("bulk.BULK_MAX_RECORDS", 2):
+            response = self.post("/movies/bulk", [
+                {"title": "Movie", "release_date": "2023-01-01"}
+            ] * 3)
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_bulk_create_requires_permission(self):
+        """Test the bulk endpoints check the post permission"""
+        token = self.issuer.mint(["get:movie"])
+        response = self.client.post(
+            "/movies/bulk",
+            headers={"Authorization": "Bearer " + token},
+            json=[{"title": "Movie", "release_date": "2023-01-01"}]
+        )
+
+        self.assertEqual(response.status_code, 403)
+
+
+class BatchTestCase(APITestCase):
+    """This class represents the batch update and delete test case"""
+
+    def batch(self, method, url, body, headers=None):
+        return self.client.open(url, method=method, json=body, headers=headers or self.headers)
+
+    def test_recast_in_one_statement(self):
+        """Test many actors are moved with one UPDATE and one commit"""
+        self.seed(2, 100)
+
+        with self.count_queries() as statements:
+            response = self.batch("PATCH", "/actors/batch", {
+                "ids": list(range(1, 101)) + [999], "patch": {"movie_id": 2}
+            })
+
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data["updated"], list(range(1, 101)))
+        self.assertEqual(data["not_found"], [999])
+        self.assertEqual(
+            len([s for s in statements if s.startswith("UPDATE actors SET")]), 1
+        )
+        self.assertLess(len(statements), 10)
+
+        movies = self.get("/movies").get_json()["movies"]
+        self.assertEqual([len(movie["actors"]) for movie in movies], [0, 200])
+
+    def test_update_keeps_the_search_index_in_sync(self):
+        """Test a batch update reindexes the updated rows"""
+        self.seed(3)
+        self.get("/search?q=sequel")
+
+        response = self.batch("PATCH", "/movies/batch", {
+            "ids": [1, 3], "patch": {"title": "Sequel", "release_date": "2001-01-01"}
+        })
+
+        self.assertEqual(response.get_json()["updated"], [1, 3])
+        results = self.get("/search?q=sequel").get_json()["results"]
+        self.assertEqual(sorted(result["id"] for result in results), [1, 3])
+
+    def test_delete_movies_keeps_their_actors(self):
+        """Test deleted movies leave their actors without a movie"""
+        from search import rebuild
+
+        self.seed(3, 2)
+
+        with self.app.app_context():
+            rebuild(db.session, Movie)
+            db.session.commit()
+
+        response = self.batch("DELETE", "/movies/batch", {"ids": [2, 3, 3, 7]})
+        data = response.get_json()
+
+        self.assertEqual((data["deleted"], data["not_found"]), ([2, 3], [7]))
+        self.assertEqual(
+            [movie["id"] for movie in self.get("/movies").get_json()["movies"]], [1]
+        )
+        self.assertEqual(
+            [actor["movie_id"] for actor in self.get("/actors").get_json()["actors"]],
+            [1, 1, None, None, None, None]
+        )
+        self.assertEqual(
+            [result["id"] for result in self.get("/search?q=movie").get_json()["results"]],
+            [1]
+        )
+
+    def test_delete_actors(self):
+        """Test many actors are deleted with one DELETE"""
+        self.seed(1, 5)
+
+        with self.count_queries() as statements:
+            response = self.batch("DELETE", "/actors/batch", {"ids": [1, 2, 3]})
+
+        self.assertEqual(response.get_json()["deleted"], [1, 2, 3])
+        self.assertEqual(
+            len([s for s in statements if s.startswith("DELETE FROM actors ")]), 1
+        )
+        self.assertEqual(len(self.get("/actors").get_json()["actors"]), 2)
+
+    def test_invalid_batches(self):
+        """Test invalid ids and patches are rejected before any write"""
+        self.seed(1, 1)
+
+        for method, url, body in [
+            ("DELETE", "/actors/batch", {"ids": []}),
+            ("DELETE", "/actors/batch", {"ids": ["1"]}),
+            ("DELETE", "/actors/batch", [1]),
+            ("PATCH", "/actors/batch", {"ids": [1]}),
+            ("PATCH", "/actors/batch", {"ids": [1], "patch": {"age": -1}}),
+            ("PATCH", "/actors/batch", {"ids": [1], "patch": {"movie_id": 9}}),
+            ("PATCH", "/actors/batch", {"ids": [1], "patch": {"id": 9}}),
+            ("PATCH", "/movies/batch", {"ids": [1], "patch": {"release_date": "May"}})
+        ]:
+            response = self.batch(method, url, body)
+            self.assertEqual(response.status_code, 400, (url, body))
+
+        with unittest.mock.patch("bulk.BULK_MAX_RECORDS", 2):
+            response = self.batch("DELETE", "/actors/batch", {"ids": [1, 2, 3]})
+        self.assertEqual(response.status_code, 400)
+
+        self.assertEqual(self.get("/actors").get_json()["actors"][0]["age"], 20)
+
+    def test_batch_requires_permission(self):
+        """Test the batch endpoints check their permission once"""
+        self.seed(1, 1)
+        headers = {"Authorization": "Bearer " + self.issuer.mint(["patch:actor"])}
+
+        response = self.batch("DELETE", "/actors/batch", {"ids": [1]}, headers)
+        self.assertEqual(response.status_code, 403)
+
+        response = self.batch(
+            "PATCH", "/actors/batch", {"ids": [1], "patch": {"age": 40}}, headers
+        )
+        self.assertEqual(response.status_code, 200)
+
+
+class StatsTestCase(APITestCase):
+    """This class represents the actor statistics test case"""
+
+    def write(self, method, url, body=None):
+        response = self.client.open(url, method=method, json=body, headers=self.headers)
+        self.assertEqual(response.status_code, 200, response.get_json())
+
+    def assertConsistent(self):
+        """Check the maintained aggregates against a rebuild."""
+        from models import ActorStat
+        from stats import rebuild_actor_stats
+
+        def rows():
+            return sorted(
+                (row.movie_id, row.gender, row.age_bucket, row.count)
+                for row in db.session.query(ActorStat) if row.count
+            )
+
+        with self.app.app_context():
+            maintained = rows()
+            rebuild_actor_stats()
+            self.assertEqual(maintained, rows())
+            db.session.rollback()
+
+    def test_stats_follow_every_write_path(self):
+        """Test inserts, updates and deletes keep the aggregates exact"""
+        for title in ("Alien", "Aliens", "Alien 3"):
+            self.write("POST", "/movies", {"title": title, "release_date": "1979-05-25"})
+
+        self.write("POST", "/actors/bulk", [
+            {"name": f"Actor {number}", "age": 20 + number * 7,
+             "gender": "Female" if number % 2 else "Male", "movie_id": 1 + number % 2}
+            for number in range(6)
+        ])
+        self.write("POST", "/actors", {
+            "name": "Newt", "age": 10, "gender": "Female", "movie_id": 2
+        })
+        self.assertConsistent()
+
+        stats = self.get("/stats/movies/1").get_json()["stats"]
+        self.assertEqual(stats, {
+            "movie_id": 1, "actors": 3, "genders": {"Male": 3},
+            "ages": {"20-29": 1, "30-39": 1, "40-49": 1}
+        })
+
+        self.write("PATCH", "/actors/1", {"movie_id": 3, "age": 61})
+        self.write("PATCH", "/actors/1", {"name": "Renamed"})
+        self.write("PATCH", "/actors/batch", {"ids": [2, 4], "patch": {"gender": "Other"}})
+        self.write("DELETE", "/actors/3")
+        self.assertConsistent()
+
+        self.write("DELETE", "/movies/2")
+        self.write("DELETE", "/movies/batch", {"ids": [3]})
+        self.assertConsistent()
+
+        stats = self.get("/stats/actors").get_json()["stats"]
+        self.assertEqual(stats["actors"], 6)
+        self.assertEqual(stats["without_movie"], 5)
+        self.assertEqual(stats["genders"], {"Male": 2, "Female": 2, "Other": 2})
+
+    def test_model_methods_keep_the_stats(self):
+        """Test the Movie and Actor methods maintain the aggregates"""
+        with self.app.app_context():
+            movie = Movie(title="Alien", release_date=None)
+            movie.insert()
+            actor = Actor(name="Ripley", age=30, gender="Female", movie_id=movie.id)
+            actor.insert()
+            actor.age = 45
+            actor.update()
+            Actor(name="Ash", age=40, gender="Male", movie_id=movie.id).insert()
+            movie.delete()
+
+        self.assertConsistent()
+        self.assertEqual(self.get("/stats/actors").get_json()["stats"]["without_movie"], 2)
+
+    def test_writes_apply_their_net_change_once(self):
+        """Test a write upserts only the changed groups, in key order"""
+        self.write("POST", "/movies", {"title": "Alien", "release_date": "1979-05-25"})
+        self.write("POST", "/actors", {
+            "name": "Ripley", "age": 38, "gender": "Female", "movie_id": 1
+        })
+
+        with self.count_queries() as statements:
+            self.write("PATCH", "/actors/1", {"age": 22})
+            self.write("PATCH", "/actors/1", {"name": "Ellen Ripley"})
+
+        upserts = [s for s in statements if s.startswith("INSERT INTO actor_stats")]
+        self.assertEqual(len(upserts), 1)
+        self.assertEqual(upserts[0].count("(?, ?, ?, ?)"), 2)
+        self.assertConsistent()
+
+        with self.app.app_context():
+            from models import ActorStat
+
+            self.assertEqual(
+                [(row.age_bucket, row.count) for row in
+                 db.session.query(ActorStat).order_by(ActorStat.age_bucket)],
+                [(20, 1), (30, 0)]
+            )
+
+    def test_reads_use_the_aggregates(self):
+        """Test the stats endpoints do not scan the actors table"""
+        self.write("POST", "/movies", {"title": "Alien", "release_date": "1979-05-25"})
+        self.write("POST", "/movies", {"title": "Heat", "release_date": "1995-12-15"})
+        self.write("POST", "/actors/bulk", [
+            {"name": "Actor", "age": 30, "gender": "Male", "movie_id": movie_id}
+            for movie_id in (1, 2, 2)
+        ])
+
+        with self.count_queries() as statements:
+            first = self.get("/stats/movies?limit=1").get_json()
+            second = self.get(f"/stats/movies?cursor={first['next_cursor']}&limit=1").get_json()
+
+        self.assertEqual([movie["actors"] for movie in first["movies"] + second["movies"]], [1, 2])
+        self.assertIsNone(second["next_cursor"])
+        self.assertEqual([s for s in statements if "FROM actors" in s], [])
+
+        self.write("POST", "/movies", {"title": "Empty", "release_date": "2000-01-01"})
+        self.assertEqual(self.get("/stats/movies/3").get_json()["stats"]["actors"], 0)
+        self.assertEqual(self.get("/stats/movies/9").status_code, 404)
+
+
+class ImportTestCase(APITestCase):
+    """This class represents the file import test case"""
+
+    def run_import(self, model, text, format_="ndjson", **kwargs):
+        from importer import import_records, read_records
+
+        with self.app.app_context():
+            return import_records(
+                model, read_records(io.StringIO(text), format_), batch_size=2, **kwargs
+            )
+
+    def test_import_keeps_indexes_and_stats(self):
+        """Test imported rows are searchable, counted and versioned"""
+        etag = self.get("/movies").headers["ETag"]
+        movies = "".join(
+            json.dumps({"title": f"Heist {number}", "release_date": "1995-12-15"}) + "\n"
+            for number in range(3)
+        )
+        actors = "name,age,gender,movie_id\nPacino,55,Male,1\nKilmer,35,Male,2\nAshley,24,Female,2\n"
+
+        self.assertEqual(self.run_import(Movie, movies)["imported"], 3)
+        self.assertEqual(self.run_import(Actor, actors, "csv", mode="batch")["imported"], 3)
+
+        self.assertNotEqual(self.get("/movies").headers["ETag"], etag)
+        self.assertEqual(self.get("/search?q=heist").get_json()["results"][0]["type"], "movie")
+        self.assertEqual(self.get("/stats/movies/2").get_json()["stats"]["genders"], {
+            "Male": 1, "Female": 1
+        })
+        self.assertEqual(self.get("/stats/actors").get_json()["stats"]["actors"], 3)
+
+    def test_invalid_records_stop_the_import(self):
+        """Test atomic imports keep nothing and batch imports keep the batches before"""
+        from importer import ImportFailed
+
+        self.seed(1)
+        actors = "".join(
+            json.dumps({"name": "Actor", "age": 30, "gender": "Male", "movie_id": movie_id}) + "\n"
+            for movie_id in (1, 1, 1, 9, 1)
+        )
+
+        for mode, imported in (("atomic", 0), ("batch", 2)):
+            with self.assertRaises(ImportFailed) as failure:
+                self.run_import(Actor, actors, mode=mode)
+
+            self.assertEqual(failure.exception.errors, [{"index": 3, "message": "Movie not found."}])
+            self.assertEqual(failure.exception.imported, imported)
+            self.assertEqual(len(self.get("/actors").get_json()["actors"]), imported)
+
+    def test_csv_integers_are_ascii_digits(self):
+        """Test non-ASCII digits are reported as invalid, not converted"""
+        from importer import ImportFailed
+
+        self.seed(1)
+
+        with self.assertRaises(ImportFailed) as failure:
+            self.run_import(Actor, "name,age,gender,movie_id\nRipley,\u00b2,Female,1\n", "csv")
+
+        self.assertEqual(failure.exception.errors, [{"index": 0, "message": "Missing or invalid age."}])
+
+    def test_copy_is_only_used_with_psycopg2(self):
+        """Test other PostgreSQL drivers, e.g. asyncpg, insert the rows"""
+        from importer import insert_rows
+
+        dialect = unittest.mock.Mock(driver="asyncpg")
+        dialect.name = "postgresql"
+        row = {"title": "Alien", "release_date": datetime(1979, 5, 25)}
+
+        with self.app.app_context(), \
+                unittest.mock.patch("importer.copy_rows") as copy_rows, \
+                unittest.mock.patch.object(db.session, "get_bind") as get_bind:
+            get_bind.return_value.dialect = dialect
+            insert_rows(Movie, [row])
+            dialect.driver = "psycopg2"
+            insert_rows(Movie, [row])
+            db.session.rollback()
+
+        copy_rows.assert_called_once_with(Movie, [row])
+
+    def test_failed_batch_keeps_the_sequence_ahead(self):
+        """Test each committed batch with ids moves the id sequence first"""
+        from importer import ImportFailed
+
+        movies = "".join(
+            json.dumps({"id": id_, "title": "Heat", "release_date": date}) + "\n"
+            for id_, date in ((10, "1995-12-15"), (11, "1995-12-15"), (12, "May 25"))
+        )
+
+        with unittest.mock.patch("importer.advance_sequence") as advance_sequence:
+            with self.assertRaises(ImportFailed) as failure:
+                self.run_import(Movie, movies, mode="batch")
+
+        self.assertEqual(failure.exception.imported, 2)
+        advance_sequence.assert_called_once_with(Movie)
+
+        response = self.client.post("/movies", headers=self.headers, json={
+            "title": "Alien", "release_date": "1979-05-25"
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [movie["id"] for movie in self.get("/movies").get_json()["movies"]], [10, 11, 12]
+        )
+
+    def test_movie_ids_are_checked_once_per_batch(self):
+        """Test the foreign keys are checked in bulk"""
+        self.seed(1)
+        actors = "".join(
+            json.dumps({"name": "Actor", "age": 30, "gender": "Male", "movie_id": 1}) + "\n"
+            for _ in range(6)
+        )
+
+        with self.count_queries() as statements:
+            self.run_import(Actor, actors)
+
+        self.assertEqual(len([s for s in statements if "FROM movies" in s]), 3)
+
+    def test_export_round_trip(self):
+        """Test an export imports back with its ids"""
+        self.seed(3, actors_per_movie=2)
+
+        def export(url, accept="application/x-ndjson"):
+            response = self.get(url, headers=dict(self.headers, Accept=accept))
+            return response.get_data(as_text=True)
+
+        with self.app.app_context():
+            db.session.execute(text("UPDATE movies SET release_date = '2000-01-01 00:00:00'"))
+            db.session.commit()
+
+        movies, actors = export("/export/movies"), export("/export/actors", "text/csv")
+        self.setUp()
+
+        self.run_import(Movie, movies)
+        self.run_import(Actor, actors, "csv")
+
+        self.assertEqual(export("/export/movies"), movies)
+        self.assertEqual(export("/export/actors", "text/csv"), actors)
+        self.assertEqual(self.get("/movies").get_json()["movies"][2]["actors"][1]["id"], 6)
+
+    def test_upload_endpoint(self):
+        """Test files are uploaded to the import endpoints when enabled"""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        with unittest.mock.patch("app.IMPORT_ENABLED", True):
+            app = create_app(f"sqlite:///{directory.name}/import.db", replica_paths=[])
+
+        with app.app_context():
+            db.create_all(bind_key=None)
+            db.session.add(Movie(title="Alien", release_date=datetime(1979, 5, 25)))
+            db.session.commit()
+
+
+        def dispose():
+            with app.app_context():
+                db.session.remove()
+                db.engine.dispose()
+
+        self.addCleanup(dispose)
+        client = app.test_client()
+
+        response = client.post(
+            "/import/actors?mode=batch", headers=self.headers, content_type="text/csv",
+            data="name,age,gender,movie_id\nRipley,30,Female,1\nAsh,40,Male,7\n"
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()["errors"], [{"index": 1, "message": "Movie not found."}])
+
+        response = client.post(
+            "/import/movies", headers=self.headers, content_type="application/x-ndjson",
+            data='{"title": "Alien", "release_date": "1979-05-25"}\n'
+        )
+        self.assertEqual(response.get_json()["imported"], 1)
+        self.assertIn("rows_per_second", response.get_json())
+
+        response = client.post(
+            "/import/movies", headers=self.headers, content_type="application/json", data="[]"
+        )
+        self.assertEqual(response.status_code, 415)
+        self.assertEqual(self.client.post("/import/movies", headers=self.headers).status_code, 404)
+
+
+class CompressionTestCase(APITestCase):
+    """This class represents the response compression test case"""
+
+    def gzip_headers(self, accept="gzip, deflate", **headers):
+        return dict(self.headers, **{"Accept-Encoding": accept}, **headers)
+
+    def test_buffered_lists_are_compressed(self):
+        """Test large lists are gzipped and keep an ETag of their own"""
+        self.seed(30, actors_per_movie=3)
+        identity = self.get("/movies")
+        response = self.get("/movies", headers=self.gzip_headers())
+
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response.headers["Vary"])
+        self.assertIn("Accept-Encoding", identity.headers["Vary"])
+        self.assertNotIn("Content-Encoding", identity.headers)
+        self.assertEqual(gzip.decompress(response.data), identity.data)
+        self.assertLess(len(response.data), len(identity.data) / 4)
+        self.assertEqual(response.headers["ETag"], identity.headers["ETag"][:-1] + '-gzip"')
+
+        for etag in (identity.headers["ETag"], response.headers["ETag"]):
+            revalidated = self.get("/movies", headers=self.gzip_headers(**{"If-None-Match": etag}))
+            self.assertEqual(revalidated.status_code, 304)
+            self.assertEqual(revalidated.headers["ETag"], etag)
+            self.assertIn("Accept-Encoding", revalidated.headers["Vary"])
+
+    def test_small_and_refused_responses_are_not_compressed(self):
+        """Test the size threshold and the identity coding"""
+        self.seed(30, actors_per_movie=3)
+
+        for url, accept in (
+            ("/movies?limit=1", "gzip"),
+            ("/movies", "identity"),
+            ("/movies", "gzip;q=0"),
+            ("/movies?sort=bogus", "gzip")
+        ):
+            response = self.get(url, headers=self.gzip_headers(accept))
+            self.assertNotIn("Content-Encoding", response.headers, url)
+
+    def test_streamed_responses_are_compressed_chunk_by_chunk(self):
+        """Test every chunk of a stream is flushed compressed"""
+        self.seed(7, actors_per_movie=2)
+
+        for url in ("/movies?stream=true", "/export/actors"):
+            identity = b"".join(self.get(url, buffered=False).iter_encoded())
+
+            with unittest.mock.patch("streaming.STREAM_CHUNK_SIZE", 3), \
+                    unittest.mock.patch("export.EXPORT_CHUNK_SIZE", 3):
+                response = self.get(url, headers=self.gzip_headers(), buffered=False)
+                chunks = list(response.iter_encoded())
+
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            first = decompressor.decompress(chunks[0] + chunks[1])
+
+            self.assertEqual(response.headers["Content-Encoding"], "gzip", url)
+            self.assertNotIn("Content-Length", response.headers)
+            self.assertGreater(len(chunks), 3)
+            self.assertTrue(identity.startswith(first) and first, url)
+            self.assertEqual(gzip.decompress(b"".join(chunks)), identity)
+
+    @unittest.skipIf(compression.brotli is None, "brotli is not installed")
+    def test_brotli_is_preferred(self):
+        """Test br wins a tie with gzip"""
+        self.seed(30, actors_per_movie=3)
+        identity = self.get("/actors")
+        response = self.get("/actors", headers=self.gzip_headers("gzip, br"))
+
+        self.assertEqual(response.headers["Content-Encoding"], "br")
+        self.assertEqual(compression.brotli.decompress(response.data), identity.data)
+
+
+class AdmissionTestCase(APITestCase):
+    """This class represents the rate limit and load shedding test case"""
+
+    def setUp(self):
+        """Limit get:movie to a burst of 2 per subject."""
+        super().setUp()
+        self.seed(1)
+        patches = [
+            unittest.mock.patch("ratelimit.RATE_LIMITS", {"get:movie": (1, 2)}),
+            unittest.mock.patch("ratelimit.RATE_LIMITER", MemoryRateLimitBackend())
+        ]
+
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_subjects_are_rate_limited_per_permission(self):
+        """Test a caller over its limit gets 429 without touching the database"""
+        statuses = [self.get("/movies").status_code for _ in range(2)]
+
+        with self.count_queries() as statements:
+            response = self.get("/movies")
+
+        self.assertEqual(statuses, [200, 200])
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers["Retry-After"], "1")
+        self.assertEqual(response.get_json()["message"], "Rate limit exceeded.")
+        self.assertEqual(statements, [])
+
+        other = {"Authorization": "Bearer " + self.issuer.mint(PERMISSIONS, sub="local|other")}
+        self.assertEqual(self.get("/movies", headers=other).status_code, 200)
+        self.assertEqual(self.get("/actors").status_code, 200)
+
+        with unittest.mock.patch("ratelimit.RATE_LIMITS", {"*": (1, 1)}):
+            self.assertEqual(self.get("/actors").status_code, 200)
+            self.assertEqual(self.get("/actors").status_code, 429)
+
+    def test_excess_load_is_shed(self):
+        """Test requests past the concurrency limit get 503 before any work"""
+        limiter = ConcurrencyLimiter(1)
+
+        with unittest.mock.patch("ratelimit.CONCURRENCY_LIMITER", limiter):
+            with limiter:
+                with self.count_queries() as statements:
+                    response = self.get("/movies")
+
+            self.assertEqual(self.get("/movies").status_code, 200)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["Retry-After"], "1")
+        self.assertEqual(statements, [])
+        self.assertEqual(limiter.stats(), {"limit": 1, "active": 0, "shed": 1})
+        self.assertEqual(self.get("/health/admission").status_code, 200)
+
+    def test_streamed_responses_hold_their_slot(self):
+        """Test a streamed body keeps its concurrency slot until closed"""
+        limiter = ConcurrencyLimiter(1)
+
+        with unittest.mock.patch("ratelimit.CONCURRENCY_LIMITER", limiter):
+            response = self.get("/movies?stream=true", buffered=False)
+
+            self.assertEqual(limiter.stats()["active"], 1)
+            self.assertEqual(self.get("/movies").status_code, 503)
+
+            b"".join(response.iter_encoded())
+            response.close()
+
+            self.assertEqual(limiter.stats()["active"], 0)
+            self.assertEqual(self.get("/movies").status_code, 200)
+
+
+class MovieDateTestCase(APITestCase):
+    """This class represents the movie release date test case"""
+
+    def test_release_dates_are_parsed(self):
+        """Test single writes store the date on any database"""
+        response = self.client.post("/movies", headers=self.headers, json={
+            "title": "Alien", "release_date": "1979-05-25"
+        })
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.patch("/movies/1", headers=self.headers, json={
+            "release_date": "1986-07-18"
+        })
+        self.assertEqual(
+            response.get_json()["updated"]["release_date"],
+            "Fri, 18 Jul 1986 00:00:00 GMT"
+        )
+
+        response = self.client.post("/movies", headers=self.headers, json={
+            "title": "Alien", "release_date": "May 25"
+        })
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.patch("/movies/1", headers=self.headers, json={
+            "release_date": "May 25"
+        })
+        self.assertEqual(response.status_code, 400)
+
+
+class PoolStatsTestCase(APITestCase):
+    """This class represents the pool statistics endpoint test case"""
+
+    def test_get_pool_stats(self):
+        """Test the pool statistics are exposed"""
+        data = self.get("/health/pool").get_json()
+
+        self.assertTrue(data["success"])
+        self.assertIn("status", data["pool"])
+
+    def test_health_requires_a_permission(self):
+        """Test the statistics are only served with get:health"""
+        headers = {"Authorization": "Bearer " + self.issuer.mint(["get:movie"])}
+
+        for path in ("/health/pool", "/health/cache", "/health/admission"):
+            self.assertEqual(self.client.get(path).status_code, 401)
+            self.assertEqual(self.get(path, headers=headers).status_code, 403)
+
+
+class ETagTestCase(APITestCase):
+    """This class represents the conditional list request test case"""
+
+    def test_not_modified_without_reading_rows(self):
+        """Test a matching If-None-Match gets a 304 from the versions alone"""
+        self.seed(3, actors_per_movie=1)
+        etag = self.get("/movies").headers["ETag"]
+
+        with self.count_queries() as statements:
+            response = self.get("/movies", headers={
+                **self.headers, "If-None-Match": etag
+            })
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers["ETag"], etag)
+        self.assertEqual(response.data, b"")
+        self.assertEqual(len(statements), 1)
+        self.assertIn("table_versions", statements[0])
+
+    def test_writes_change_the_etag(self):
+        """Test model writes bump the versions of the affected lists"""
+        self.seed(1)
+        movies = self.get("/movies").headers["ETag"]
+        actors = self.get("/actors").headers["ETag"]
+
+        self.client.post("/actors", headers=self.headers, json={
+            "name": "Actor", "age": 30, "gender": "Male", "movie_id": 1
+        })
+
+        self.assertNotEqual(self.get("/movies").headers["ETag"], movies)
+        self.assertNotEqual(self.get("/actors").headers["ETag"], actors)
+
+        movies = self.get("/movies").headers["ETag"]
+        actors = self.get("/actors").headers["ETag"]
+        self.client.patch("/movies/1", headers=self.headers, json={"title": "New"})
+
+        self.assertNotEqual(self.get("/movies").headers["ETag"], movies)
+        self.assertEqual(self.get("/actors").headers["ETag"], actors)
+
+    def test_bulk_writes_change_the_etag(self):
+        """Test bulk inserts bump the versions"""
+        etag = self.get("/movies").headers["ETag"]
+        self.client.post("/movies/bulk", headers=self.headers, json=[
+            {"title": "Movie", "release_date": "2023-01-01"}
+        ])
+
+        self.assertNotEqual(self.get("/movies").headers["ETag"], etag)
+
+    def test_pages_have_their_own_etag(self):
+        """Test the query string is part of the ETag"""
+        self.seed(3)
+        etag = self.get("/movies?limit=1").headers["ETag"]
+
+        self.assertNotEqual(self.get("/movies?limit=2").headers["ETag"], etag)
+        self.assertEqual(self.get("/movies?limit=2", headers={
+            **self.headers, "If-None-Match": etag
+        }).status_code, 200)
+
+    def test_permissions_have_their_own_etag(self):
+        """Test a caller without get:actor never matches a search with actors"""
+        self.seed(1, actors_per_movie=1)
+        response = self.get("/search?q=Movie")
+        movies_only = {
+            "Authorization": "Bearer " + self.issuer.mint(["get:movie"]),
+            "If-None-Match": response.headers["ETag"]
+        }
+
+        self.assertIn("Authorization", response.headers["Vary"])
+        self.assertEqual(self.get("/search?q=Movie", headers=movies_only).status_code, 200)
+
+
+class ResponseCacheTestCase(APITestCase):
+    """This class represents the response cache test case"""
+
+    def test_repeat_reads_are_served_from_the_cache(self):
+        """Test a repeat read only reads the table versions"""
+        self.seed(3, actors_per_movie=2)
+        body = self.get("/movies").data
+
+        with self.count_queries() as statements:
+            response = self.get("/movies")
+
+        self.assertEqual(response.data, body)
+        self.assertEqual(len(statements), 1)
+        self.assertIn("table_versions", statements[0])
+
+    def test_no_stale_read_after_a_write(self):
+        """Test every write path drops the cached lists"""
+        self.seed(1, actors_per_movie=1)
+        self.get("/movies")
+        self.get("/actors")
+
+        self.client.patch("/actors/1", headers=self.headers, json={"name": "Renamed"})
+
+        self.assertEqual(self.get("/actors").get_json()["actors"][0]["name"], "Renamed")
+        self.assertEqual(
+            self.get("/movies").get_json()["movies"][0]["actors"][0]["name"],
+            "Renamed"
+        )
+
+        self.client.delete("/movies/1", headers=self.headers)
+
+        self.assertEqual(self.get("/movies").get_json()["movies"], [])
+        self.assertIsNone(self.get("/actors").get_json()["actors"][0]["movie_id"])
+
+    def test_scopes_do_not_share_entries(self):
+        """Test callers with other permissions get their own entries"""
+        self.seed(1)
+        hits = self.get("/health/cache").get_json()["cache"]["hits"]
+        self.get("/movies")
+        token = self.issuer.mint(["get:movie"])
+        self.client.get("/movies", headers={"Authorization": "Bearer " + token})
+
+        stats = self.get("/health/cache").get_json()["cache"]
+
+        self.assertEqual(stats["entries"], 2)
+        self.assertEqual(stats["hits"], hits)
+
+    def test_memory_backend_bounds(self):
+        """Test entries are evicted by count, size and age"""
+        from cache import MemoryCacheBackend
+
+        clock = unittest.mock.Mock(return_value=0)
+        backend = MemoryCacheBackend(max_entries=2, max_bytes=10, ttl=5, clock=clock)
+        backend.set("a", "a", 4, ["movies"])
+        backend.set("b", "b", 4, ["actors"])
+        backend.set("c", "c", 4, ["actors"])
+
+        self.assertIsNone(backend.get("a"))
+        self.assertEqual(backend.stats()["bytes"], 8)
+
+        backend.invalidate(["actors"])
+        self.assertEqual(backend.stats()["entries"], 0)
+
+        backend.set("d", "d", 4, ["movies"])
+        clock.return_value = 6
+        self.assertIsNone(backend.get("d"))
+
+
+class FieldsetTestCase(APITestCase):
+    """This class represents the sparse fieldset test case"""
+
+    def test_fields_limit_keys_and_columns(self):
+        """Test only the requested columns are selected and serialized"""
+        self.seed(3, actors_per_movie=2)
+
+        with self.count_queries() as statements:
+            data = self.get("/movies?fields=id,title").get_json()
+
+        rows = [s for s in statements if "table_versions" not in s]
+
+        self.assertEqual(data["movies"][0], {"id": 1, "title": "Movie 0"})
+        self.assertEqual(len(rows), 1)
+        self.assertNotIn("release_date", rows[0])
+
+    def test_fields_with_relationship(self):
+        """Test the cast is loaded when requested"""
+        self.seed(2, actors_per_movie=2)
+        data = self.get("/movies?fields=actors").get_json()
+
+        self.assertEqual(set(data["movies"][0]), {"actors"})
+        self.assertEqual(len(data["movies"][1]["actors"]), 2)
+
+    def test_fields_with_pagination_and_stream(self):
+        """Test fieldsets combine with pages and streams"""
+        self.seed(3, actors_per_movie=1)
+        page = self.get("/actors?fields=name&limit=2").get_json()
+        stream = self.get("/actors?fields=name,age&stream=true").get_json()
+
+        self.assertEqual(page["actors"], [{"name": "Actor 0.0"}, {"name": "Actor 1.0"}])
+        self.assertIsNotNone(page["next_cursor"])
+        self.assertEqual(stream["actors"][2], {"name": "Actor 2.0", "age": 20})
+
+    def test_unknown_fields_are_rejected(self):
+        """Test unknown or empty fieldsets get a 400"""
+        self.assertEqual(self.get("/actors?fields=id,salary").status_code, 400)
+        self.assertEqual(self.get("/movies?fields=").status_code, 400)
+
+
+class FilterTestCase(APITestCase):
+    """This class represents the filtering and sorting test case"""
+
+    def ids(self, url):
+        data = self.get(url).get_json()
+        return [row["id"] for row in data[url[1:].split("?")[0]]]
+
+    def test_movie_filters(self):
+        """Test the title prefix and release date range"""
+        self.client.post("/movies/bulk", headers=self.headers, json=[
+            {"title": "Alien", "release_date": "1979-05-25"},
+            {"title": "Aliens", "release_date": "1986-07-18"},
+            {"title": "Blade Runner", "release_date": "1982-06-25"}
+        ])
+
+        self.assertEqual(self.ids("/movies?title_prefix=Alien"), [1, 2])
+        self.assertEqual(self.ids(
+            "/movies?release_date_from=1980-01-01&release_date_to=1986-07-18"
+        ), [2, 3])
+        self.assertEqual(self.get("/movies?release_date_to=soon").status_code, 400)
+
+    def test_title_prefix_is_exact(self):
+        """Test the prefix matches case, punctuation, wildcards and any code point"""
+        self.client.post("/movies/bulk", headers=self.headers, json=[
+            {"title": title, "release_date": "2000-01-01"}
+            for title in ("AC/DC", "abz", "Abz", "100% Wolf", "100 Wolves", "\U0010ffffA")
+        ])
+
+        self.assertEqual(self.ids("/movies?title_prefix=AC/"), [1])
+        self.assertEqual(self.ids("/movies?title_prefix=Ab"), [3])
+        self.assertEqual(self.ids("/movies?title_prefix=100%25"), [4])
+        self.assertEqual(self.ids("/movies?title_prefix=%F4%8F%BF%BF"), [6])
+        self.assertEqual(self.ids("/movies?title_prefix=%ED%9F%BF"), [])
+
+    def test_actor_filters(self):
+        """Test the age range, gender and movie filters"""
+        self.seed(2, actors_per_movie=4)
+
+        self.assertEqual(self.ids("/actors?age_min=21&age_max=22"), [2, 3, 6, 7])
+        self.assertEqual(self.ids("/actors?gender=Female&movie_id=2"), [6, 8])
+        self.assertEqual(self.get("/actors?age_min=old").status_code, 400)
+
+    def test_sort_with_pagination(self):
+        """Test keyset pages follow the sort order, NULLs last"""
+        self.seed(1, actors_per_movie=5)
+        self.client.post("/actors", headers=self.headers, json={
+            "name": "Ageless", "age": 0, "gender": "Male", "movie_id": 1
+        })
+
+        with self.app.app_context():
+            db.session.get(Actor, 6).age = None
+            db.session.commit()
+
+        ids = []
+        url = "/actors?sort=-age&limit=2"
+
+        while url:
+            data = self.get(url).get_json()
+            ids.extend(actor["id"] for actor in data["actors"])
+            url = data["next_cursor"] and f"/actors?sort=-age&limit=2&cursor={data['next_cursor']}"
+
+        self.assertEqual(ids, [5, 4, 3, 2, 1, 6])
+        self.assertEqual(self.ids("/actors?sort=-age&stream=1"), ids)
+
+    def test_sort_is_whitelisted(self):
+        """Test unknown sort fields and foreign cursors are rejected"""
+        self.seed(3)
+        cursor = self.get("/movies?sort=title&limit=1").get_json()["next_cursor"]
+
+        self.assertEqual(self.get("/movies?sort=gender").status_code, 400)
+        self.assertEqual(self.get("/movies?sort=--title").status_code, 400)
+        self.assertEqual(self.get(f"/movies?limit=1&cursor={cursor}").status_code, 400)
+
+    def test_tampered_cursors_are_rejected(self):
+        """Test cursor values of another type than the sort column get 400"""
+        self.seed(3)
+        cases = [
+            ("title", encode_cursor(1, "title", 5)),
+            ("title", encode_cursor(1, "title", ["Movie 1"])),
+            ("release_date", encode_cursor(1, "release_date", 5)),
+            ("-release_date", encode_cursor(1, "release_date", "May 25")),
+            ("title", encode_cursor(True, "title", "Movie 1"))
+        ]
+
+        for sort, cursor in cases:
+            response = self.get(f"/movies?sort={sort}&limit=1&cursor={cursor}")
+            self.assertEqual(response.status_code, 400)
+
+        cursor = encode_cursor(1, "age", "30")
+        self.assertEqual(self.get(f"/actors?sort=age&limit=1&cursor={cursor}").status_code, 400)
+
+    def test_filters_use_indexes(self):
+        """Test the query plans of the filters on a seeded database"""
+        from filters import filter_actors, filter_movies
+
+        self.seed(200, actors_per_movie=5)
+        cases = [
+            ("/movies?title_prefix=Movie 1", filter_movies, Movie, "ix_movies_title"),
+            ("/movies?release_date_from=2023-01-01", filter_movies, Movie, "ix_movies_release_date"),
+            ("/actors?movie_id=3", filter_actors, Actor, "ix_actors_movie_id"),
+            ("/actors?age_min=30&age_max=31", filter_actors, Actor, "ix_actors_age"),
+            ("/actors?gender=Male&age_min=30", filter_actors, Actor, "ix_actors_gender_age")
+        ]
+
+        for url, apply_filters, model, index in cases:
+            with self.app.test_request_context(url):
+                statement = apply_filters(model.query, model).statement
+                sql = str(statement.compile(db.engine, compile_kwargs={"literal_binds": True}))
+                plan = " ".join(
+                    row[-1] for row in db.session.execute(text("EXPLAIN QUERY PLAN " + sql))
+                )
+
+            self.assertIn(index, plan, url)
+
+
+class SerializationTestCase(APITestCase):
+    """This class represents the JSON provider and serializer test case"""
+
+    def setUp(self):
+        super().setUp()
+
+        with self.app.app_context():
+            movies = [
+                Movie(title="Amélie", release_date=datetime(2001, 4, 25)),
+                Movie(title='Quote "and" \\ slash', release_date=None),
+                Movie(title=None, release_date=datetime(1999, 12, 31, 23, 59, 58))
+            ]
+            db.session.add_all(movies)
+            db.session.flush()
+            db.session.add_all([
+                Actor(name="Audrey Tautou", age=24, gender="Female", movie_id=1),
+                Actor(name="Mathieu Kassovitz", age=None, gender=None, movie_id=1),
+                Actor(name="日本", age=30, gender="Male", movie_id=None)
+            ])
+            db.session.commit()
+
+    def test_http_date_matches_werkzeug(self):
+        """Test the date formatter against werkzeug.http.http_date"""
+        from werkzeug.http import http_date as werkzeug_http_date
+        from serialization import http_date
+
+        values = [
+            datetime(1979, 5, 25), datetime(5, 1, 1, 3, 4, 5), date(2024, 2, 29),
+            datetime(2001, 1, 1, 1, 0, tzinfo=timezone(timedelta(hours=3)))
+        ]
+
+        for value in values:
+            self.assertEqual(http_date(value), werkzeug_http_date(value))
+
+    def test_list_responses_are_byte_compatible(self):
+        """Test list bodies equal jsonify of format() with the default provider"""
+        from flask.json.provider import DefaultJSONProvider
+        from serialization import list_response
+
+        cases = [
+            ("movies", Movie, None), ("movies", Movie, ("title", "id")),
+            ("actors", Actor, None), ("actors", Actor, ("age",))
+        ]
+
+        for key, model, fields in cases:
+            with self.app.test_request_context():
+                rows = model.query.order_by(model.id).all()
+                body = list_response(key, rows, model, fields, next_cursor="abc").get_data()
+                expected = DefaultJSONProvider(self.app).response({
+                    "success": True,
+                    key: [row.format(fields) for row in rows],
+                    "next_cursor": "abc"
+                }).get_data()
+
+            self.assertEqual(body, expected, (key, fields))
+
+    def test_mistyped_values_stay_valid_json(self):
+        """Test values SQLite stored with another type than their column"""
+        from flask.json.provider import DefaultJSONProvider
+        from serialization import list_response
+
+        with self.app.app_context():
+            db.session.execute(text(
+                "UPDATE actors SET age = 'abc', name = 7, gender = 2.5 WHERE id = 1"
+            ))
+            db.session.commit()
+
+        with self.app.test_request_context():
+            rows = Actor.query.order_by(Actor.id).all()
+            body = list_response("actors", rows, Actor, None).get_data()
+            expected = DefaultJSONProvider(self.app).response({
+                "success": True, "actors": [row.format() for row in rows]
+            }).get_data()
+
+        self.assertEqual(body, expected)
+        self.assertEqual(json.loads(body)["actors"][0]["age"], "abc")
+        self.assertEqual(self.get("/actors?stream=1").get_json()["actors"][0]["age"], "abc")
+
+        for patch in [{"age": "abc"}, {"age": -1}, {"name": ""}, {"movie_id": 9}, {}]:
+            response = self.client.patch("/actors/2", headers=self.headers, json=patch)
+            self.assertEqual(response.status_code, 400, patch)
+
+        response = self.client.patch("/actors/2", headers=self.headers, json={"age": 0})
+        self.assertEqual(response.get_json()["updated"]["age"], 0)
+
+    def test_provider_is_byte_compatible(self):
+        """Test the fast provider matches the default one"""
+        from flask.json.provider import DefaultJSONProvider
+        from serialization import FastJSONProvider
+
+        document = {
+            "b": [1, None, True, "é"], "a": {"z": datetime(2001, 4, 25), "y": "x"},
+            "c": date(2020, 1, 2)
+        }
+
+        floats = {"rank": [1e-07, 1e16, 2.5e-05, 0.5, float("inf"), float("nan")]}
+
+        for value in (document, {"ascii": [1, 2, {"k": datetime(1970, 1, 1)}]}, floats):
+            self.assertEqual(
+                FastJSONProvider(self.app).response(value).get_data(),
+                DefaultJSONProvider(self.app).response(value).get_data()
+            )
+
+        self.assertEqual(FastJSONProvider(self.app).loads('{"a": [1]}'), {"a": [1]})
+
+    def test_endpoints_use_the_serializers(self):
+        """Test the buffered and streamed lists decode to format()"""
+        data = self.get("/movies").get_json()
+
+        self.assertEqual(data["movies"][0]["title"], "Amélie")
+        self.assertEqual(data["movies"][0]["release_date"], "Wed, 25 Apr 2001 00:00:00 GMT")
+        self.assertEqual(len(data["movies"][0]["actors"]), 2)
+        self.assertEqual(self.get("/movies?stream=1").get_json(), data)
+
+
+class SearchTestCase(APITestCase):
+    """This class represents the full-text search test case"""
+
+    def setUp(self):
+        super().setUp()
+        self.client.post("/movies/bulk", headers=self.headers, json=[
+            {"title": "Star Wars", "release_date": "1977-05-25"},
+            {"title": "Star Trek", "release_date": "1979-12-07"},
+            {"title": "Wars of the Roses", "release_date": "1989-12-08"}
+        ])
+        self.client.post("/actors/bulk", headers=self.headers, json=[
+            {"name": "Harrison Ford", "age": 35, "gender": "Male", "movie_id": 1},
+            {"name": "Carrie Fisher", "age": 21, "gender": "Female", "movie_id": 1},
+            {"name": "Starla Wars", "age": 30, "gender": "Female", "movie_id": 3}
+        ])
+
+    def results(self, url, headers=None):
+        response = self.get(url, headers)
+        self.assertEqual(response.status_code, 200)
+        return [(row["type"], row["id"]) for row in response.get_json()["results"]]
+
+    def test_search_matches_every_term_as_a_prefix(self):
+        """Test titles and names match on word prefixes, best first"""
+        self.assertEqual(
+            sorted(self.results("/search?q=star")),
+            [("actor", 3), ("movie", 1), ("movie", 2)]
+        )
+        self.assertEqual(self.results("/search?q=WAR%20star"), [("actor", 3), ("movie", 1)])
+        self.assertEqual(self.results("/search?q=ford"), [("actor", 1)])
+        self.assertEqual(self.results("/search?q=ars"), [])
+
+        data = self.get("/search?q=roses").get_json()
+        self.assertEqual(data["results"][0]["title"], "Wars of the Roses")
+        self.assertIsNone(data["next_cursor"])
+
+    def test_writes_keep_the_index_in_sync(self):
+        """Test the model insert, update and delete paths reindex"""
+        self.client.post("/actors", headers=self.headers, json={
+            "name": "Mark Hamill", "age": 25, "gender": "Male", "movie_id": 1
+        })
+        self.assertEqual(self.results("/search?q=hamill"), [("actor", 4)])
+
+        self.client.patch("/movies/2", headers=self.headers, json={"title": "Dune"})
+        self.assertEqual(self.results("/search?q=trek"), [])
+        self.assertEqual(self.results("/search?q=dune"), [("movie", 2)])
+
+        self.client.delete("/actors/1", headers=self.headers)
+        self.assertEqual(self.results("/search?q=harrison"), [])
+
+    def test_search_pages(self):
+        """Test keyset pages cover the results once, in rank order"""
+        everything = self.results("/search?q=s")
+        pages = []
+        url = "/search?q=s&limit=1"
+
+        while url:
+            data = self.get(url).get_json()
+            pages.extend((row["type"], row["id"]) for row in data["results"])
+            url = data["next_cursor"] and f"/search?q=s&limit=1&cursor={data['next_cursor']}"
+
+        self.assertEqual(len(everything), 3)
+        self.assertEqual(pages, everything)
+
+        cursor = self.get("/movies?sort=title&limit=1").get_json()["next_cursor"]
+        self.assertEqual(self.get(f"/search?q=s&cursor={cursor}").status_code, 400)
+
+    def test_search_arguments_and_permissions(self):
+        """Test empty queries are rejected and actors need get:actor"""
+        self.assertEqual(self.get("/search?q=%20-").status_code, 400)
+        self.assertEqual(self.get("/search").status_code, 400)
+
+        token = self.issuer.mint(["get:movie"])
+        self.assertEqual(
+            self.results("/search?q=star", {"Authorization": "Bearer " + token}),
+            [("movie", 1), ("movie", 2)]
+        )
+
+
+class MetricsTestCase(FileAppTestCase):
+    """This class represents the request metrics test case"""
+
+    features = {"METRICS_ENABLED": True}
+
+    def setUp(self):
+        """Create an instrumented app with one movie."""
+        super().setUp()
+
+        with self.app.app_context():
+            db.session.add(Movie(title="Alien", release_date=datetime(1979, 5, 25)))
+            db.session.commit()
+
+    def test_server_timing_header(self):
+        """Test the phases of a request are reported to the client"""
+        response = self.client.get("/movies?limit=1", headers=self.headers)
+        timings = {
+            metric.split(";")[0]: metric
+            for metric in response.headers["Server-Timing"].split(", ")
+        }
+
+        self.assertEqual(set(timings), {"auth", "db", "serialization", "total"})
+        self.assertIn('desc="3 queries"', timings["db"])
+        self.assertGreater(float(timings["total"].split("dur=")[1]), 0)
+
+        response = self.client.get("/movies")
+        self.assertEqual(response.status_code, 401)
+        self.assertIn("auth;dur=", response.headers["Server-Timing"])
+
+    def test_metrics_endpoint(self):
+        """Test the per-route histograms are exported to Prometheus"""
+        for _ in range(3):
+            self.client.get("/movies?limit=1", headers=self.headers)
+
+        self.client.patch("/movies/1", headers=self.headers, json={"title": "Aliens"})
+        response = self.client.get("/metrics", headers=self.headers)
+        text = response.get_data(as_text=True)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "text/plain")
+        self.assertIn(
+            'casting_requests_total{route="/movies",method="GET",status="200"} 3', text
+        )
+        self.assertIn(
+            'casting_request_duration_seconds_count'
+            '{route="/movies",method="GET",phase="db"} 3', text
+        )
+        self.assertIn(
+            'casting_request_queries_bucket'
+            '{route="/movies/<int:movie_id>",method="PATCH",le="+Inf"} 1', text
+        )
+        self.assertIn("casting_pool_checkouts ", text)
+        self.assertIn("casting_response_cache_hits ", text)
+        self.assertEqual(self.client.get("/metrics").status_code, 401)
+
+    def test_disabled_by_default(self):
+        """Test the default app is not instrumented"""
+        response = APP.test_client().get("/health/cache", headers=self.headers)
+
+        self.assertNotIn("Server-Timing", response.headers)
+        self.assertEqual(APP.test_client().get("/metrics").status_code, 404)
+
+
+class DiagnosticsTestCase(FileAppTestCase):
+    """This class represents the query diagnostics test case"""
+
+    def setUp(self):
+        """Create an app with a lazy-loading route."""
+        from sqlalchemy.orm import lazyload
+        from diagnostics import query_budget
+
+        super().setUp()
+        self.app.testing = True
+
+        @self.app.route("/casts")
+        @query_budget(2)
+        def casts():
+            movies = Movie.query.options(lazyload(Movie.actors)).all()
+            return {"casts": [len(movie.actors) for movie in movies]}
+
+        with self.app.app_context():
+            for number in range(6):
+                db.session.add(Movie(title=f"Secret {number}", release_date=None))
+                db.session.add(Actor(
+                    name="Actor", age=30, gender="Male", movie_id=number + 1
+                ))
+
+            db.session.commit()
+
+    def test_statement_shape(self):
+        """Test IN lists of any length share a shape"""
+        from diagnostics import statement_shape
+
+        self.assertEqual(
+            statement_shape("SELECT a\n  FROM t WHERE id IN (?, ?, ?)"),
+            statement_shape("SELECT a FROM t WHERE id IN (?)")
+        )
+        self.assertEqual(
+            statement_shape("SELECT a FROM t WHERE id IN (%(id_1)s, %(id_2)s)"),
+            "SELECT a FROM t WHERE id IN (?)"
+        )
+
+    def test_slow_queries_are_logged_redacted(self):
+        """Test slow statements are logged with their route, without values"""
+        with unittest.mock.patch("diagnostics.SLOW_QUERY_MS", 0), \
+                self.assertLogs("diagnostics", "WARNING") as logs:
+            self.client.get("/movies?title_prefix=Secret", headers=self.headers)
+
+        output = "\n".join(logs.output)
+
+        self.assertIn("Slow query", output)
+        self.assertIn("GET /movies: SELECT", output)
+        self.assertIn("movies.title < ? ORDER BY movies.id ASC ('str', 'str', 'str')", output)
+        self.assertNotIn("Secret", output)
+
+    def test_repeated_statements_are_flagged(self):
+        """Test a lazy load per row is reported as a possible N+1"""
+        self.app.testing = False
+
+        with self.assertLogs("diagnostics", "WARNING") as logs:
+            response = self.client.get("/casts")
+
+        self.assertEqual(response.get_json()["casts"], [1] * 6)
+        self.assertIn("Statement repeated 6 times, possible N+1, GET /casts", logs.output[0])
+        self.assertIn("over its budget of 2", logs.output[1])
+
+    def test_bulk_inserts_are_not_flagged(self):
+        """Test the row by row batches of one bulk INSERT are not an N+1"""
+        with self.assertNoLogs("diagnostics", "WARNING"):
+            response = self.client.post("/movies/bulk", headers=self.headers, json=[
+                {"title": f"Bulk {number}", "release_date": "2023-01-01"}
+                for number in range(10)
+            ])
+
+        self.assertEqual(response.status_code, 200)
+
+    def test_query_budget_fails_requests_in_test_mode(self):
+        """Test a request over its budget fails when testing"""
+        from diagnostics import QueryBudgetExceeded
+
+        with self.assertRaisesRegex(QueryBudgetExceeded, "GET /casts ran 7 statements"):
+            self.client.get("/casts")
+
+        self.assertEqual(
+            self.client.get("/movies?limit=20", headers=self.headers).status_code, 200
+        )
+
+
+class ReplicaTestCase(FileAppTestCase):
+    """This class represents the read replica routing test case"""
+
+    replicas = 1
+
+    def setUp(self):
+        """Create a primary and a replica with different rows."""
+        from replicas import ReplicaRouter
+
+        router = unittest.mock.patch("replicas.ROUTER", ReplicaRouter())
+        router.start()
+        self.addCleanup(router.stop)
+        super().setUp()
+
+        with self.app.app_context():
+            db.session.add(Movie(title="On primary", release_date=None))
+            db.session.commit()
+
+            with db.engines["replica_0"].begin() as connection:
+                connection.execute(Movie.__table__.insert(), {"title": "On replica"})
+
+    def titles(self, subject, client=None):
+        token = ISSUER.mint(PERMISSIONS, sub=subject)
+        response = (client or self.client).get(
+            "/movies", headers={"Authorization": "Bearer " + token}
+        )
+
+        return [movie["title"] for movie in response.get_json()["movies"]]
+
+    def test_reads_go_to_the_replica(self):
+        """Test GET handlers read from the replica"""
+        self.assertEqual(self.titles("reader"), ["On replica"])
+
+    def test_writers_read_their_writes(self):
+        """Test a writer reads from the primary for a short window"""
+        token = ISSUER.mint(PERMISSIONS, sub="writer")
+        response = self.client.post(
+            "/movies/bulk",
+            headers={"Authorization": "Bearer " + token},
+            json=[{"title": "Written", "release_date": "2023-01-01"}]
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.titles("writer"), ["On primary", "Written"])
+        self.assertEqual(self.titles("reader", self.app.test_client()), ["On replica"])
+
+    def test_other_workers_read_the_writes_of_a_client(self):
+        """Test the primary cookie makes any worker read from the primary"""
+        from replicas import PRIMARY_COOKIE, ReplicaRouter
+
+        self.client.post(
+            "/movies/bulk", headers={"Authorization": "Bearer " + ISSUER.mint(PERMISSIONS)},
+            json=[{"title": "Written", "release_date": "2023-01-01"}]
+        )
+
+        with unittest.mock.patch("replicas.ROUTER", ReplicaRouter()):
+            self.assertEqual(self.titles("writer"), ["On primary", "Written"])
+
+            client = self.app.test_client()
+            client.set_cookie(PRIMARY_COOKIE, "1e300")
+            self.assertEqual(self.titles("writer", client), ["On replica"])
+
+    def test_unhealthy_replica_falls_back_to_the_primary(self):
+        """Test a failing replica is skipped"""
+        with self.app.app_context():
+            db.engines["replica_0"].dispose()
+            os.remove(f"{self.directory.name}/replica_0.db")
+            os.mkdir(f"{self.directory.name}/replica_0.db")
+
+        self.assertEqual(self.titles("reader"), ["On primary"])
+        self.assertEqual(self.titles("reader"), ["On primary"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,225 @@
+"""
+    File for testing the ASGI entry point against aiosqlite
+"""
+
+
+import os
+import json
+import asyncio
+import tempfile
+import unittest
+import unittest.mock
+
+os.environ.setdefault("AUTH0_DOMAIN", "casting.local")
+os.environ.setdefault("ALGORITHMS", "RS256")
+os.environ.setdefault("API_AUDIENCE", "casting")
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import auth
+import ratelimit
+from auth import JWKSStore
+from local_issuer import LocalIssuer
+from asgi import async_url, create_asgi_app
+
+PERMISSIONS = [
+    "get:movie", "post:movie", "patch:movie", "delete:movie",
+    "get:actor", "post:actor", "patch:actor", "delete:actor", "get:health"
+]
+
+
+ISSUER = LocalIssuer(bits=1024)
+
+
+def setUpModule():
+    """Serve the keys of the local issuer for the whole module."""
+    auth.JWKS_STORE = JWKSStore(ISSUER.serve())
+
+
+def tearDownModule():
+    ISSUER.stop()
+
+
+async def call(app, method, path, headers=None, body=None):
+    """Send one HTTP request to an ASGI app and collect the response."""
+    query = b""
+
+    if "?" in path:
+        path, query = path.split("?", 1)
+        query = query.encode()
+
+    raw = json.dumps(body).encode() if body is not None else b""
+    headers = [
+        (name.lower().encode(), value.encode())
+        for name, value in (headers or {}).items()
+    ] + [(b"content-type", b"application/json")]
+    scope = {
+        "type": "http",
+        "method": method,
+        "path": path,
+        "query_string": query,
+        "headers": headers,
+        "http_version": "1.1",
+        "scheme": "http",
+        "server": ("testserver", 80)
+    }
+    received = [{"type": "http.request", "body": raw, "more_body": False}]
+    messages = []
+
+    async def receive():
+        return received.pop(0)
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+
+    return (
+        messages[0]["status"],
+        dict(messages[0]["headers"]),
+        [message["body"] for message in messages[1:] if message["body"]]
+    )
+
+
+class ASGITestCase(unittest.TestCase):
+    """This class represents the ASGI entry point test case"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.app = create_asgi_app(f"sqlite:///{cls.directory.name}/asgi.db")
+        cls.headers = {"Authorization": "Bearer " + ISSUER.mint(PERMISSIONS)}
+
+    @classmethod
+    def tearDownClass(cls):
+        asyncio.run(cls.app.engine.dispose())
+        cls.directory.cleanup()
+
+    def setUp(self):
+        """Reset the database."""
+        from cache import invalidate
+        from models import db
+
+        with self.app.app.app_context():
+            db.drop_all(bind_key=None)
+            db.create_all(bind_key=None)
+
+        invalidate(("movies", "actors"))
+
+    def request(self, method, path, body=None, headers=None):
+        status, _, chunks = asyncio.run(
+            call(self.app, method, path, headers or self.headers, body)
+        )
+
+        return status, json.loads(b"".join(chunks))
+
+    def test_async_url(self):
+        """Test database urls are switched to asyncio drivers"""
+        self.assertEqual(async_url("sqlite:///a.db"), "sqlite+aiosqlite:///a.db")
+        self.assertEqual(
+            async_url("postgresql://user:secret@db/casting"),
+            "postgresql+asyncpg://user:secret@db/casting"
+        )
+        self.assertEqual(async_url("sqlite+aiosqlite://"), "sqlite+aiosqlite://")
+
+    def test_same_routes_and_error_handlers(self):
+        """Test writes, reads and errors behave as over WSGI"""
+        status, data = self.request("POST", "/movies/bulk", [
+            {"title": "Alien", "release_date": "1979-05-25"}
+        ])
+        self.assertEqual((status, data["created"]), (200, [1]))
+
+        status, data = self.request("PATCH", "/movies/1", {"title": "Aliens"})
+        self.assertEqual((status, data["updated"]["title"]), (200, "Aliens"))
+
+        status, data = self.request("GET", "/movies?limit=1")
+        self.assertEqual(status, 200)
+        self.assertEqual(data["movies"][0]["title"], "Aliens")
+
+        status, data = self.request("DELETE", "/movies/7")
+        self.assertEqual((status, data["error"]), (404, 404))
+
+        status, data = self.request("GET", "/movies", headers={"Authorization": "Bearer x"})
+        self.assertEqual((status, data["message"]), (401, "Invalid token."))
+
+    def test_requests_never_wait_for_a_slot(self):
+        """Test the app has its own limiter, leaving CONCURRENCY_WAIT alone"""
+        limiter = self.app.app.extensions["concurrency_limiter"]
+
+        self.assertEqual(limiter.wait, 0)
+        self.assertIsNot(limiter, ratelimit.CONCURRENCY_LIMITER)
+        self.assertEqual(limiter.limit, ratelimit.CONCURRENCY_LIMITER.limit)
+
+    def test_statements_run_on_the_async_engine(self):
+        """Test the request sessions use the pool of the async engine"""
+        self.request("GET", "/movies")
+        status, data = self.request("GET", "/health/pool")
+
+        self.assertEqual(status, 200)
+        self.assertEqual(data["pool"]["pool"], "InstrumentedAsyncQueuePool")
+        self.assertGreater(data["pool"]["checkouts"], 0)
+
+    def test_concurrent_requests(self):
+        """Test many requests in flight share one event loop"""
+        self.request("POST", "/movies/bulk", [
+            {"title": "Alien", "release_date": "1979-05-25"}
+        ])
+        self.request("POST", "/actors/bulk", [
+            {"name": f"Actor {number}", "age": 30, "gender": "Male", "movie_id": 1}
+            for number in range(5)
+        ])
+
+        async def run():
+            return await asyncio.gather(*(
+                call(self.app, "GET", f"/actors?limit={number + 1}", self.headers)
+                for number in range(20)
+            ))
+
+        responses = asyncio.run(run())
+
+        self.assertEqual({status for status, _, _ in responses}, {200})
+        self.assertEqual(
+            [len(json.loads(b"".join(chunks))["actors"]) for _, _, chunks in responses],
+            [min(number + 1, 5) for number in range(20)]
+        )
+
+    def test_streamed_response(self):
+        """Test streamed lists are sent chunk by chunk"""
+        self.request("POST", "/movies/bulk", [
+            {"title": f"Movie {number}", "release_date": "2000-01-01"}
+            for number in range(7)
+        ])
+
+        with unittest.mock.patch("streaming.STREAM_CHUNK_SIZE", 3):
+            status, _, chunks = asyncio.run(
+                call(self.app, "GET", "/movies?stream=true", self.headers)
+            )
+
+        self.assertEqual(status, 200)
+        self.assertEqual(len(chunks), 5)
+        self.assertEqual(len(json.loads(b"".join(chunks))["movies"]), 7)
+
+    def test_key_fetch_does_not_block_the_loop(self):
+        """Test other requests are served while a key set is fetched"""
+        issuer = LocalIssuer(kid="rotated-key", bits=1024)
+        finished = []
+
+        async def timed(name, path, headers):
+            status, _, _ = await call(self.app, "GET", path, headers)
+            finished.append((name, status))
+
+        async def run():
+            await asyncio.gather(
+                timed("fetch", "/movies", {
+                    "Authorization": "Bearer " + issuer.mint(PERMISSIONS)
+                }),
+                timed("health", "/health/cache", self.headers)
+            )
+
+        try:
+            with unittest.mock.patch("auth.JWKS_STORE", JWKSStore(issuer.serve())):
+                issuer.delay = 0.5
+                asyncio.run(run())
+        finally:
+            issuer.stop()
+
+        self.assertEqual(finished, [("health", 200), ("fetch", 200)])
@@ -0,0 +1,294 @@
+"""
+    File for testing the authentication against a local issuer
+"""
+
+
+import os
+import threading
+import unittest
+import unittest.mock
+
+os.environ.setdefault("AUTH0_DOMAIN", "casting.local")
+os.environ.setdefault("ALGORITHMS", "RS256")
+os.environ.setdefault("API_AUDIENCE", "casting")
+
+import auth
+from auth import (
+    AuthError, JWKSStore, TokenCache, parse_max_age, verify_decode_jwt
+)
+from local_issuer import LocalIssuer
+from ratelimit import (
+    AdmissionError, ConcurrencyLimiter, MemoryRateLimitBackend, parse_limits,
+    rate_limit
+)
+
+
+class FakeClock:
+    """Manually advanced monotonic clock"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class JWKSStoreTestCase(unittest.TestCase):
+    """This class represents the JWKS store test case"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Start the local issuer once, key generation is slow."""
+        cls.issuer = LocalIssuer()
+        cls.jwks_url = cls.issuer.serve()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.issuer.stop()
+
+    def setUp(self):
+        """Reset the issuer and build a fresh store."""
+        self.issuer.fail = False
+        self.issuer.delay = 0
+        self.issuer.cache_control = "max-age=600"
+        self.issuer.jwks_requests = 0
+        self.clock = FakeClock()
+        self.store = JWKSStore(
+            self.jwks_url,
+            min_refresh_interval=30,
+            clock=self.clock
+        )
+
+    def test_parse_max_age(self):
+        """Test reading max-age from Cache-Control"""
+        self.assertEqual(parse_max_age("public, max-age=15, stale-if-error=60", 600), 15)
+        self.assertEqual(parse_max_age("no-store", 600), 0)
+        self.assertEqual(parse_max_age("public", 600), 600)
+        self.assertEqual(parse_max_age(None, 600), 600)
+
+    def test_keys_are_cached(self):
+        """Test the key set is fetched once and keys are parsed once"""
+        key = self.store.get_key(self.issuer.kid)
+
+        self.assertIsNotNone(key)
+        self.assertIs(self.store.get_key(self.issuer.kid), key)
+        self.assertEqual(self.issuer.jwks_requests, 1)
+        self.assertEqual(self.store.stats["hits"], 1)
+        self.assertEqual(self.store.stats["misses"], 1)
+        self.assertEqual(self.store.stats["refreshes"], 1)
+
+    def test_cache_control_max_age(self):
+        """Test the keys expire after the max-age of the response"""
+        self.issuer.cache_control = "public, max-age=60"
+        self.store.get_key(self.issuer.kid)
+
+        self.clock.now += 59
+        self.store.get_key(self.issuer.kid)
+        self.assertEqual(self.issuer.jwks_requests, 1)
+
+        self.clock.now += 2
+        self.store.get_key(self.issuer.kid)
+        self.assertEqual(self.issuer.jwks_requests, 2)
+
+    def test_unknown_kid_refresh_is_rate_limited(self):
+        """Test unknown kids do not hammer the issuer"""
+        self.store.get_key(self.issuer.kid)
+
+        self.assertIsNone(self.store.get_key("rotated"))
+        self.assertIsNone(self.store.get_key("rotated"))
+        self.assertEqual(self.issuer.jwks_requests, 1)
+
+        self.clock.now += 31
+        self.assertIsNone(self.store.get_key("rotated"))
+        self.assertEqual(self.issuer.jwks_requests, 2)
+
+    def test_concurrent_refreshes_are_collapsed(self):
+        """Test a cold store fetches once for many concurrent callers"""
+        self.issuer.delay = 0.2
+        results = []
+
+        def get_key():
+            results.append(self.store.get_key(self.issuer.kid))
+
+        threads = [threading.Thread(target=get_key) for _ in range(8)]
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.issuer.jwks_requests, 1)
+        self.assertEqual(len(results), 8)
+        self.assertTrue(all(key is results[0] for key in results))
+
+    def test_stale_keys_are_served_when_fetch_fails(self):
+        """Test an issuer outage does not lock everyone out"""
+        key = self.store.get_key(self.issuer.kid)
+
+        self.issuer.fail = True
+        self.clock.now += 601
+
+        self.assertIs(self.store.get_key(self.issuer.kid), key)
+        self.assertIs(self.store.get_key(self.issuer.kid), key)
+        self.assertEqual(self.store.stats["refresh_failures"], 1)
+        self.assertEqual(self.store.stats["stale_hits"], 1)
+
+    def test_verify_decode_jwt(self):
+        """Test tokens are verified with the cached keys"""
+        original_store = auth.JWKS_STORE
+        auth.JWKS_STORE = self.store
+
+        try:
+            token = self.issuer.mint(["get:movie"])
+            payload = verify_decode_jwt(token)
+            verify_decode_jwt(token)
+
+            self.assertEqual(payload["permissions"], ["get:movie"])
+            self.assertEqual(self.issuer.jwks_requests, 1)
+
+            with self.assertRaises(AuthError):
+                verify_decode_jwt(self.issuer.mint([], expires_in=-60))
+        finally:
+            auth.JWKS_STORE = original_store
+
+
+class TokenCacheTestCase(unittest.TestCase):
+    """This class represents the verified token cache test case"""
+
+    def setUp(self):
+        """Build a cache around a counting verifier."""
+        self.clock = FakeClock()
+        self.cache = TokenCache(max_size=2, max_ttl=300, clock=self.clock)
+        self.verified = []
+
+    def verify(self, token):
+        self.verified.append(token)
+        return {"sub": token, "exp": self.clock.now + 100, "permissions": []}
+
+    def test_repeat_tokens_are_verified_once(self):
+        """Test a repeat token is served from the cache"""
+        payload = self.cache.verify("a", self.verify)
+
+        self.assertIs(self.cache.verify("a", self.verify), payload)
+        self.assertEqual(self.verified, ["a"])
+        self.assertEqual(self.cache.stats["hits"], 1)
+        self.assertEqual(self.cache.stats["hit_ratio"], 0.5)
+
+    def test_entries_expire_with_the_token(self):
+        """Test a payload is not served past the exp claim"""
+        self.cache.verify("a", self.verify)
+        self.clock.now += 101
+        self.cache.verify("a", self.verify)
+
+        self.assertEqual(self.verified, ["a", "a"])
+
+    def test_least_recently_used_entry_is_evicted(self):
+        """Test the cache stays bounded"""
+        self.cache.verify("a", self.verify)
+        self.cache.verify("b", self.verify)
+        self.cache.verify("a", self.verify)
+        self.cache.verify("c", self.verify)
+        self.cache.verify("a", self.verify)
+        self.cache.verify("b", self.verify)
+
+        self.assertEqual(self.verified, ["a", "b", "c", "b"])
+        self.assertEqual(self.cache.stats["size"], 2)
+
+    def test_failed_verifications_are_not_cached(self):
+        """Test invalid tokens are verified every time"""
+        def reject(token):
+            self.verified.append(token)
+            raise AuthError({"code": "invalid_token"}, 401)
+
+        for _ in range(2):
+            with self.assertRaises(AuthError):
+                self.cache.verify("bad", reject)
+
+        self.assertEqual(self.verified, ["bad", "bad"])
+        self.assertEqual(self.cache.stats["size"], 0)
+
+
+class RateLimitTestCase(unittest.TestCase):
+    """This class represents the admission control test case"""
+
+    def test_parse_limits(self):
+        """Test RATE_LIMITS items, with and without a burst"""
+        self.assertEqual(parse_limits(""), {})
+        self.assertEqual(
+            parse_limits("*=20:40, get:movie=5"),
+            {"*": (20.0, 40.0), "get:movie": (5.0, 5.0)}
+        )
+
+        for value in ("get:movie", "*=0", "*=fast", "*=2:0.5"):
+            with self.assertRaises(ValueError):
+                parse_limits(value)
+
+    def test_token_bucket(self):
+        """Test the burst is served, then the rate"""
+        clock = FakeClock()
+        backend = MemoryRateLimitBackend(clock=clock)
+
+        self.assertEqual([backend.acquire("a", 2, 3) for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(backend.acquire("a", 2, 3), 0.5)
+        self.assertEqual(backend.acquire("b", 2, 3), 0)
+
+        clock.now += 0.5
+        self.assertEqual(backend.acquire("a", 2, 3), 0)
+        self.assertGreater(backend.acquire("a", 2, 3), 0)
+
+        clock.now += 60
+        self.assertEqual([backend.acquire("a", 2, 3) for _ in range(3)], [0, 0, 0])
+        self.assertEqual(backend.stats(), {"buckets": 2, "limited": 2})
+
+    def test_buckets_are_bounded(self):
+        """Test the least recently used buckets are dropped"""
+        backend = MemoryRateLimitBackend(max_keys=2, clock=FakeClock())
+
+        for key in "abcb":
+            backend.acquire(key, 1, 1)
+
+        self.assertEqual(list(backend._buckets), ["c", "b"])
+
+    def test_buckets_are_keyed_by_caller(self):
+        """Test callers without a sub claim do not share one bucket"""
+        backend = MemoryRateLimitBackend(clock=FakeClock())
+
+        with unittest.mock.patch("ratelimit.RATE_LIMITS", {"*": (1, 1)}), \
+                unittest.mock.patch("ratelimit.RATE_LIMITER", backend):
+            rate_limit("get:movie", {"sub": "auth0|a"})
+            rate_limit("get:movie", {"azp": "client-a"})
+            rate_limit("get:movie", {"client_id": "client-b"})
+
+            for _ in range(3):
+                rate_limit("get:movie", {})
+
+            with self.assertRaises(AdmissionError):
+                rate_limit("get:actor", {"azp": "client-a"})
+
+        self.assertEqual(
+            list(backend._buckets), ["auth0|a *", "client-b *", "client-a *"]
+        )
+
+    def test_concurrency_limit(self):
+        """Test requests past the limit are shed until a slot is free"""
+        limiter = ConcurrencyLimiter(2)
+
+        with limiter, limiter:
+            with self.assertRaises(AdmissionError) as refused:
+                with limiter:
+                    pass
+
+            self.assertEqual(limiter.stats(), {"limit": 2, "active": 2, "shed": 1})
+
+        self.assertEqual(refused.exception.status_code, 503)
+        self.assertEqual(refused.exception.retry_after, 1)
+
+        with limiter:
+            self.assertEqual(limiter.stats()["active"], 1)
+
+        with ConcurrencyLimiter(0), ConcurrencyLimiter(0):
+            pass
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+"""
+    File for testing the connection pool configuration and statistics
+"""
+
+
+import os
+import tempfile
+import threading
+import unittest
+import unittest.mock
+
+from sqlalchemy import create_engine, exc, text
+from pool import InstrumentedQueuePool, engine_options, pool_stats
+
+
+class PoolTestCase(unittest.TestCase):
+    """This class represents the connection pool test case"""
+
+    def setUp(self):
+        """Create a file database."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.url = f"sqlite:///{self.directory.name}/pool.db"
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_engine_options_from_environment(self):
+        """Test the pool is sized from the environment"""
+        with unittest.mock.patch.dict(os.environ, {
+            "DB_POOL_SIZE": "20",
+            "DB_MAX_OVERFLOW": "0",
+            "DB_POOL_PRE_PING": "false"
+        }):
+            options = engine_options("postgresql://localhost/casting")
+
+        self.assertIs(options["poolclass"], InstrumentedQueuePool)
+        self.assertEqual(options["pool_size"], 20)
+        self.assertEqual(options["max_overflow"], 0)
+        self.assertFalse(options["pool_pre_ping"])
+
+    def test_in_memory_sqlite_keeps_its_pool(self):
+        """Test in-memory SQLite gets no queue pool options"""
+        self.assertNotIn("pool_size", engine_options("sqlite://"))
+
+    def test_pool_statistics(self):
+        """Test checkouts, overflow, waits and new connections are recorded"""
+        engine = create_engine(self.url, **dict(
+            engine_options(self.url), pool_size=1, max_overflow=1, pool_timeout=0.2
+        ))
+
+        first = engine.connect()
+        second = engine.connect()
+        stats = pool_stats(engine)
+
+        self.assertEqual(stats["checked_out"], 2)
+        self.assertEqual(stats["overflow"], 1)
+        self.assertEqual(stats["connections_created"], 2)
+
+        with self.assertRaises(exc.TimeoutError):
+            engine.connect()
+
+        released = threading.Timer(0.05, second.close)
+        released.start()
+
+        with engine.connect() as third:
+            third.execute(text("SELECT 1"))
+
+        released.join()
+        first.close()
+        stats = pool_stats(engine)
+
+        self.assertEqual(stats["checked_out"], 0)
+        self.assertEqual(stats["checkout_timeouts"], 1)
+        self.assertGreaterEqual(stats["checkout_wait_seconds_max"], 0.04)
+        self.assertEqual(stats["checkouts"], 3)
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    unittest.main()